@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster activity analytics: bouts, speed, distance & frequency histograms
+# computed with numpy from the revolution timestamps (in seconds)
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import sys
+import json
+import time
+import datetime
+import numpy as np
+import tsstore
+
+# Same meaning as in the device programs, in seconds
+TIME_LIMIT = 0.4		# magnet-counter.py: shorter crossings are bounces
+INTERVAL_DELAY = 2.5		# magnet-collector.py: a longer pause ends a bout
+HIST_DELTA = 0.01		# magnet-histogram.py: bin width in Hz
+HIST_STEPS = 250
+WHEEL_DIAMETER = 0.23		# m, the sheets use =L*pi()*0.23
+WHEEL_LENGTH = np.pi * WHEEL_DIAMETER
+NIGHT_START_HOUR = 12		# nights are split at noon as the day logs
+
+BOUT_DTYPE = np.dtype([('start', '<f8'),
+                       ('end', '<f8'),
+                       ('revolutions', '<i8'),
+                       ('distance', '<f8'),
+                       ('speed', '<f8')])
+
+# Revolution times from store records: the device clock (ms since boot)
+# is more precise than the arrival time, so it is used for the intervals
+# and aligned to the host clock separately after every device reset.
+def event_times(records):
+    if not len(records):
+        return np.empty(0)
+    device_ts = records['ts'].astype(np.float64) / 1000.0
+    local_ts = records['local_ts']
+    boots = np.concatenate(([0], np.cumsum(np.diff(device_ts) < 0)))
+    result = np.empty(len(records))
+    for boot in range(boots[-1] + 1):
+        mask = boots == boot
+        result[mask] = device_ts[mask] + np.median(local_ts[mask] - device_ts[mask])
+    return result
+
+def debounce(times, time_limit=TIME_LIMIT):
+    times = np.sort(np.asarray(times, dtype=np.float64))
+    if len(times) < 2:
+        return times
+    keep = np.ones(len(times), dtype=bool)
+    keep[1:] = np.diff(times) > time_limit
+    return times[keep]
+
+# The summary sheet column =C{i+1}-C{i}: revolutions between summaries
+def summary_deltas(num):
+    num = np.asarray(num, dtype=np.int64)
+    if not len(num):
+        return num
+    deltas = np.diff(num, prepend=num[0])
+    # a device reset restarts the counter
+    return np.where(deltas < 0, num, deltas)
+
+def distance(revolutions, wheel_length=WHEEL_LENGTH):
+    return np.round(np.asarray(revolutions) * wheel_length, 1)
+
+def bouts(times, gap=INTERVAL_DELAY, wheel_length=WHEEL_LENGTH):
+    times = np.asarray(times, dtype=np.float64)
+    if not len(times):
+        return np.empty(0, BOUT_DTYPE)
+    breaks = np.nonzero(np.diff(times) > gap)[0]
+    first = np.concatenate(([0], breaks + 1))
+    last = np.concatenate((breaks, [len(times) - 1]))
+    result = np.empty(len(first), BOUT_DTYPE)
+    result['start'] = times[first]
+    result['end'] = times[last]
+    result['revolutions'] = last - first + 1
+    result['distance'] = result['revolutions'] * wheel_length
+    duration = result['end'] - result['start']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result['speed'] = np.where(duration > 0, (last - first) * wheel_length / duration, 0.0)
+    return result
+
+# Speed in m/s at the middle of every revolution within a bout
+def speed(times, gap=INTERVAL_DELAY, wheel_length=WHEEL_LENGTH):
+    times = np.asarray(times, dtype=np.float64)
+    intervals = np.diff(times)
+    running = (intervals > 0) & (intervals <= gap)
+    mid = (times[:-1] + times[1:])[running] / 2.0
+    return mid, wheel_length / intervals[running]
+
+# Revolution frequency histogram as on the device, or over the given
+# bin edges in Hz
+def frequency_histogram(times, delta=HIST_DELTA, steps=HIST_STEPS, edges=None,
+                        time_limit=TIME_LIMIT):
+    intervals = np.diff(np.asarray(times, dtype=np.float64))
+    intervals = intervals[intervals > time_limit]
+    freq = 1.0 / intervals
+    if edges is not None:
+        counts, edges = np.histogram(freq, edges)
+        return edges[:-1], counts
+    index = np.minimum((freq / delta).astype(np.int64), steps - 1)
+    return np.arange(steps) * delta, np.bincount(index, minlength=steps)
+
+def night_bounds(start, end, hour=NIGHT_START_HOUR):
+    day = datetime.date.fromtimestamp(start) - datetime.timedelta(days=1)
+    bounds = []
+    while True:
+        t = time.mktime(datetime.datetime(day.year, day.month, day.day, hour).timetuple())
+        bounds.append(t)
+        if t > end:
+            break
+        day += datetime.timedelta(days=1)
+    return np.array(bounds)
+
+# Revolutions & distance for every night (noon to noon) in the range
+def nights(times, start, end, hour=NIGHT_START_HOUR, wheel_length=WHEEL_LENGTH):
+    times = np.asarray(times, dtype=np.float64)
+    bounds = night_bounds(start, end, hour)
+    counts = np.diff(np.searchsorted(times, bounds))
+    used = counts > 0
+    labels = [datetime.date.fromtimestamp(t).strftime('%d.%m') for t in bounds[:-1][used]]
+    return labels, counts[used], counts[used] * wheel_length
+
+def analyze(times, start, end, edges=None, revolutions=None):
+    times = debounce(times)
+    if revolutions is None:
+        revolutions = len(times)
+    b = bouts(times)
+    _, v = speed(times)
+    labels, night_revolutions, dist = nights(times, start, end)
+    hist_bins, hist = frequency_histogram(times, edges=edges)
+    return {'revolutions': int(revolutions),
+            'distance': float(distance(revolutions)),
+            'bouts': {'count': len(b),
+                      'longest': float((b['end'] - b['start']).max()) if len(b) else 0.0,
+                      'mean_revolutions': float(b['revolutions'].mean()) if len(b) else 0.0},
+            'speed': {'mean': float(v.mean()) if len(v) else 0.0,
+                      'p50': float(np.percentile(v, 50)) if len(v) else 0.0,
+                      'p95': float(np.percentile(v, 95)) if len(v) else 0.0,
+                      'max': float(v.max()) if len(v) else 0.0},
+            'nights': {label: {'revolutions': int(r), 'distance': round(float(d), 1)}
+                       for label, r, d in zip(labels, night_revolutions, dist)},
+            'histogram': {'{:.2f}'.format(f): int(c) for f, c in zip(hist_bins, hist) if c}}
+
+def analyze_store(store, device, start, end, edges=None):
+    records = store.query(device, start, end, tsstore.KIND_EVENT)
+    # lost radio packets still advance the device counter
+    return analyze(event_times(records), start, end, edges,
+                   store.revolutions(device, start, end))
+
+def usage():
+    sys.stderr.write('Hamster activity analytics\n'
+                     'Usage: {} <store> <device> <from> <to>\n'
+                     '\tTimes are "YYYY-MM-DD HH:MM"\n'.format(sys.argv[0]))
+    exit(1)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 5:
+        usage()
+    try:
+        t1, t2 = (time.mktime(time.strptime(t, '%Y-%m-%d %H:%M')) for t in sys.argv[3:5])
+    except ValueError:
+        usage()
+    print(json.dumps(analyze_store(tsstore.TimeSeriesStore(sys.argv[1]), sys.argv[2], t1, t2),
+                     indent=2))
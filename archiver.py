@@ -0,0 +1,271 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: past days archiver & transparent day file reader
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import queue
+import shutil
+import tarfile
+import hashlib
+import threading
+from wal import WAL_NAME, SNAP_NAME
+from debug import dprint, error
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_NONE = 'none'
+COMPRESSION_GZIP = 'gz'
+COMPRESSION_XZ = 'xz'
+COMPRESSION_ZSTD = 'zst'
+COMPRESSIONS = (COMPRESSION_GZIP, COMPRESSION_XZ, COMPRESSION_ZSTD)
+
+DAY_DIR_RE = re.compile(r'^\d\d\.\d\d$')
+ARCHIVE_TEMPLATE = '{}/{}.tar.{}'
+MANIFEST_TEMPLATE = '{}/{}.manifest.json'
+
+class ArchiverException(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+
+def check_compression(compression):
+    if compression not in COMPRESSIONS:
+        raise ArchiverException('unknown compression {}'.format(compression))
+    if compression == COMPRESSION_ZSTD and zstandard is None:
+        raise ArchiverException('zstandard module is required for the zst compression')
+
+def is_day_dir(name):
+    return DAY_DIR_RE.match(name) is not None
+
+def list_days(datadir):
+    days = set()
+    for name in os.listdir(datadir):
+        if is_day_dir(name) and os.path.isdir(os.path.join(datadir, name)):
+            days.add(name)
+        else:
+            for compression in COMPRESSIONS:
+                postfix = '.tar.' + compression
+                if name.endswith(postfix) and is_day_dir(name[:-len(postfix)]):
+                    days.add(name[:-len(postfix)])
+    return sorted(days)
+
+def find_archive(datadir, date):
+    for compression in COMPRESSIONS:
+        path = ARCHIVE_TEMPLATE.format(datadir, date, compression)
+        if os.path.exists(path):
+            return path, compression
+    return None, None
+
+def __open_archive(path, compression):
+    if compression == COMPRESSION_ZSTD:
+        check_compression(compression)
+        f = open(path, 'rb')
+        return tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(f), mode='r|')
+    return tarfile.open(path, 'r:' + compression)
+
+def read_day_file(datadir, date, name):
+    path = '{}/{}/{}'.format(datadir, date, name)
+    if os.path.exists(path):
+        f = open(path, 'rb')
+        data = f.read()
+        f.close()
+        return data
+    archive, compression = find_archive(datadir, date)
+    if archive is None:
+        return None
+    tar = __open_archive(archive, compression)
+    try:
+        for member in tar:
+            if member.name == name and member.isfile():
+                return tar.extractfile(member).read()
+    finally:
+        tar.close()
+    return None
+
+# Names of the files of a day either in the day dir or in the day archive
+def list_day_files(datadir, date):
+    daydir = '{}/{}'.format(datadir, date)
+    if os.path.isdir(daydir):
+        return sorted(name for name in os.listdir(daydir)
+                      if os.path.isfile(os.path.join(daydir, name)))
+    archive, compression = find_archive(datadir, date)
+    if archive is None:
+        return []
+    tar = __open_archive(archive, compression)
+    try:
+        return sorted(member.name for member in tar if member.isfile())
+    finally:
+        tar.close()
+
+# Opens a file of a day either in the day dir or in the day archive
+def open_day_file(datadir, date, name):
+    data = read_day_file(datadir, date, name)
+    if data is None:
+        raise FileNotFoundError('no {} for {} in {}'.format(name, date, datadir))
+    return io.StringIO(data.decode('utf-8', 'replace'))
+
+def write_archive(datadir, date, compression):
+    check_compression(compression)
+    daydir = '{}/{}'.format(datadir, date)
+    path = ARCHIVE_TEMPLATE.format(datadir, date, compression)
+    tmppath = path + '.tmp'
+    files = []
+    f = open(tmppath, 'wb')
+    try:
+        stream = f
+        if compression == COMPRESSION_ZSTD:
+            stream = zstandard.ZstdCompressor().stream_writer(f, closefd=False)
+            tar = tarfile.open(fileobj=stream, mode='w|')
+        else:
+            tar = tarfile.open(fileobj=f, mode='w:' + compression)
+        for name in sorted(os.listdir(daydir)):
+            filepath = os.path.join(daydir, name)
+            if not os.path.isfile(filepath) or name.endswith('.tmp'):
+                continue
+            src = open(filepath, 'rb')
+            data = src.read()
+            src.close()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = os.path.getmtime(filepath)
+            tar.addfile(info, io.BytesIO(data))
+            files.append({'name': name,
+                          'size': len(data),
+                          'lines': data.count(b'\n'),
+                          'sha256': hashlib.sha256(data).hexdigest()})
+        tar.close()
+        if stream is not f:
+            stream.close()
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.replace(tmppath, path)
+    manifest = {'date': date,
+                'archive': os.path.basename(path),
+                'compression': compression,
+                'created': time.time(),
+                'size': os.path.getsize(path),
+                'files': files}
+    manifest_path = MANIFEST_TEMPLATE.format(datadir, date)
+    mf = open(manifest_path + '.tmp', 'w')
+    json.dump(manifest, mf, indent=2)
+    mf.close()
+    os.replace(manifest_path + '.tmp', manifest_path)
+    shutil.rmtree(daydir)
+    return manifest
+
+class DayArchiver(object):
+
+    QUEUE_SIZE = 64
+
+    def __init__(self, datadir, compression=COMPRESSION_GZIP, uploader=None):
+        check_compression(compression)
+        self.__datadir = datadir
+        self.compression = compression
+        self.__uploader = uploader
+        self.__queued = set()
+        self.__queue = queue.Queue(self.QUEUE_SIZE)
+        self.__thread = threading.Thread(target=self.__run,
+                                         name='day-archiver',
+                                         daemon=True)
+        self.__thread.start()
+
+    # a day with the write-ahead log state is still open or was not closed
+    def __is_open(self, date):
+        daydir = os.path.join(self.__datadir, date)
+        return any(os.path.exists(os.path.join(daydir, name)) for name in (WAL_NAME, SNAP_NAME))
+
+    # archives all the closed day dirs except the current one in the background
+    def archive_past(self, current_date):
+        for name in os.listdir(self.__datadir):
+            if name == current_date or name in self.__queued or not is_day_dir(name):
+                continue
+            if not os.path.isdir(os.path.join(self.__datadir, name)):
+                continue
+            if self.__is_open(name):
+                dprint('day {} has the day state, not archiving it'.format(name))
+                continue
+            try:
+                self.__queue.put_nowait(name)
+                self.__queued.add(name)
+            except queue.Full:
+                break
+
+    def pending(self):
+        return self.__queue.qsize()
+
+    def __archive(self, date):
+        # the uploader may still be syncing the finished day
+        if self.__uploader is not None:
+            self.__uploader.wait()
+        if find_archive(self.__datadir, date)[0] is not None:
+            error('archive for {} already exists, keeping the day dir', date)
+            return
+        if self.__is_open(date):
+            return
+        manifest = write_archive(self.__datadir, date, self.compression)
+        dprint('archived {} files of {} into {} bytes'.format(len(manifest['files']),
+                                                             date,
+                                                             manifest['size']))
+
+    def __run(self):
+        while True:
+            date = self.__queue.get()
+            try:
+                if date is None:
+                    break
+                self.__archive(date)
+            except (OSError, tarfile.TarError, ArchiverException) as e:
+                error('error while archiving {}: {}', date, e)
+            finally:
+                self.__queued.discard(date)
+                self.__queue.task_done()
+
+    def close(self, timeout=None):
+        if not self.__thread.is_alive():
+            return
+        self.__queue.put(None)
+        self.__thread.join(timeout)
+
+def usage():
+    dprint('Hamster data archiver')
+    dprint('Usage: {} <command> [args]'.format(sys.argv[0]))
+    dprint('Commands:')
+    dprint('\tarchive <datadir> <date> [compression]\tArchive a day dir '
+           '({}, default {})'.format('/'.join(COMPRESSIONS), COMPRESSION_GZIP))
+    dprint('\tlist <datadir>\tList the days in the data dir')
+    dprint('\tcat <datadir> <date> <file>\tPrint a day file, archived or not')
+    exit(1)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        usage()
+    command = sys.argv[1]
+    try:
+        if command == 'archive' and len(sys.argv) in (4, 5):
+            result = write_archive(sys.argv[2], sys.argv[3],
+                                   sys.argv[4] if len(sys.argv) == 5 else COMPRESSION_GZIP)
+            print(json.dumps(result, indent=2))
+        elif command == 'list' and len(sys.argv) == 3:
+            for day in list_days(sys.argv[2]):
+                print(day)
+        elif command == 'cat' and len(sys.argv) == 5:
+            sys.stdout.write(open_day_file(sys.argv[2], sys.argv[3], sys.argv[4]).read())
+        else:
+            usage()
+    except (OSError, tarfile.TarError, ArchiverException) as e:
+        error('error: {}', e)
+        exit(1)
@@ -0,0 +1,378 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: ingest throughput & latency benchmark
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+DEFAULT_DEVICES = (1, 10, 100)
+DEFAULT_FRAMES = 20000
+CHUNK_SIZE = 4096
+SUMMARY_EVERY = 50
+REGRESSION_THRESHOLD = 0.1
+
+def device_name(i):
+    return chr(0x21 + i)
+
+def make_payload(ts, num, temp=20.5, light=3.25):
+    data = (ts.to_bytes(4, 'little') +
+            num.to_bytes(2, 'little') +
+            int(temp).to_bytes(2, 'little') +
+            int((temp - int(temp)) * 1000000).to_bytes(4, 'little') +
+            int(light).to_bytes(2, 'little') +
+            int((light - int(light)) * 1000000).to_bytes(4, 'little'))
+    return data + sum(data).to_bytes(2, 'little')
+
+def make_frames(devices, frames):
+    result = []
+    for i in range(frames):
+        device = device_name(i % devices)
+        num = i // devices + 1
+        code = 'LOG' if num % SUMMARY_EVERY == 0 else 'EVN'
+        line = '{}{}{}\r\n'.format(code, device, make_payload(i * 10, num & 0xffff).hex())
+        result.append(line.encode('latin-1'))
+    return result
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[int(q * (len(samples) - 1))]
+
+class NullLogger(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def check_day(self):
+        pass
+
+    def __call(self, *args):
+        self.calls += 1
+
+    summary = event = log_data = __call
+
+    def start_log(self, device, logname):
+        pass
+
+    def finish_log(self, device):
+        pass
+
+class FakeWorksheet(object):
+
+    def __init__(self):
+        self.title = 'sheet1'
+        self.row_count = 1000
+        self.col_count = 26
+
+    def update_title(self, title):
+        self.title = title
+
+    def resize(self, rows, cols):
+        self.row_count = rows
+        self.col_count = cols
+
+class FakeSpreadsheet(object):
+
+    def __init__(self):
+        self.id = 'benchmark'
+        self.sheet1 = FakeWorksheet()
+        self.body_size = 0
+
+    def values_batch_update(self, body):
+        self.body_size += len(json.dumps(body))
+
+class FakeSheetsClient(object):
+
+    def __init__(self):
+        self.spreadsheet = FakeSpreadsheet()
+
+    def open(self, name):
+        import gspread
+        raise gspread.SpreadsheetNotFound()
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+    def create(self, name):
+        return self.spreadsheet
+
+    def del_spreadsheet(self, key):
+        pass
+
+    def insert_permission(self, *args, **kwargs):
+        pass
+
+# Each stage returns (frames processed, list of per-frame latencies in seconds)
+
+def stage_framing(frames):
+    from framer import SerialFramer
+    stream = b''.join(frames)
+    framer = SerialFramer()
+    latencies = []
+    total = 0
+    for i in range(0, len(stream), CHUNK_SIZE):
+        start = time.perf_counter()
+        framer.feed(stream[i:i + CHUNK_SIZE])
+        count = 0
+        for _ in framer.frames():
+            count += 1
+        elapsed = time.perf_counter() - start
+        if count:
+            latencies.extend([elapsed / count] * count)
+        total += count
+    return total, latencies
+
+def stage_protocol(frames):
+    from serialprotocol import SerialProtocol
+    protocol = SerialProtocol(object(), NullLogger())
+    latencies = []
+    for frame in frames:
+        frame = frame[:-2]
+        start = time.perf_counter()
+        protocol.process_frame(frame)
+        latencies.append(time.perf_counter() - start)
+    return len(frames), latencies
+
+def stage_logger(frames, devices):
+    from logger import EventLogger
+    from uploader import NullUploader
+    datadir = tempfile.mkdtemp()
+    try:
+        logger = EventLogger(datadir, uploader=NullUploader())
+        latencies = []
+        for i in range(len(frames)):
+            device = device_name(i % devices)
+            num = i // devices + 1
+            start = time.perf_counter()
+            if num % SUMMARY_EVERY == 0:
+                logger.summary(device, i * 10, num, 20.5, 3.25)
+            else:
+                logger.event(device, i * 10, num, 20.5, 3.25)
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        logger.save()
+        latencies.append(time.perf_counter() - start)
+        logger.close()
+    finally:
+        shutil.rmtree(datadir)
+    return len(frames), latencies
+
+def stage_merge(frames, devices):
+    from logger import EventLogger
+    from uploader import NullUploader
+    datadir = tempfile.mkdtemp()
+    try:
+        logger = EventLogger(datadir, uploader=NullUploader())
+        per_device = max(len(frames) // devices, 2)
+        for d in range(devices):
+            for n in range(0, per_device, 2):
+                logger.summary(device_name(d), n * 10, n, 20.5, 3.25)
+        latencies = []
+        for d in range(devices):
+            device = device_name(d)
+            start = time.perf_counter()
+            logger.start_log(device, 'log{}'.format(d))
+            for n in range(per_device):
+                logger.log_data(device, n * 10, n, 20.5, 3.25)
+            logger.finish_log(device)
+            elapsed = time.perf_counter() - start
+            latencies.extend([elapsed / per_device] * per_device)
+        logger.close()
+    finally:
+        shutil.rmtree(datadir)
+    return len(latencies), latencies
+
+def stage_sheet(frames, devices):
+    import gspread
+    import hamstersheet
+    from daystore import DayStore
+    client = FakeSheetsClient()
+    gspread.authorize = lambda creds: client
+    hamstersheet.ServiceAccountCredentials.from_json_keyfile_name = staticmethod(lambda *a: None)
+    store = DayStore()
+    for i in range(len(frames)):
+        device = device_name(i % devices)
+        num = i // devices + 1
+        store.event(device, 1600000000.0 + i, num)
+        if num % SUMMARY_EVERY == 0:
+            store.summary_log(device).append(1600000000.0 + i, i * 10, num, 20.5, 3.25)
+    start = time.perf_counter()
+    hamstersheet.HamsterSheet('01.01', store)
+    elapsed = time.perf_counter() - start
+    return len(frames), [elapsed / len(frames)] * len(frames)
+
+STAGES = ('framing', 'protocol', 'logger', 'merge', 'sheet')
+STAGE_MODULES = {'framing': 'framer',
+                 'protocol': 'serialprotocol',
+                 'logger': 'logger',
+                 'merge': 'logger',
+                 'sheet': 'hamstersheet'}
+
+def run_stage(stage, devices, frames_count):
+    devnull = open(os.devnull, 'w')
+    sys.stderr = devnull
+    frames = make_frames(devices, frames_count)
+    # keep module import time out of the measurement
+    __import__(STAGE_MODULES[stage])
+    start = time.perf_counter()
+    if stage == 'framing':
+        count, latencies = stage_framing(frames)
+    elif stage == 'protocol':
+        count, latencies = stage_protocol(frames)
+    elif stage == 'logger':
+        count, latencies = stage_logger(frames, devices)
+    elif stage == 'merge':
+        count, latencies = stage_merge(frames, devices)
+    else:
+        count, latencies = stage_sheet(frames, devices)
+    elapsed = time.perf_counter() - start
+    return {'stage': stage,
+            'devices': devices,
+            'frames': count,
+            'seconds': elapsed,
+            'frames_per_sec': count / elapsed if elapsed else 0.0,
+            'p50_us': percentile(latencies, 0.5) * 1000000.0,
+            'p99_us': percentile(latencies, 0.99) * 1000000.0,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+def __child(stage, devices, frames_count, results):
+    try:
+        results.put(run_stage(stage, devices, frames_count))
+    except Exception as e: # pylint: disable=broad-except
+        results.put({'stage': stage, 'devices': devices, 'error': str(e)})
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Every scenario runs in a fresh interpreter to get its own peak RSS
+def run_all(stages=STAGES, devices=DEFAULT_DEVICES, frames_count=DEFAULT_FRAMES):
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for stage in stages:
+        for d in devices:
+            queue = ctx.Queue()
+            p = ctx.Process(target=__child, args=(stage, d, frames_count, queue))
+            p.start()
+            result = queue.get()
+            p.join()
+            results.append(result)
+            print_result(result)
+    return {'version': git_version(),
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'frames': frames_count,
+            'results': results}
+
+def print_result(r):
+    if 'error' in r:
+        print('{:<10} {:>4} error: {}'.format(r['stage'], r['devices'], r['error']))
+        return
+    print('{:<10} {:>4} {:>12.0f} f/s  p50 {:>9.2f} us  p99 {:>9.2f} us  '
+          'rss {:>7} KB'.format(r['stage'], r['devices'], r['frames_per_sec'],
+                                r['p50_us'], r['p99_us'], r['peak_rss_kb']))
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    baseline = {}
+    for r in old['results']:
+        baseline[(r['stage'], r['devices'])] = r
+    regressions = 0
+    print('comparing {} -> {}'.format(old.get('version'), new.get('version')))
+    for r in new['results']:
+        o = baseline.get((r['stage'], r['devices']))
+        if o is None or 'error' in r or 'error' in o:
+            continue
+        ratio = r['frames_per_sec'] / o['frames_per_sec'] if o['frames_per_sec'] else 0.0
+        mark = ''
+        if ratio < 1.0 - threshold:
+            mark = ' REGRESSION'
+            regressions += 1
+        print('{:<10} {:>4} {:>12.0f} -> {:>12.0f} f/s ({:+.1f}%){}'.format(r['stage'],
+                                                                          r['devices'],
+                                                                          o['frames_per_sec'],
+                                                                          r['frames_per_sec'],
+                                                                          (ratio - 1.0) * 100,
+                                                                          mark))
+    return regressions
+
+def usage():
+    print('Hamster ingest benchmark')
+    print('Usage: {} <command> [flags]'.format(sys.argv[0]))
+    print('Commands:')
+    print('\trun\tRun the benchmark')
+    print('\tcompare <old.json> <new.json>\tCompare two benchmark results')
+    print('Flags for run:')
+    print('\t-o <file>\tSave the results as JSON')
+    print('\t-f <frames>\tFrames per scenario (default {})'.format(DEFAULT_FRAMES))
+    print('\t-d <list>\tComma separated device counts (default {})'.format(
+        ','.join(map(str, DEFAULT_DEVICES))))
+    print('\t-s <list>\tComma separated stages (default {})'.format(','.join(STAGES)))
+    exit(1)
+
+def load_results(path):
+    f = open(path)
+    data = json.load(f)
+    f.close()
+    return data
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        usage()
+    command = sys.argv[1]
+    if command == 'compare':
+        if len(sys.argv) != 4:
+            usage()
+        exit(1 if compare(load_results(sys.argv[2]), load_results(sys.argv[3])) else 0)
+    elif command != 'run':
+        usage()
+
+    output = None
+    frames_num = DEFAULT_FRAMES
+    device_counts = DEFAULT_DEVICES
+    stage_names = STAGES
+    flagargs = sys.argv[2:]
+    if len(flagargs) % 2 != 0:
+        usage()
+    for i in range(int(len(flagargs) / 2)):
+        theflag = flagargs[i * 2]
+        thearg = flagargs[i * 2 + 1]
+        try:
+            if theflag == '-o':
+                output = thearg
+            elif theflag == '-f':
+                frames_num = int(thearg)
+            elif theflag == '-d':
+                device_counts = [int(d) for d in thearg.split(',')]
+            elif theflag == '-s':
+                stage_names = thearg.split(',')
+                if any(s not in STAGES for s in stage_names):
+                    usage()
+            else:
+                usage()
+        except ValueError:
+            usage()
+
+    report = run_all(stage_names, device_counts, frames_num)
+    if output is not None:
+        f = open(output, 'w')
+        json.dump(report, f, indent=2)
+        f.close()
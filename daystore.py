@@ -0,0 +1,166 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: columnar in-memory day store
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import bisect
+from array import array
+
+def column_size(column):
+    return column.buffer_info()[1] * column.itemsize
+
+class EventColumn(object):
+
+    def __init__(self):
+        self.local_ts = array('d')
+
+    def __len__(self):
+        return len(self.local_ts)
+
+    def __iter__(self):
+        return iter(self.local_ts)
+
+    def __getitem__(self, idx):
+        return self.local_ts[idx]
+
+    def fill(self, num, local_ts):
+        diff = num - len(self.local_ts)
+        if diff > 0:
+            self.local_ts.extend(array('d', (local_ts,)) * diff)
+
+    def memory(self):
+        return column_size(self.local_ts)
+
+    def copy(self):
+        column = EventColumn()
+        column.local_ts = array('d', self.local_ts)
+        return column
+
+class SummaryColumns(object):
+
+    def __init__(self):
+        self.local_ts = array('d')
+        self.ts = array('I')
+        self.num = array('I')
+        self.temp = array('d')
+        self.light = array('d')
+
+    def columns(self):
+        return (self.local_ts, self.ts, self.num, self.temp, self.light)
+
+    def __len__(self):
+        return len(self.ts)
+
+    def __iter__(self):
+        return zip(*self.columns())
+
+    def __getitem__(self, idx):
+        return tuple(c[idx] for c in self.columns())
+
+    def append(self, local_ts, ts, num, temp, light):
+        self.local_ts.append(local_ts)
+        self.ts.append(ts)
+        self.num.append(num)
+        self.temp.append(temp)
+        self.light.append(light)
+
+    def insert(self, idx, local_ts, ts, num, temp, light):
+        self.local_ts.insert(idx, local_ts)
+        self.ts.insert(idx, ts)
+        self.num.insert(idx, num)
+        self.temp.insert(idx, temp)
+        self.light.insert(idx, light)
+
+    def find(self, ts):
+        idx = bisect.bisect_left(self.ts, ts)
+        if idx < len(self.ts) and self.ts[idx] == ts:
+            return idx
+        return -1
+
+    # Inserts the row at its remote timestamp position; the row borrows
+    # the local time of the following row. Duplicates are ignored.
+    def insert_sorted(self, local_ts, ts, num, temp, light):
+        idx = bisect.bisect_left(self.ts, ts)
+        if idx < len(self.ts):
+            if self.ts[idx] == ts:
+                return False
+            local_ts = self.local_ts[idx]
+        self.insert(idx, local_ts, ts, num, temp, light)
+        return True
+
+    # Merges rows of (ts, num, temp, light) in one sorted pass, copying
+    # the runs of existing rows between the merged ones as array slices.
+    def merge(self, local_ts, rows):
+        rows = sorted(rows, key=lambda r: r[0])
+        old = self.columns()
+        old_ts = self.ts
+        size = len(old_ts)
+        new = tuple(array(c.typecode) for c in old)
+        (self.local_ts, self.ts, self.num, self.temp, self.light) = new
+        merged = 0
+        i = 0
+        prev_ts = None
+        for row in rows:
+            ts = row[0]
+            if ts == prev_ts:
+                continue
+            prev_ts = ts
+            j = bisect.bisect_left(old_ts, ts, i)
+            if j > i:
+                for c, o in zip(new, old):
+                    c.extend(o[i:j])
+                i = j
+            if i < size and old_ts[i] == ts:
+                continue
+            self.append(old[0][i] if i < size else local_ts, *row)
+            merged += 1
+        for c, o in zip(new, old):
+            c.extend(o[i:])
+        return merged
+
+    def memory(self):
+        return sum(column_size(c) for c in self.columns())
+
+    def copy(self):
+        columns = SummaryColumns()
+        (columns.local_ts, columns.ts, columns.num,
+         columns.temp, columns.light) = (array(c.typecode, c) for c in self.columns())
+        return columns
+
+class DayStore(object):
+
+    def __init__(self):
+        self.events = {}
+        self.summaries = {}
+
+    def event(self, device, local_ts, num):
+        if device not in self.events:
+            self.events[device] = EventColumn()
+        self.events[device].fill(num, local_ts)
+
+    def summary_log(self, device):
+        if device not in self.summaries:
+            self.summaries[device] = SummaryColumns()
+        return self.summaries[device]
+
+    # A copy of the day for the background uploader, never modified later
+    def snapshot(self):
+        store = DayStore()
+        for device, column in self.events.items():
+            store.events[device] = column.copy()
+        for device, columns in self.summaries.items():
+            store.summaries[device] = columns.copy()
+        return store
+
+    def memory_usage(self):
+        usage = {}
+        for device, column in self.events.items():
+            usage[device] = usage.get(device, 0) + column.memory()
+        for device, columns in self.summaries.items():
+            usage[device] = usage.get(device, 0) + columns.memory()
+        return usage
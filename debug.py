@@ -5,10 +5,159 @@
 #
 # Hamster desktop server: debugger
 #
+# Messages are formatted and written by a background thread, so a call that
+# is below the current level costs one comparison and an enabled one costs
+# one deque append. Use '{}' placeholders with arguments instead of formatting
+# the message in place.
+#
 # Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
 # -----------------------------------------------------------------------------
 
+import os
 import sys
+import time
+import atexit
+import threading
+import collections
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+QUEUE_SIZE = 65536		# messages waiting for the writer; the oldest are dropped
+RECENT_FRAMES = 256		# frames kept for post-mortems
+WRITE_PERIOD = 0.1		# seconds
+
+class OutputThread(threading.Thread):
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        threading.Thread.__init__(self, name='debug-output', daemon=True)
+        self.queue = collections.deque(maxlen=queue_size)
+        self.files = []
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+
+    def put(self, item):
+        self.queue.append(item)
+
+    def wakeup(self):
+        self.__wakeup.set()
+
+    def __format(self, item):
+        t, level, msg, args = item
+        if args:
+            try:
+                msg = msg.format(*args)
+            except (IndexError, KeyError, ValueError) as e:
+                msg = '{} {!r} (bad format: {})'.format(msg, args, e)
+        return t, level, msg
+
+    # debug messages are stamped with the time they were logged at
+    def __stderr_line(self, t, level, msg):
+        if level <= DEBUG:
+            return '{}.{:06d} {}\n'.format(time.strftime('%H:%M:%S', time.localtime(t)),
+                                           int(t * 1000000) % 1000000, msg)
+        return msg + '\n'
+
+    def drain(self):
+        with self.__lock:
+            lines = []
+            queue = self.queue
+            while queue:
+                lines.append(self.__format(queue.popleft()))
+            if not lines:
+                return
+            sys.stderr.write(''.join(self.__stderr_line(*line) for line in lines))
+            sys.stderr.flush()
+            for f in self.files:
+                for t, level, msg in lines:
+                    f.write('{}.{:03d} {} {}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S',
+                                                                     time.localtime(t)),
+                                                       int(t * 1000) % 1000,
+                                                       LEVEL_NAMES.get(level, level),
+                                                       msg))
+                f.flush()
+
+    def run(self):
+        while True:
+            self.__wakeup.wait(WRITE_PERIOD)
+            self.__wakeup.clear()
+            try:
+                self.drain()
+            except (OSError, ValueError):
+                pass
+
+level = INFO
+__output = None
+__frames = collections.deque(maxlen=RECENT_FRAMES)
+
+def __get_output():
+    global __output
+    if __output is None:
+        __output = OutputThread()
+        __output.start()
+    return __output
+
+def set_level(new_level):
+    global level
+    level = new_level
+
+def enabled(msg_level):
+    return msg_level >= level
+
+def log(msg_level, msg, *args):
+    if msg_level < level:
+        return
+    output = __output if __output is not None else __get_output()
+    output.put((time.time(), msg_level, msg, args))
+    if msg_level >= WARNING:
+        output.wakeup()
+
+def debug(msg, *args):
+    if DEBUG >= level:
+        log(DEBUG, msg, *args)
+
+def info(msg, *args):
+    log(INFO, msg, *args)
+
+def warning(msg, *args):
+    log(WARNING, msg, *args)
+
+def error(msg, *args):
+    log(ERROR, msg, *args)
+
+def dprint(msg, *args):
+    log(INFO, msg, *args)
+
+def add_file(path):
+    output = __get_output()
+    output.drain()
+    output.files.append(open(path, 'a'))
+
+def flush():
+    if __output is not None:
+        __output.drain()
+
+def record_frame(frame):
+    __frames.append((time.time(), bytes(frame)))
+
+def recent_frames():
+    return list(__frames)
+
+def dump_frames():
+    frames = recent_frames()
+    error('last {} received frames:', len(frames))
+    for t, frame in frames:
+        error('{:.6f} {}', t, frame)
+    flush()
+
+# the output thread does not survive a fork, the child starts its own
+def __after_fork():
+    global __output
+    __output = None
 
-def dprint(msg):
-    sys.stderr.write(msg + '\n')
+atexit.register(flush)
+os.register_at_fork(after_in_child=__after_fork)
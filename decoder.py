@@ -0,0 +1,133 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: LOG/EVN payload decoder
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import struct
+import binascii
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# ts, num, temp int, temp fraction, light int, light fraction, checksum
+PAYLOAD = struct.Struct('<IHHIHIH')
+PAYLOAD_SIZE = PAYLOAD.size
+CHECKSUM_BYTES = 18
+FRACTION = 1000000.0
+
+if np is not None:
+    RAW_DTYPE = np.dtype([('ts', '<u4'),
+                          ('num', '<u2'),
+                          ('temp1', '<u2'),
+                          ('temp2', '<u4'),
+                          ('light1', '<u2'),
+                          ('light2', '<u4'),
+                          ('checksum', '<u2')])
+    DTYPE = np.dtype([('ts', '<u4'),
+                      ('num', '<u2'),
+                      ('temp', '<f8'),
+                      ('light', '<f8'),
+                      ('checksum_ok', '?')])
+    assert RAW_DTYPE.itemsize == PAYLOAD_SIZE
+
+class DecoderException(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+    def __str__(self):
+        return self.msg
+
+def decode_payload(data):
+    if len(data) != PAYLOAD_SIZE:
+        raise DecoderException('bad data size {}'.format(len(data)))
+    ts, num, temp1, temp2, light1, light2, remote_cs = PAYLOAD.unpack(data)
+    return (ts,
+            num,
+            temp1 + temp2 / FRACTION,
+            light1 + light2 / FRACTION,
+            sum(data[0:CHECKSUM_BYTES]) == remote_cs)
+
+def decode_batch(data):
+    if np is None:
+        raise DecoderException('numpy is required for the batch decoding')
+    if len(data) % PAYLOAD_SIZE != 0:
+        raise DecoderException('bad batch size {}'.format(len(data)))
+    raw = np.frombuffer(data, dtype=RAW_DTYPE)
+    octets = np.frombuffer(data, dtype=np.uint8).reshape(-1, PAYLOAD_SIZE)
+    result = np.empty(len(raw), dtype=DTYPE)
+    result['ts'] = raw['ts']
+    result['num'] = raw['num']
+    result['temp'] = raw['temp1'] + raw['temp2'] / FRACTION
+    result['light'] = raw['light1'] + raw['light2'] / FRACTION
+    result['checksum_ok'] = (octets[:, 0:CHECKSUM_BYTES].sum(axis=1, dtype=np.uint32) ==
+                             raw['checksum'])
+    return result
+
+def decode_hex_batch(payloads):
+    chunks = []
+    for p in payloads:
+        try:
+            data = binascii.unhexlify(p)
+        except (ValueError, binascii.Error):
+            continue
+        if len(data) == PAYLOAD_SIZE:
+            chunks.append(data)
+    return decode_batch(b''.join(chunks))
+
+# LPK packets: sequence number, varint records & a sum checksum. The first
+# record of a packet is (ts, num, temp & light in thousandths), the next
+# ones are zigzag deltas from the record before.
+PACKED_FIELDS = 4
+PACKED_TEMP_OFFSET = 100
+PACKED_FRACTION = 1000.0
+
+def decode_varints(data, start, end):
+    values = []
+    value = shift = 0
+    for i in range(start, end):
+        byte = data[i]
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    if shift:
+        raise DecoderException('truncated varint')
+    return values
+
+def decode_packed(data):
+    if len(data) < 2:
+        raise DecoderException('bad packed size {}'.format(len(data)))
+    if sum(data[:-1]) & 0xff != data[-1]:
+        raise DecoderException('bad packed checksum')
+    values = decode_varints(data, 1, len(data) - 1)
+    if not values or len(values) % PACKED_FIELDS:
+        raise DecoderException('bad packed record count')
+    records = []
+    prev = None
+    for i in range(0, len(values), PACKED_FIELDS):
+        record = values[i:i + PACKED_FIELDS]
+        if prev is not None:
+            record = [p + ((v >> 1) ^ -(v & 1)) for v, p in zip(record, prev)]
+        records.append(record)
+        prev = record
+    return data[0], [(ts, num,
+                      round(temp / PACKED_FRACTION - PACKED_TEMP_OFFSET, 3),
+                      round(light / PACKED_FRACTION, 3))
+                     for ts, num, temp, light in records]
+
+# STS frames of the receivers: ticks, radio packets received, forwarded,
+# malformed & the drains that found the radio queue full
+STATUS = struct.Struct('<IIIII')
+
+def decode_status(data):
+    if len(data) != STATUS.size:
+        raise DecoderException('bad status size {}'.format(len(data)))
+    return STATUS.unpack(data)
@@ -11,10 +11,25 @@
 import sys
 from serialport import SerialPort, SerialException
 from serialprotocol import SerialProtocol
+from multiserver import MultiServer
+from pipeline import Pipeline
+from handshake import handshake_addresses
+from logger import EventLogger
+from logwriter import LogWriter
+from uploader import SheetUploader
+from tsstore import TimeSeriesStore
+from wal import WriteAheadLog
+from archiver import DayArchiver, ArchiverException, check_compression
+from archiver import COMPRESSION_NONE, COMPRESSION_GZIP
+from recorder import StreamRecorder
+from metrics import MetricsServer
+import debug
 from debug import dprint
 
 MODE_INIT = 0
 MODE_LISTEN = 1
+MODE_MULTI_LISTEN = 2
+MODE_PIPELINE_LISTEN = 3
 
 DEFAULT_SERIAL_ADDRESS = '/dev/ttyACM0'
 
@@ -22,11 +37,29 @@ def usage():
     dprint('Hamster desktop server')
     dprint('Usage: {} <command> [flags]'.format(sys.argv[0]))
     dprint('Commands:')
-    dprint('\tinit\tInitialize counter with system time')
+    dprint('\tinit\tInitialize all the counters with system time at once')
     dprint('\tlisten\tWait for counter data & files')
+    dprint('\tmlisten\tWait for data from all the receivers in one event loop')
+    dprint('\tplisten\tWait for data from all the receivers with reader, '
+           'decoder & writer processes')
     dprint('Flags:')
     dprint('\t-d <device>\tUse the specified '
-           'tty device (default {})'.format(DEFAULT_SERIAL_ADDRESS))
+           'tty device (default {}); may be repeated for init, mlisten & plisten'.format(DEFAULT_SERIAL_ADDRESS))
+    dprint('\t-s <policy>\tLog fsync policy: none, batch or '
+           'period in seconds (default none)')
+    dprint('\t-u <mode>\tSheets upload mode: full or incremental (default full)')
+    dprint('\t-p <minutes>\tSync the day to sheets periodically')
+    dprint('\t-r <file>\tRecord the raw serial stream (listen only)')
+    dprint('\t-b <baud>\tAsk the receivers for binary frames at the baud rate')
+    dprint('\t-z <compression>\tArchive past days: gz, xz, zst or none (default gz)')
+    dprint('\t-w <policy>\tDay state write-ahead log: flush (every second), '
+           'fsync, none (no periodic flush) or off (default flush)')
+    dprint('\t-t <dir>\tAlso store the events & summaries in the time-series store')
+    dprint('\t-v <level>\tMessage level: debug, info, warning or error (default info)')
+    dprint('\t-l <file>\tAlso write the messages to the file')
+    dprint('\t-m <port>\tServe Prometheus metrics on localhost:<port>/metrics')
+    dprint('\t-j <file>\tSave a JSON metrics snapshot every {:.0f} seconds'.format(
+        MetricsServer.SNAPSHOT_PERIOD))
     exit(1)
 
 if __name__ == '__main__':
@@ -39,10 +72,24 @@ if __name__ == '__main__':
         mode = MODE_INIT
     elif command == 'listen':
         mode = MODE_LISTEN
+    elif command == 'mlisten':
+        mode = MODE_MULTI_LISTEN
+    elif command == 'plisten':
+        mode = MODE_PIPELINE_LISTEN
     else:
         usage()
 
-    serial_address = DEFAULT_SERIAL_ADDRESS
+    serial_addresses = []
+    writer = LogWriter()
+    incremental = False
+    sync_period = None
+    record_file = None
+    metrics_port = None
+    compression = COMPRESSION_GZIP
+    tsstore_dir = None
+    wal_policy = WriteAheadLog.SYNC_FLUSH
+    metrics_file = None
+    baud = None
     if len(sys.argv) > 2:
         flagargs = sys.argv[2:]
         if len(flagargs) % 2 != 0:
@@ -52,17 +99,143 @@ if __name__ == '__main__':
             theflag = flagargs[i * 2]
             thearg = flagargs[i * 2 + 1]
             if theflag == '-d':
-                serial_address = thearg
+                serial_addresses.append(thearg)
+            elif theflag == '-s':
+                if thearg in (LogWriter.SYNC_NONE, LogWriter.SYNC_BATCH):
+                    writer = LogWriter(thearg)
+                else:
+                    try:
+                        writer = LogWriter(LogWriter.SYNC_PERIODIC, float(thearg))
+                    except ValueError:
+                        usage()
+            elif theflag == '-u':
+                if thearg not in ('full', 'incremental'):
+                    usage()
+                incremental = thearg == 'incremental'
+            elif theflag == '-r':
+                record_file = thearg
+            elif theflag == '-p':
+                try:
+                    sync_period = float(thearg) * 60
+                except ValueError:
+                    usage()
+            elif theflag == '-m':
+                try:
+                    metrics_port = int(thearg)
+                except ValueError:
+                    usage()
+            elif theflag == '-b':
+                try:
+                    baud = int(thearg)
+                except ValueError:
+                    usage()
+            elif theflag == '-j':
+                metrics_file = thearg
+            elif theflag == '-w':
+                if thearg == 'off':
+                    wal_policy = None
+                elif thearg in (WriteAheadLog.SYNC_NONE, WriteAheadLog.SYNC_FLUSH,
+                                WriteAheadLog.SYNC_FSYNC):
+                    wal_policy = thearg
+                else:
+                    usage()
+            elif theflag == '-t':
+                tsstore_dir = thearg
+            elif theflag == '-z':
+                compression = thearg
+            elif theflag == '-v':
+                levels = {name.lower(): level for level, name in debug.LEVEL_NAMES.items()}
+                if thearg not in levels:
+                    usage()
+                debug.set_level(levels[thearg])
+            elif theflag == '-l':
+                debug.add_file(thearg)
+    if not serial_addresses:
+        serial_addresses.append(DEFAULT_SERIAL_ADDRESS)
 
-    sport = SerialPort(serial_address)
-    protocol = SerialProtocol(sport)
+    metrics_server = None
+    if mode != MODE_INIT and (metrics_port is not None or metrics_file is not None):
+        metrics_server = MetricsServer(metrics_port, metrics_file)
 
-    try:
-        protocol.init()
+    def make_logger():
+        uploader = SheetUploader(EventLogger.DATA_DIR, incremental)
+        archiver = None
+        if mode != MODE_INIT and compression != COMPRESSION_NONE:
+            archiver = DayArchiver(EventLogger.DATA_DIR, compression, uploader)
+        return EventLogger(writer=writer,
+                           uploader=uploader,
+                           sync_period=sync_period,
+                           archiver=archiver,
+                           tsstore=TimeSeriesStore(tsstore_dir) if tsstore_dir else None,
+                           wal_policy=wal_policy if mode != MODE_INIT else None)
+
+    if compression != COMPRESSION_NONE:
+        try:
+            check_compression(compression)
+        except ArchiverException as e:
+            dprint('archiver error: {}'.format(e))
+            usage()
+
+    if mode == MODE_INIT:
+        try:
+            results = handshake_addresses(serial_addresses, baud=baud)
+        except SerialException as e:
+            debug.error('serial error: {}', e)
+            exit(1)
+        exit(0 if all(r.ok for r in results) else 1)
+
+    if mode == MODE_PIPELINE_LISTEN:
+        # the logger lives in the writer process
+        pipeline = Pipeline(serial_addresses, make_logger, baud=baud)
+        try:
+            if not pipeline.init():
+                raise SerialException('not all the receivers answered')
+            dprint('waiting data from {} receivers...'.format(len(serial_addresses)))
+            pipeline.listen()
+        except SerialException as e:
+            debug.error('serial error: {}', e)
+            exit(1)
+        finally:
+            if metrics_server is not None:
+                metrics_server.close()
+        exit(0)
 
-        if mode == MODE_INIT:
-            protocol.send_time(5)
-            exit(0)
+    logger = make_logger()
+
+    if mode == MODE_MULTI_LISTEN:
+        server = None
+        try:
+            server = MultiServer(serial_addresses, logger)
+            if not server.init(baud):
+                raise SerialException('not all the receivers answered')
+            dprint('waiting data from {} receivers...'.format(len(serial_addresses)))
+            server.listen()
+        except KeyboardInterrupt:
+            dprint('keyboard interrupt. saving state...')
+            if server is not None:
+                server.save_state()
+        except SerialException as e:
+            debug.error('serial error: {}', e)
+            debug.dump_frames()
+            # keep the frames that came before the failure
+            if server is not None:
+                server.save_state()
+            exit(1)
+        finally:
+            if metrics_server is not None:
+                metrics_server.close()
+        exit(0)
+
+    serial_address = serial_addresses[0]
+    recorder = None
+    if record_file is not None and mode == MODE_LISTEN:
+        recorder = StreamRecorder(record_file)
+    sport = SerialPort(serial_address, recorder=recorder)
+    protocol = SerialProtocol(sport, logger)
+
+    try:
+        if not protocol.send_time(baud=baud):
+            raise SerialException('the receiver did not answer')
 
         assert mode == MODE_LISTEN
         dprint('waiting data...')
@@ -72,7 +245,14 @@ if __name__ == '__main__':
         dprint('keyboard interrupt. saving state...')
         if mode == MODE_LISTEN:
             protocol.save_state()
+            if recorder is not None:
+                recorder.close()
     except SerialException as e:
-        dprint('serial error: {}'.format(e))
+        debug.error('serial error: {}', e)
+        debug.dump_frames()
+        protocol.save_state()
         sport.close()
         exit(1)
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
@@ -0,0 +1,10 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Micro:bit emulator: runs the device programs under CPython on a virtual
+# clock with fake microbit, radio & flash modules
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
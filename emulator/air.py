@@ -0,0 +1,37 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Micro:bit emulator: shared in-process radio air
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import random
+
+class RadioAir(object):
+
+    AIR_DELAY = 1.0		# ms
+
+    def __init__(self, loss=0.0, seed=None, delay=AIR_DELAY):
+        self.loss = loss
+        self.delay = delay
+        self.radios = []
+        self.sent = 0
+        self.lost = 0
+        self.__random = random.Random(seed)
+
+    def attach(self, radio):
+        self.radios.append(radio)
+
+    def transmit(self, sender, t, msg):
+        self.sent += 1
+        for r in self.radios:
+            if r is sender or not r.enabled or r.channel != sender.channel:
+                continue
+            if self.loss and self.__random.random() < self.loss:
+                self.lost += 1
+                r.lost += 1
+                continue
+            r.deliver(t + self.delay, msg)
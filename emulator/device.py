@@ -0,0 +1,162 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Micro:bit emulator: emulated device running a device script
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import ast
+import random
+import builtins
+import threading
+import traceback
+from emulator.scheduler import EmulationStopped
+from emulator.microbit import MicrobitModule, DeviceReset, DeviceHalted
+from emulator.radio import RadioModule
+from emulator.flash import Flash, FlashOS
+
+class Wheel(object):
+
+    BASELINE = 30000
+    SPIKE = 20000
+    SPIKE_TIME = 60		# ms the magnet stays near the sensor
+
+    # bouts are (start ms, end ms, revolution period ms)
+    def __init__(self, bouts=None):
+        self.bouts = sorted(bouts or [])
+
+    @classmethod
+    def random(cls, duration, seed=None, bouts=20, period=(450, 1500), length=(10000, 300000)):
+        rnd = random.Random(seed)
+        result = []
+        for _ in range(bouts):
+            start = rnd.uniform(0, duration)
+            end = min(start + rnd.uniform(*length), duration)
+            result.append((start, end, rnd.uniform(*period)))
+        return cls(result)
+
+    def revolutions(self, t):
+        total = 0
+        for start, end, period in self.bouts:
+            if t > start:
+                total += int((min(t, end) - start) // period)
+        return total
+
+    def field(self, t):
+        for start, end, period in self.bouts:
+            if start <= t < end and (t - start) % period < self.SPIKE_TIME:
+                return self.BASELINE + self.SPIKE
+        return self.BASELINE
+
+class TimeModule(object):
+
+    def __init__(self, device):
+        self.__device = device
+
+    def ticks_ms(self):
+        self.__device.advance(self.__device.API_COST)
+        return int(self.__device.now - self.__device.boot_time)
+
+    def ticks_us(self):
+        self.__device.advance(self.__device.API_COST)
+        return int((self.__device.now - self.__device.boot_time) * 1000)
+
+    def ticks_add(self, ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(self, ticks1, ticks2):
+        return ticks1 - ticks2
+
+    def sleep(self, seconds):
+        self.__device.advance(seconds * 1000.0)
+
+    def sleep_ms(self, ms):
+        self.__device.advance(ms)
+
+    def sleep_us(self, us):
+        self.__device.advance(us / 1000.0)
+
+def load_script(path, overrides=None):
+    f = open(path)
+    source = f.read()
+    f.close()
+    tree = ast.parse(source, path)
+    if overrides:
+        for node in tree.body:
+            if (isinstance(node, ast.Assign) and len(node.targets) == 1 and
+                isinstance(node.targets[0], ast.Name) and
+                node.targets[0].id in overrides):
+                node.value = ast.copy_location(ast.Constant(overrides[node.targets[0].id]),
+                                               node.value)
+    return compile(tree, path, 'exec')
+
+class EmulatedDevice(threading.Thread):
+
+    API_COST = 0.05		# ms spent in any API call
+
+    def __init__(self, name, script, scheduler, air,
+                 overrides=None, wheel=None, flash_size=Flash.FLASH_SIZE):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.script = script
+        self.scheduler = scheduler
+        self.now = 0.0
+        self.boot_time = 0.0
+        self.deadline = 0.0
+        self.alive = True
+        self.resets = 0
+        self.error = None
+        self.wheel = wheel if wheel is not None else Wheel()
+        self.flash = Flash(self, flash_size)
+        self.microbit = MicrobitModule(self, self.wheel)
+        self.radio = RadioModule(self, air)
+        self.os = FlashOS(self.flash)
+        self.time = TimeModule(self)
+        self.__code = load_script(script, overrides)
+        self.__modules = {'microbit': self.microbit,
+                          'radio': self.radio,
+                          'os': self.os,
+                          'uos': self.os,
+                          'time': self.time,
+                          'utime': self.time}
+        scheduler.add(self)
+
+    def advance(self, ms):
+        self.now += ms
+        if self.now >= self.deadline:
+            self.scheduler.switch(self)
+
+    def __import(self, name, globs=None, locs=None, fromlist=(), level=0):
+        if name in self.__modules:
+            return self.__modules[name]
+        return builtins.__import__(name, globs, locs, fromlist, level)
+
+    def __globals(self):
+        device_builtins = dict(builtins.__dict__)
+        device_builtins['__import__'] = self.__import
+        device_builtins['open'] = self.flash.open
+        return {'__name__': '__main__',
+                '__file__': self.script,
+                '__builtins__': device_builtins}
+
+    def run(self):
+        try:
+            self.scheduler.enter(self)
+            while True:
+                self.boot_time = self.now
+                self.radio.off()
+                self.radio.reset()
+                try:
+                    exec(self.__code, self.__globals()) # pylint: disable=exec-used
+                    break
+                except DeviceReset:
+                    self.resets += 1
+        except EmulationStopped:
+            return
+        except DeviceHalted as e:
+            self.error = str(e)
+        except Exception: # pylint: disable=broad-except
+            self.error = traceback.format_exc()
+        self.scheduler.leave(self)
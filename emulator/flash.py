@@ -0,0 +1,120 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Micro:bit emulator: size-limited flash file system
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import errno
+
+class Flash(object):
+
+    FLASH_SIZE = 30 * 1024		# bytes available to the files
+    CHUNK_SIZE = 128		# files take space in chunks
+    WRITE_COST = 0.05		# ms per byte
+
+    def __init__(self, device, size=FLASH_SIZE):
+        self.device = device
+        self.size = size
+        self.files = {}
+        self.bytes_written = 0
+
+    def __chunks(self, length):
+        return (length + self.CHUNK_SIZE - 1) // self.CHUNK_SIZE * self.CHUNK_SIZE
+
+    def used(self):
+        return sum(self.__chunks(len(f)) for f in self.files.values())
+
+    def reserve(self, name, length):
+        used = self.used() - self.__chunks(len(self.files.get(name, b'')))
+        if used + self.__chunks(length) > self.size:
+            raise OSError(errno.ENOSPC, 'no space left on the flash')
+
+    def write(self, name, data):
+        self.bytes_written += len(data)
+        self.device.advance(len(data) * self.WRITE_COST)
+        self.files[name] += data
+
+    def open(self, name, mode='r'):
+        if 'w' in mode:
+            self.reserve(name, 0)
+            self.files[name] = bytearray()
+        elif name not in self.files:
+            raise OSError(errno.ENOENT, 'no such file')
+        return FlashFile(self, name, mode)
+
+class FlashFile(object):
+
+    def __init__(self, flash, name, mode):
+        self.__flash = flash
+        self.name = name
+        self.binary = 'b' in mode
+        self.writable = 'w' in mode
+        self.__pos = 0
+        self.closed = False
+
+    def write(self, data):
+        if not self.writable:
+            raise OSError(errno.EBADF, 'file is not writable')
+        if isinstance(data, str):
+            data = data.encode()
+        current = self.__flash.files[self.name]
+        self.__flash.reserve(self.name, len(current) + len(data))
+        self.__flash.write(self.name, bytes(data))
+        return len(data)
+
+    def read(self, size=-1):
+        data = self.__flash.files[self.name]
+        if size is None or size < 0:
+            size = len(data) - self.__pos
+        chunk = bytes(data[self.__pos:self.__pos + size])
+        self.__pos += len(chunk)
+        return chunk if self.binary else str(chunk, 'utf-8')
+
+    def readline(self):
+        data = self.__flash.files[self.name]
+        index = data.find(b'\n', self.__pos)
+        end = len(data) if index < 0 else index + 1
+        chunk = bytes(data[self.__pos:end])
+        self.__pos = end
+        return chunk if self.binary else str(chunk, 'utf-8')
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class FlashOS(object):
+
+    def __init__(self, flash):
+        self.__flash = flash
+
+    def listdir(self):
+        return sorted(self.__flash.files.keys())
+
+    def remove(self, name):
+        if name not in self.__flash.files:
+            raise OSError(errno.ENOENT, 'no such file')
+        del self.__flash.files[name]
+
+    def size(self, name):
+        if name not in self.__flash.files:
+            raise OSError(errno.ENOENT, 'no such file')
+        return len(self.__flash.files[name])
+
+    def uname(self):
+        return ('microbit', 'microbit', '1.0', 'emulator', 'micro:bit emulator')
@@ -0,0 +1,155 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Micro:bit emulator: cage fleet runner
+#
+# Usage example (from the collection directory):
+#   python3 -m emulator.fleet -n 4 -t 3600 -l 0.01
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import ast
+import sys
+import json
+import time
+from emulator.scheduler import Scheduler
+from emulator.air import RadioAir
+from emulator.device import EmulatedDevice, Wheel
+
+class Fleet(object):
+
+    def __init__(self, loss=0.0, seed=None, quantum=Scheduler.QUANTUM):
+        self.scheduler = Scheduler(quantum)
+        self.air = RadioAir(loss, seed)
+        self.seed = seed
+        self.devices = []
+        self.duration = 0.0
+        self.wall_time = 0.0
+
+    def add_device(self, name, script, overrides=None, wheel=None):
+        device = EmulatedDevice(name, script, self.scheduler, self.air,
+                                overrides=overrides, wheel=wheel)
+        self.devices.append(device)
+        return device
+
+    def add_counter(self, name, script, duration, overrides=None):
+        values = {'DEVICE': name}
+        if overrides:
+            values.update(overrides)
+        seed = None if self.seed is None else '{}{}'.format(self.seed, name)
+        return self.add_device(name, script, values, Wheel.random(duration, seed))
+
+    def add_server(self, name, script, overrides=None):
+        device = self.add_device(name, script, overrides)
+        device.microbit.uart.input += '{}\r\n{} {}\r\n'.format('STA', 'TIM',
+                                                               int(time.time())).encode()
+        return device
+
+    def run(self, seconds):
+        self.duration = seconds * 1000.0
+        start = time.time()
+        self.scheduler.run(self.duration)
+        self.wall_time = time.time() - start
+
+    def __device_report(self, d):
+        uart = d.microbit.uart.output
+        frames = uart.count(b'\r\n')
+        return {'script': d.script,
+                'resets': d.resets,
+                'error': d.error,
+                'revolutions': d.wheel.revolutions(self.duration),
+                'radio': {'sent': d.radio.sent,
+                          'received': d.radio.received,
+                          'lost': d.radio.lost,
+                          'overflow': d.radio.overflow},
+                'flash': {'files': len(d.flash.files),
+                          'used': d.flash.used(),
+                          'written': d.flash.bytes_written},
+                'uart': {'bytes': len(uart),
+                         'frames': frames,
+                         'frames_per_sec': frames * 1000.0 / self.duration if self.duration else 0}}
+
+    def report(self):
+        devices = {}
+        for d in self.devices:
+            devices[d.name] = self.__device_report(d)
+        received = sum(d.radio.received for d in self.devices)
+        dropped = sum(d.radio.lost + d.radio.overflow for d in self.devices)
+        return {'virtual_seconds': self.duration / 1000.0,
+                'wall_seconds': self.wall_time,
+                'radio': {'sent': self.air.sent,
+                          'lost': self.air.lost,
+                          'received': received,
+                          'drop_rate': float(dropped) / (received + dropped) if received + dropped else 0.0},
+                'devices': devices}
+
+def usage():
+    sys.stderr.write('Hamster cage fleet emulator\n'
+                     'Usage: python3 -m emulator.fleet [flags]\n'
+                     'Flags:\n'
+                     '\t-c <script>\tCounter script (default magnet-counter.py)\n'
+                     '\t-n <count>\tNumber of counters (default 1)\n'
+                     '\t-s <script>\tReceiver script or "none" (default magnet-server.py)\n'
+                     '\t-t <seconds>\tVirtual time to run (default 600)\n'
+                     '\t-l <loss>\tRadio packet loss probability (default 0)\n'
+                     '\t-p <seconds>\tPress button A on the counters at this time\n'
+                     '\t-o <NAME=VALUE>\tOverride a counter script constant\n'
+                     '\t-r <seed>\tRandom seed\n'
+                     '\t-q <ms>\tScheduler quantum, larger is faster but coarser (default {})\n'.format(Scheduler.QUANTUM))
+    exit(1)
+
+if __name__ == '__main__':
+    counter_script = 'magnet-counter.py'
+    server_script = 'magnet-server.py'
+    counters = 1
+    seconds = 600.0
+    loss = 0.0
+    press = None
+    random_seed = None
+    quantum = Scheduler.QUANTUM
+    counter_overrides = {}
+
+    flagargs = sys.argv[1:]
+    if len(flagargs) % 2 != 0:
+        usage()
+    for i in range(int(len(flagargs) / 2)):
+        theflag = flagargs[i * 2]
+        thearg = flagargs[i * 2 + 1]
+        try:
+            if theflag == '-c':
+                counter_script = thearg
+            elif theflag == '-n':
+                counters = int(thearg)
+            elif theflag == '-s':
+                server_script = thearg
+            elif theflag == '-t':
+                seconds = float(thearg)
+            elif theflag == '-l':
+                loss = float(thearg)
+            elif theflag == '-p':
+                press = float(thearg) * 1000.0
+            elif theflag == '-o':
+                oname, ovalue = thearg.split('=', 1)
+                counter_overrides[oname] = ast.literal_eval(ovalue)
+            elif theflag == '-r':
+                random_seed = int(thearg)
+            elif theflag == '-q':
+                quantum = float(thearg)
+            else:
+                usage()
+        except ValueError:
+            usage()
+
+    fleet = Fleet(loss, random_seed, quantum)
+    for c in range(counters):
+        counter = fleet.add_counter(chr(ord('A') + c), counter_script,
+                                    seconds * 1000.0, counter_overrides)
+        if press is not None:
+            counter.microbit.button_a.press_at(press)
+    if server_script != 'none':
+        fleet.add_server('Z', server_script)
+    fleet.run(seconds)
+    print(json.dumps(fleet.report(), indent=2))
@@ -0,0 +1,181 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Micro:bit emulator: fake microbit module
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+class DeviceReset(Exception):
+    pass
+
+class DeviceHalted(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg = msg
+    def __str__(self):
+        return self.msg
+
+class Display(object):
+
+    def __init__(self, device):
+        self.__device = device
+        self.pixels = [[0] * 5 for _ in range(5)]
+        self.text = None
+
+    def set_pixel(self, x, y, value):
+        self.__device.advance(self.__device.API_COST)
+        self.pixels[y][x] = value
+
+    def get_pixel(self, x, y):
+        self.__device.advance(self.__device.API_COST)
+        return self.pixels[y][x]
+
+    def clear(self):
+        self.__device.advance(self.__device.API_COST)
+        self.pixels = [[0] * 5 for _ in range(5)]
+        self.text = None
+
+    def show(self, value, delay=400, wait=True, loop=False, **kwargs):
+        self.text = str(value)
+        if wait and loop:
+            # the real device never returns from an endless blocking scroll
+            raise DeviceHalted('halted showing "{}"'.format(self.text))
+        if wait:
+            self.__device.advance(delay * max(len(self.text), 1))
+        else:
+            self.__device.advance(self.__device.API_COST)
+
+    scroll = show
+
+class Button(object):
+
+    def __init__(self, device):
+        self.__device = device
+        self.__presses = []
+        self.__pressed = 0
+
+    def press_at(self, t):
+        self.__presses.append(t)
+        self.__presses.sort()
+
+    def __update(self):
+        now = self.__device.now
+        while self.__presses and self.__presses[0] <= now:
+            self.__presses.pop(0)
+            self.__pressed += 1
+
+    def was_pressed(self):
+        self.__device.advance(self.__device.API_COST)
+        self.__update()
+        pressed = self.__pressed > 0
+        self.__pressed = 0
+        return pressed
+
+    def get_presses(self):
+        self.__device.advance(self.__device.API_COST)
+        self.__update()
+        presses = self.__pressed
+        self.__pressed = 0
+        return presses
+
+    def is_pressed(self):
+        return self.was_pressed()
+
+class Pin(object):
+
+    def __init__(self, device, value=0):
+        self.__device = device
+        self.value = value
+
+    def read_analog(self):
+        self.__device.advance(self.__device.API_COST)
+        return self.value
+
+    def read_digital(self):
+        self.__device.advance(self.__device.API_COST)
+        return 1 if self.value else 0
+
+class Compass(object):
+
+    READ_COST = 2.0		# ms
+
+    def __init__(self, device, wheel):
+        self.__device = device
+        self.__wheel = wheel
+
+    def get_field_strength(self):
+        self.__device.advance(self.READ_COST)
+        return self.__wheel.field(self.__device.now)
+
+    def calibrate(self):
+        pass
+
+    def is_calibrated(self):
+        return True
+
+class Uart(object):
+
+    def __init__(self, device):
+        self.__device = device
+        self.baudrate = None
+        self.input = bytearray()
+        self.output = bytearray()
+
+    def init(self, baudrate=9600, **kwargs):
+        self.baudrate = baudrate
+
+    def any(self):
+        self.__device.advance(self.__device.API_COST)
+        return len(self.input) > 0
+
+    def read(self, nbytes=None):
+        self.__device.advance(self.__device.API_COST)
+        if not self.input:
+            return None
+        if nbytes is None:
+            nbytes = len(self.input)
+        data = bytes(self.input[0:nbytes])
+        del self.input[0:nbytes]
+        return data
+
+    def write(self, buf):
+        if isinstance(buf, str):
+            buf = buf.encode()
+        # 10 bits per byte on the wire
+        if self.baudrate:
+            self.__device.advance(len(buf) * 10000.0 / self.baudrate)
+        self.output += buf
+        return len(buf)
+
+class MicrobitModule(object):
+
+    def __init__(self, device, wheel, temperature=20, light=100):
+        self.__device = device
+        self.__temperature = temperature
+        self.display = Display(device)
+        self.button_a = Button(device)
+        self.button_b = Button(device)
+        self.pin0 = Pin(device, light)
+        self.pin1 = Pin(device)
+        self.pin2 = Pin(device)
+        self.compass = Compass(device, wheel)
+        self.uart = Uart(device)
+
+    def sleep(self, ms):
+        self.__device.advance(ms)
+
+    def running_time(self):
+        return int(self.__device.now - self.__device.boot_time)
+
+    def temperature(self):
+        self.__device.advance(self.__device.API_COST)
+        return self.__temperature
+
+    def reset(self):
+        raise DeviceReset()
+
+    def panic(self, code=0):
+        raise DeviceHalted('panic {}'.format(code))
@@ -0,0 +1,112 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Micro:bit emulator: fake radio module
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import bisect
+
+RATE_1MBIT = 1
+RATE_2MBIT = 2
+
+# radio.send() prepends this header to the string messages
+STRING_HEADER = b'\x01\x00\x01'
+
+class RadioModule(object):
+
+    RATE_1MBIT = RATE_1MBIT
+    RATE_2MBIT = RATE_2MBIT
+
+    DEFAULT_LENGTH = 32
+    DEFAULT_QUEUE = 3
+    DEFAULT_CHANNEL = 7
+    SEND_COST = 1.0		# ms
+
+    def __init__(self, device, air):
+        self.__device = device
+        self.__air = air
+        self.enabled = False
+        self.length = self.DEFAULT_LENGTH
+        self.queue = self.DEFAULT_QUEUE
+        self.channel = self.DEFAULT_CHANNEL
+        self.__inbox = []
+        self.__queue = []
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.overflow = 0
+        air.attach(self)
+
+    def on(self):
+        self.enabled = True
+
+    def off(self):
+        self.enabled = False
+        self.__inbox = []
+        self.__queue = []
+
+    def config(self, length=None, queue=None, channel=None, **kwargs):
+        if length is not None:
+            if not 1 <= length <= 251:
+                raise ValueError('value out of range')
+            self.length = length
+        if queue is not None:
+            self.queue = queue
+        if channel is not None:
+            if not 0 <= channel <= 83:
+                raise ValueError('value out of range')
+            self.channel = channel
+
+    def reset(self):
+        self.config(self.DEFAULT_LENGTH, self.DEFAULT_QUEUE, self.DEFAULT_CHANNEL)
+
+    def deliver(self, t, msg):
+        bisect.insort(self.__inbox, (t, msg))
+
+    # Moves the messages arrived by now into the receive queue; the
+    # queue only grows between the receive calls, so it is exact.
+    def __update(self):
+        now = self.__device.now
+        while self.__inbox and self.__inbox[0][0] <= now:
+            _, msg = self.__inbox.pop(0)
+            if len(self.__queue) >= self.queue:
+                self.overflow += 1
+            else:
+                self.__queue.append(msg)
+
+    def send_bytes(self, msg):
+        if not self.enabled:
+            raise ValueError('radio is not enabled')
+        msg = bytes(msg)
+        if len(msg) > self.length:
+            raise ValueError('message too long')
+        self.__device.advance(self.SEND_COST)
+        self.sent += 1
+        self.__air.transmit(self, self.__device.now, msg)
+
+    def send(self, msg):
+        if isinstance(msg, str):
+            msg = msg.encode()
+        self.send_bytes(STRING_HEADER + bytes(msg))
+
+    def receive_bytes(self):
+        if not self.enabled:
+            raise ValueError('radio is not enabled')
+        self.__device.advance(self.__device.API_COST)
+        self.__update()
+        if not self.__queue:
+            return None
+        self.received += 1
+        return self.__queue.pop(0)
+
+    def receive(self):
+        msg = self.receive_bytes()
+        if msg is None:
+            return None
+        if msg[0:3] != STRING_HEADER:
+            raise ValueError('received packet is not a string')
+        return str(msg[3:], 'utf-8')
@@ -0,0 +1,85 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Micro:bit emulator: virtual clock scheduler
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import threading
+
+class EmulationStopped(Exception):
+    pass
+
+class Scheduler(object):
+
+    # how far (in virtual ms) a device may run ahead of the others
+    QUANTUM = 5.0
+
+    def __init__(self, quantum=QUANTUM):
+        self.quantum = quantum
+        self.devices = []
+        self.now = 0.0
+        self.duration = 0.0
+        self.__cond = threading.Condition()
+        self.__running = None
+        self.__stopped = False
+
+    def add(self, device):
+        self.devices.append(device)
+
+    def __alive(self):
+        return [d for d in self.devices if d.alive]
+
+    # Called from a device thread when its time passed the deadline
+    def switch(self, device):
+        with self.__cond:
+            self.__running = None
+            self.__cond.notify_all()
+            self.__wait_turn(device)
+
+    def __wait_turn(self, device):
+        while self.__running is not device and not self.__stopped:
+            self.__cond.wait()
+        if self.__stopped:
+            raise EmulationStopped()
+
+    def enter(self, device):
+        with self.__cond:
+            self.__wait_turn(device)
+
+    def leave(self, device):
+        with self.__cond:
+            device.alive = False
+            self.__running = None
+            self.__cond.notify_all()
+
+    def __next_device(self, alive):
+        device = min(alive, key=lambda d: d.now)
+        others = [d.now for d in alive if d is not device]
+        horizon = min(others) if others else device.now
+        device.deadline = min(max(horizon, device.now) + self.quantum, self.duration)
+        return device
+
+    def run(self, duration):
+        self.duration = duration
+        for d in self.devices:
+            d.start()
+        with self.__cond:
+            while True:
+                alive = [d for d in self.__alive() if d.now < duration]
+                if not alive:
+                    break
+                device = self.__next_device(alive)
+                self.now = device.now
+                self.__running = device
+                self.__cond.notify_all()
+                while self.__running is not None:
+                    self.__cond.wait()
+            self.now = duration
+            self.__stopped = True
+            self.__cond.notify_all()
+        for d in self.devices:
+            d.join(1.0)
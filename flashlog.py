@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster flash log decoder: turns the binary log segments & histograms
+# copied from a counter into the text log{n}.txt & histogram{n}.txt files
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import os
+import re
+import sys
+import struct
+
+# ticks, num, temp & light in thousandths, as written by the counters
+RECORD = struct.Struct('<IIII')
+TEMP_OFFSET = 100
+SEGMENT_RECORDS = 16
+HIST_COUNT = struct.Struct('<I')
+HIST_DELTA = 0.01
+
+SEGMENT_RE = re.compile(r'^log([A-Z]?)(\d+)\.bin$')
+HIST_RE = re.compile(r'^histogram(\d+)\.bin$')
+
+def decode_record(record):
+    ts, num, temp, light = record
+    return ts, num, round(temp / 1000.0 - TEMP_OFFSET, 3), round(light / 1000.0, 3)
+
+def read_segments(path):
+    segments = {}
+    for name in os.listdir(path):
+        match = SEGMENT_RE.match(name)
+        if match:
+            segments.setdefault(match.group(1), []).append((int(match.group(2)), name))
+    return {prefix: sorted(names) for prefix, names in segments.items()}
+
+# A boot starts a new segment, so a segment after a partial one starts
+# a new log. So does a smaller tick, as the device clock restarts.
+def split_boots(path, names):
+    boots = []
+    last_ts = None
+    for _, name in names:
+        f = open(os.path.join(path, name), 'rb')
+        data = f.read()
+        f.close()
+        for record in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+            record = decode_record(record)
+            if last_ts is None or record[0] < last_ts:
+                boots.append([])
+            boots[-1].append(record)
+            last_ts = record[0]
+        if len(data) < RECORD.size * SEGMENT_RECORDS:
+            last_ts = None
+    return boots
+
+def write_text(path, lines):
+    f = open(path, 'w')
+    for line in lines:
+        f.write('{}\n'.format(' '.join(map(str, line))))
+    f.close()
+
+def decode_dir(path, outdir):
+    written = []
+    for prefix, names in read_segments(path).items():
+        for i, boot in enumerate(split_boots(path, names)):
+            name = 'log{}{}.txt'.format(prefix, i)
+            write_text(os.path.join(outdir, name), boot)
+            written.append(name)
+    hists = sorted((int(m.group(1)), m.group(0)) for m in
+                   (HIST_RE.match(name) for name in os.listdir(path)) if m)
+    for i, (_, hist) in enumerate(hists):
+        f = open(os.path.join(path, hist), 'rb')
+        data = f.read()
+        f.close()
+        counts = [c[0] for c in HIST_COUNT.iter_unpack(data)]
+        name = 'histogram{}.txt'.format(i)
+        write_text(os.path.join(outdir, name), ((step * HIST_DELTA, c) for step, c in enumerate(counts)))
+        written.append(name)
+    return written
+
+def usage():
+    sys.stderr.write('Hamster flash log decoder\n'
+                     'Usage: {} <device files dir> [output dir]\n'.format(sys.argv[0]))
+    exit(1)
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        usage()
+    outdir = sys.argv[2] if len(sys.argv) == 3 else sys.argv[1]
+    for name in decode_dir(sys.argv[1], outdir):
+        print(name)
@@ -0,0 +1,132 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: serial stream framer
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+class SerialFramer(object):
+
+    SEPARATOR = b'\r\n'
+    MAX_FRAME = 4096
+
+    def __init__(self, separator=SEPARATOR, max_frame=MAX_FRAME):
+        self.separator = separator
+        self.max_frame = max_frame
+        self.__buf = bytearray()
+
+    def feed(self, data):
+        self.__buf += data
+
+    def pending(self):
+        return len(self.__buf)
+
+    # Yields memoryviews into the internal buffer. Each frame is valid only
+    # until the next iteration step, so copy it with bytes() to keep it.
+    def frames(self):
+        buf = self.__buf
+        seplen = len(self.separator)
+        start = 0
+        view = memoryview(buf)
+        try:
+            while True:
+                index = buf.find(self.separator, start)
+                if index < 0:
+                    break
+                frame = view[start:index]
+                start = index + seplen
+                yield frame
+                frame.release()
+        finally:
+            view.release()
+            self.__compact(start)
+
+    def __compact(self, start):
+        buf = self.__buf
+        if len(buf) - start > self.max_frame:
+            # garbage without a separator, drop it
+            start = len(buf)
+        if not start:
+            return
+        try:
+            del buf[:start]
+        except BufferError:
+            # a frame view is still referenced by the consumer
+            self.__buf = bytearray(buf[start:])
+
+# CRC-8 (polynomial 0x07) as computed by magnet-server.py
+def make_crc8_table():
+    table = bytearray(256)
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = ((c << 1) ^ 0x07) & 0xff if c & 0x80 else (c << 1) & 0xff
+        table[i] = c
+    return table
+
+CRC8_TABLE = make_crc8_table()
+
+def crc8(data):
+    crc = 0
+    for b in data:
+        crc = CRC8_TABLE[crc ^ b]
+    return crc
+
+def cobs_encode(data):
+    out = bytearray([0])
+    code_index = 0
+    code = 1
+    for b in data:
+        if b:
+            out.append(b)
+            code += 1
+        if not b or code == 0xff:
+            out[code_index] = code
+            code_index = len(out)
+            out.append(0)
+            code = 1
+    out[code_index] = code
+    return bytes(out)
+
+def cobs_decode(data):
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        code = data[i]
+        if not code or i + code > len(data):
+            return None
+        out += data[i + 1:i + code]
+        i += code
+        if code < 0xff and i < len(data):
+            out.append(0)
+    return bytes(out)
+
+def encode_frame(payload):
+    return cobs_encode(payload + bytes([crc8(payload)])) + BinaryFramer.SEPARATOR
+
+class BinaryFramer(SerialFramer):
+
+    SEPARATOR = b'\x00'
+
+    # COBS frames ending with a zero byte; the last byte of a decoded frame
+    # is the CRC-8 of the rest. Frames are bytes, bad ones are dropped.
+    def __init__(self, max_frame=SerialFramer.MAX_FRAME):
+        SerialFramer.__init__(self, self.SEPARATOR, max_frame)
+        self.bad_frames = 0
+
+    def frames(self):
+        frames = SerialFramer.frames(self)
+        try:
+            for frame in frames:
+                if not len(frame):
+                    continue
+                data = cobs_decode(frame)
+                if data is None or len(data) < 2 or crc8(data[:-1]) != data[-1]:
+                    self.bad_frames += 1
+                    continue
+                yield data[:-1]
+        finally:
+            frames.close()
@@ -9,10 +9,10 @@
 # -----------------------------------------------------------------------------
 
 import sys
-import os
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import google.auth
+import archiver
 
 SECRET_FILE = 'credentials.json'
 USER_ID = 'aleksey.fedoseev@gmail.com'
@@ -53,9 +53,9 @@ def usage():
           'creating new worksheet for the <date>')
     exit(1)
 
-def read_csv_file(filename):
+def read_csv_file(date, filename):
     try:
-        f = open(filename)
+        f = archiver.open_day_file(DATA_DIR, date, filename)
     except FileNotFoundError:
         return None
     d = []
@@ -92,8 +92,7 @@ if __name__ == '__main__':
         else:
             start_time = DEFAULT_START_TIME
         date = sys.argv[2]
-        datadir = os.listdir(DATA_DIR)
-        if date not in datadir:
+        if date not in archiver.list_days(DATA_DIR):
             error('No date {} found in the data dir {}'.format(date, DATA_DIR))
         datedir = "{}/{}".format(DATA_DIR, date)
     else:
@@ -101,9 +100,9 @@ if __name__ == '__main__':
 
     try:
         if command == 'upload':
-            logdata = read_csv_file("{}/{}".format(datedir, LOG_FILE))
-            histdata = read_csv_file("{}/{}".format(datedir, HISTOGRAM_FILE))
-            fulldata = read_csv_file("{}/{}".format(datedir, FULLLOG_FILE))
+            logdata = read_csv_file(date, LOG_FILE)
+            histdata = read_csv_file(date, HISTOGRAM_FILE)
+            fulldata = read_csv_file(date, FULLLOG_FILE)
 
             if not logdata and not histdata and not fulldata:
                 error('No data to upload in the dir {}'.format(datedir))
@@ -27,23 +27,72 @@ class HamsterSheet(object):
     USER_ID = 'aleksey.fedoseev@gmail.com'
     SEPARATOR = ' '
 
-    def __init__(self, date, event_log, summary_log):
-        self.__create_sheet(date)
-        self.__share_to(self.USER_ID)
-        self.__insert_summary_log(summary_log)
-        self.__insert_event_log(event_log)
+    SUMMARY_DEVICE = 'A'
+    SUMMARY_COLUMNS = 6
+    VALUE_INPUT_OPTION = 'USER_ENTERED'
+
+    def __init__(self, date, store, checkpoint=None):
+        self.__authorize()
+        self.__checkpoint = None
+        if checkpoint is not None and self.__is_current(checkpoint, store):
+            self.__open_sheet(checkpoint)
+        if self.__checkpoint is None:
+            self.__create_sheet(date)
+            self.__share_to(self.USER_ID)
+            self.__checkpoint = {'sheet_id': self.__sheet_id,
+                                 'summary_rows': 0,
+                                 'columns': {},
+                                 'rows': {}}
+        self.__upload(store)
 
     def get_url(self):
         return self.__sheet_id
 
-    def __create_sheet(self, date):
-        name = self.SHEET_NAME_FORMAT.format(date)
+    def get_checkpoint(self):
+        return self.__checkpoint
+
+    # A checkpoint left by a previous run has more rows than the store
+    def __is_current(self, checkpoint, store):
+        summary = store.summaries.get(self.SUMMARY_DEVICE)
+        if checkpoint['summary_rows'] > (len(summary) if summary else 0):
+            return False
+        for k, rows in checkpoint['rows'].items():
+            if k not in store.events or rows > len(store.events[k]):
+                return False
+        return True
+
+    def __authorize(self):
         scope = ['https://www.googleapis.com/auth/spreadsheets',
                  'https://www.googleapis.com/auth/drive']
-        creds = ServiceAccountCredentials.from_json_keyfile_name(self.SECRET_FILE, scope)
-        self.__client = gspread.authorize(creds)
         try:
-            self.__sheet = self.__client.open(name)
+            creds = ServiceAccountCredentials.from_json_keyfile_name(self.SECRET_FILE, scope)
+            self.__client = gspread.authorize(creds)
+        except gspread.exceptions.GSpreadException as e:
+            raise SheetException('error while authorizing: {}'.format(e))
+        except google.auth.exceptions.TransportError as e:
+            raise SheetException('sheets connection error: {}'.format(e))
+
+    def __open_sheet(self, checkpoint):
+        try:
+            self.__spreadsheet = self.__client.open_by_key(checkpoint['sheet_id'])
+        except gspread.SpreadsheetNotFound:
+            dprint('sheet {} not found, recreating'.format(checkpoint['sheet_id']))
+            return
+        except gspread.exceptions.GSpreadException as e:
+            raise SheetException('error while opening sheet: {}'.format(e))
+        except google.auth.exceptions.TransportError as e:
+            raise SheetException('sheets connection error: {}'.format(e))
+        self.__sheet_id = self.__spreadsheet.id
+        self.__sheet = self.__spreadsheet.sheet1
+        self.__checkpoint = {'sheet_id': checkpoint['sheet_id'],
+                             'summary_rows': checkpoint['summary_rows'],
+                             'columns': dict(checkpoint['columns']),
+                             'rows': dict(checkpoint['rows'])}
+
+    def __create_sheet(self, date):
+        name = self.SHEET_NAME_FORMAT.format(date)
+        try:
+            self.__spreadsheet = self.__client.open(name)
         except gspread.SpreadsheetNotFound:
             pass
         except gspread.exceptions.GSpreadException as e:
@@ -51,66 +100,90 @@ class HamsterSheet(object):
         except google.auth.exceptions.TransportError as e:
             raise SheetException('sheets connection error: {}'.format(e))
         else:
-            self.__client.del_spreadsheet(self.__sheet.id)
-        self.__sheet = self.__client.create(name)
-        self.__sheet_id = self.__sheet.id
+            self.__client.del_spreadsheet(self.__spreadsheet.id)
+        self.__spreadsheet = self.__client.create(name)
+        self.__sheet_id = self.__spreadsheet.id
         dprint('created {}'.format(self.__sheet_id))
-        self.__sheet = self.__sheet.sheet1
+        self.__sheet = self.__spreadsheet.sheet1
         self.__sheet.update_title(date)
 
     def __share_to(self, user):
         self.__client.insert_permission(self.__sheet_id, user,
                                         perm_type='user', role='reader', with_link=False)
 
-    def __insert_array(self, r, array):
-        cells = self.__sheet.range(r)
-        for idx, value in enumerate(array):
-            cells[idx].value = value
-        self.__sheet.update_cells(cells, value_input_option='USER_ENTERED')
-
-    def __insert_matrix(self, r, array):
-        columns = len(array[0])
-        cells = self.__sheet.range(r)
-        for rowidx, a in enumerate(array):
-            for colidx, value in enumerate(a):
-                cells[rowidx * columns + colidx].value = value
-        self.__sheet.update_cells(cells, value_input_option='USER_ENTERED')
-
-    def __insert_event_log(self, event_log):
-        try:
-            keys = sorted(event_log.keys())
-            if not keys:
-                return
-            self.__insert_array('G1:{}1'.format(chr(ord('G') + len(keys) - 1)), keys)
-            for i, k in enumerate(keys):
-                column = chr(ord('G') + i)
-                events = event_log[k]
-                self.__insert_array('{}1:{}{}'.format(column, column, len(events)),
-                                    events)
-        except gspread.exceptions.GSpreadException as e:
-            raise SheetException('error while saving events log: {}'.format(e))
-        except google.auth.exceptions.TransportError as e:
-            raise SheetException('error while saving events log: {}'.format(e))
+    def __range(self, row1, col1, row2, col2):
+        return "'{}'!{}:{}".format(self.__sheet.title,
+                                   gspread.utils.rowcol_to_a1(row1, col1),
+                                   gspread.utils.rowcol_to_a1(row2, col2))
+
+    # The summary block is small and backfilled lines may be merged into
+    # its middle, so it is rewritten whenever it grows.
+    def __summary_block(self, summary_log):
+        log = summary_log.get(self.SUMMARY_DEVICE)
+        if not log or len(log) == self.__checkpoint['summary_rows']:
+            return []
+        matrix = []
+        for i, (local_ts, ts, num, temp, light) in enumerate(log):
+            tt = datetime.datetime.fromtimestamp(local_ts).timetuple()
+            hour, minute, sec = tt[3:6]
+            if i == 0:
+                s = '0'
+            else:
+                s = '=C{}-C{}'.format(i + 1, i)
+            matrix.append(['{:02d}:{:02d}:{:02d}'.format(hour, minute, sec),
+                           ts, num, temp, light, s])
+        return [{'range': self.__range(1, 1, len(matrix), self.SUMMARY_COLUMNS),
+                 'values': matrix}]
 
-    def __insert_summary_log(self, summary_log):
+    # Event columns only grow, so just the rows past the checkpoint are sent.
+    def __event_blocks(self, event_log, columns):
+        first = self.SUMMARY_COLUMNS + 1
+        blocks = []
+        keys = sorted(columns.keys(), key=lambda k: columns[k])
+        if len(keys) > len(self.__checkpoint['columns']):
+            blocks.append({'range': self.__range(1, first, 1, first + len(keys) - 1),
+                           'values': [keys]})
+        for k in keys:
+            if k not in event_log:
+                continue
+            column = first + columns[k]
+            events = event_log[k].local_ts
+            start = self.__checkpoint['rows'].get(k, 0)
+            if len(events) <= start:
+                continue
+            blocks.append({'range': self.__range(start + 2, column, len(events) + 1, column),
+                           'majorDimension': 'COLUMNS',
+                           'values': [events[start:].tolist()]})
+        return blocks
+
+    def __fit_sheet(self, summary_log, event_log, columns):
+        rows = len(summary_log.get(self.SUMMARY_DEVICE, ()))
+        for column in event_log.values():
+            rows = max(rows, len(column) + 1)
+        cols = self.SUMMARY_COLUMNS + len(columns)
+        if rows > self.__sheet.row_count or cols > self.__sheet.col_count:
+            self.__sheet.resize(max(rows, self.__sheet.row_count),
+                                max(cols, self.__sheet.col_count))
+
+    def __upload(self, store):
+        columns = dict(self.__checkpoint['columns'])
+        for k in sorted(store.events.keys()):
+            if k not in columns:
+                columns[k] = len(columns)
         try:
-            if 'A' not in summary_log:
-                return
-            log = summary_log['A']
-            if not log:
+            data = (self.__summary_block(store.summaries) +
+                    self.__event_blocks(store.events, columns))
+            if not data:
                 return
-            matrix = []
-            for i, cell in enumerate(log):
-                tt = datetime.datetime.fromtimestamp(cell[0]).timetuple()
-                hour, minute, sec = tt[3:6]
-                if i == 0:
-                    s = '0'
-                else:
-                    s = '=C{}-C{}'.format(i + 1, i)
-                matrix.append(('{:02d}:{:02d}:{:02d}'.format(hour, minute, sec),
-                               cell[1], cell[2], cell[3], cell[4], s))
-            self.__insert_matrix('A1:F{}'.format(len(log)), matrix)
+            self.__fit_sheet(store.summaries, store.events, columns)
+            self.__spreadsheet.values_batch_update({'valueInputOption': self.VALUE_INPUT_OPTION,
+                                                    'data': data})
         except gspread.exceptions.GSpreadException as e:
-            raise SheetException('error while saving summary log: {}'.format(e))
+            raise SheetException('error while saving logs: {}'.format(e))
         except google.auth.exceptions.TransportError as e:
-            raise SheetException('error while saving summary log: {}'.format(e))
+            raise SheetException('error while saving logs: {}'.format(e))
+        dprint('uploaded {} ranges to {}'.format(len(data), self.__sheet_id))
+        summary = store.summaries.get(self.SUMMARY_DEVICE)
+        self.__checkpoint['summary_rows'] = len(summary) if summary else 0
+        self.__checkpoint['columns'] = columns
+        self.__checkpoint['rows'] = dict((k, len(v)) for k, v in store.events.items())
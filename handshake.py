@@ -0,0 +1,171 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: concurrent start & time handshake with the receivers
+#
+# STA and TIM are sent together: the receiver keeps the rest of its serial
+# buffer after STA, so it answers TIM with OKE as soon as it polls the port.
+# Every port waits for its OKE on its own and resends on a timeout.
+#
+# With a baud rate given STA asks for the binary frames: the receiver
+# answers "BIN <baud>" in text & switches to the COBS frames at that rate.
+# A receiver left in the binary mode by an earlier run only hears its own
+# rate. The second half of the attempts first sends a plain STA at every
+# binary rate, which brings the receiver back to the text lines at the
+# default rate, and then starts over in text.
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import time
+import asyncio
+from serialport import SerialPort, SerialException
+from debug import dprint, warning
+
+SYSTEM_START = 'STA'
+SYSTEM_TIME = 'TIM'
+SYSTEM_OK = b'OKE'
+SYSTEM_BINARY = 'BIN'
+# the receiver's binary mode rates (UART_BAUDS of magnet-server.py)
+BINARY_BAUDS = (230400, 460800, 921600, 1000000)
+
+TIMEOUT = 0.25		# seconds to wait for OKE after a send
+RETRIES = 4
+RESET_WAIT = 0.05	# seconds for the receiver to go back to the text mode
+
+class HandshakeResult(object):
+
+    def __init__(self, address):
+        self.address = address
+        self.ok = False
+        self.binary = False
+        self.baud = None
+        self.attempts = 0
+        self.elapsed = 0.0
+        self.error = None
+        # data frames that came before OKE, to be processed by the caller
+        self.frames = []
+
+class PortHandshake(object):
+
+    def __init__(self, sport, timeout=TIMEOUT, retries=RETRIES, baud=None):
+        self.sport = sport
+        self.timeout = timeout
+        self.retries = retries
+        self.baud = baud
+        self.result = HandshakeResult(sport.device)
+        self.__readable = asyncio.Event()
+
+    def __send_time(self):
+        self.sport.send('{} {}'.format(SYSTEM_TIME, int(time.time())))
+
+    def __send(self):
+        if self.baud is None:
+            self.sport.send(SYSTEM_START)
+        else:
+            self.sport.send('{} {} {}'.format(SYSTEM_START, SYSTEM_BINARY, self.baud))
+        self.__send_time()
+
+    # The empty lines end the garbage heard at the other rates
+    async def __reset_receiver(self):
+        for baud in BINARY_BAUDS:
+            self.sport.set_mode(baud, True)
+            self.sport.send('')
+            self.sport.send(SYSTEM_START)
+        self.sport.set_text()
+        self.sport.send('')
+        await asyncio.sleep(RESET_WAIT)
+
+    # The TIM sent with STA may come at the old rate, so it is repeated
+    def __switch(self, frame):
+        try:
+            baud = int(frame.split(b' ')[1])
+        except (IndexError, ValueError):
+            return
+        if not self.sport.binary or baud != self.sport.baud:
+            self.sport.set_binary(baud)
+        self.sport.send('')
+        self.__send_time()
+
+    # OKE is searched among the frames of the port's own framer, so the
+    # frames & the partial frame after it are left for the listener
+    def __check_frames(self):
+        self.sport.framer.feed(self.sport.read_available())
+        frames = self.sport.framer.frames()
+        for frame in frames:
+            frame = bytes(frame)
+            if frame.strip() == SYSTEM_OK:
+                frames.close()
+                return True
+            if frame.startswith(SYSTEM_BINARY.encode()):
+                # the rest of the buffer came at the new rate
+                frames.close()
+                self.__switch(frame)
+                return False
+            self.result.frames.append(frame)
+        return False
+
+    async def __wait_ok(self, loop):
+        deadline = loop.time() + self.timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self.__readable.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+            self.__readable.clear()
+            if self.__check_frames():
+                return True
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        fd = self.sport.fileno()
+        loop.add_reader(fd, self.__readable.set)
+        try:
+            while self.result.attempts < self.retries and not self.result.ok:
+                self.result.attempts += 1
+                if self.result.attempts > max(1, self.retries // 2):
+                    await self.__reset_receiver()
+                self.__send()
+                self.result.ok = await self.__wait_ok(loop)
+        except SerialException as e:
+            self.result.error = str(e)
+        finally:
+            loop.remove_reader(fd)
+        self.result.elapsed = loop.time() - start
+        self.result.binary = self.sport.binary
+        self.result.baud = self.sport.baud
+        return self.result
+
+async def __handshake(sports, timeout, retries, baud):
+    return await asyncio.gather(*[PortHandshake(s, timeout, retries, baud).run()
+                                  for s in sports])
+
+# Binary frames at the baud rate are asked for unless it is None
+def handshake(sports, timeout=TIMEOUT, retries=RETRIES, baud=None):
+    results = asyncio.run(__handshake(sports, timeout, retries, baud))
+    for r in results:
+        if r.ok:
+            dprint('{}: time ok in {:.0f} ms ({} attempts){}'.format(
+                r.address, r.elapsed * 1000, r.attempts,
+                ', binary frames at {}'.format(r.baud) if r.binary else ''))
+        else:
+            warning('{}: no answer after {} attempts{}', r.address, r.attempts,
+                    ': ' + r.error if r.error else '')
+    return results
+
+# Opens, handshakes & closes all the ports
+def handshake_addresses(addresses, timeout=TIMEOUT, retries=RETRIES, baud=None):
+    sports = []
+    try:
+        for address in addresses:
+            sports.append(SerialPort(address))
+        return handshake(sports, timeout, retries, baud)
+    finally:
+        for s in sports:
+            s.close()
@@ -11,144 +11,214 @@
 import os
 import datetime
 import time
-import hamstersheet
-from debug import dprint
+from uploader import SheetUploader
+from logwriter import LogWriter
+from daystore import DayStore
+from wal import WriteAheadLog
+from debug import dprint, debug, warning
 
 class EventLogger(object):
 
     DATA_DIR = 'data'
     PATH_TEMPLATE = '{}/{}.log'
-    SHEETS_PATH_TEMPLATE = '{}/sheets.log'
     PATH_RENAME_TEMPLATE = '{}/{}-{:02d}.log'
     DAY_EVENT_LOG_NAME = 'events'
     DAY_SUMMARY_LOG_NAME = 'summary'
+    DAY_START_HOUR = 12
 
-    def __init__(self, datadir=DATA_DIR):
+    def __init__(self, datadir=DATA_DIR, writer=None, uploader=None, sync_period=None,
+                 archiver=None, tsstore=None, wal_policy=None):
         self.__datadir = datadir
-        self.__save_logname = None
+        self.__sync_period = sync_period
+        self.__last_save = time.time()
+        if writer is None:
+            writer = LogWriter()
+        self.__writer = writer
+        if uploader is None:
+            uploader = SheetUploader(datadir)
+        self.__uploader = uploader
+        self.__archiver = archiver
+        self.__tsstore = tsstore
+        self.__wal_policy = wal_policy
+        self.__wal = None
+        # the full log dump open for every device, several receivers
+        # may send theirs at the same time, the dumps live in the current
+        # day dir and go on in the next one after the noon
+        self.__save_lognames = {}
+        self.__pending_lines = {}
+        self.__prev_date = None
         self.__date = None
         self.__daydir = None
-        self.__event_log = None
-        self.__summary_log = None
+        self.__store = None
         self.newday()
 
-    def __save_sheet_address(self, date, sheet):
-        logf = open(self.SHEETS_PATH_TEMPLATE.format(self.__datadir), 'a')
-        logf.write('{} {}\n'.format(date, sheet))
-        logf.close()
-
     def __sync_log_to_gsheets(self):
-        try:
-            sh = hamstersheet.HamsterSheet(self.__date,
-                                           self.__event_log,
-                                           self.__summary_log)
-            url = sh.get_url()
-            dprint('uploaded sheet {}'.format(url))
-            self.__save_sheet_address(self.__date, url)
-        except hamstersheet.SheetException as e:
-            dprint('error while uploading sheet: {}'.format(e))
+        self.__uploader.upload(self.__date, self.__store.snapshot())
 
     def save(self):
-        if self.__event_log != None:
+        if self.__pending_lines:
+            self.__merge_summary_logs()
+        self.__writer.flush()
+        if self.__tsstore is not None:
+            self.__tsstore.flush()
+        self.__last_save = time.time()
+        if self.__store is not None:
+            if self.__wal is not None:
+                self.__wal.snapshot(self.__store)
+            self.__report_memory()
             self.__sync_log_to_gsheets()
 
+    def close(self):
+        self.save()
+        self.__writer.close_all()
+        self.__uploader.close()
+        if self.__archiver is not None:
+            self.__archiver.close()
+        if self.__tsstore is not None:
+            self.__tsstore.close()
+        if self.__wal is not None:
+            self.__wal.close()
+
+    def __report_memory(self):
+        usage = self.__store.memory_usage()
+        for device in sorted(usage.keys()):
+            dprint('device {} day log memory {} bytes'.format(device, usage[device]))
+
+    # the day goes from noon to noon, before the noon the previous date is still open
+    def __open_date(self):
+        dt = datetime.datetime.now() - datetime.timedelta(hours=self.DAY_START_HOUR)
+        tt = dt.timetuple()
+        return '{:02d}.{:02d}'.format(tt[2], tt[1])
+
     def newday(self):
         self.save()
-        self.__event_log = {}
-        self.__summary_log = {}
-        tt = datetime.datetime.now().timetuple()
-        month = tt[1]
-        day = tt[2]
-        self.__date = '{:02d}.{:02d}'.format(day, month)
+        self.__writer.close_all()
+        if self.__wal is not None:
+            self.__wal.discard()
+        self.__date = self.__open_date()
         self.__daydir = '{}/{}'.format(self.__datadir, self.__date)
         if not os.path.exists(self.__daydir):
             os.mkdir(self.__daydir)
         else:
             self.__rename_log(self.DAY_EVENT_LOG_NAME)
             self.__rename_log(self.DAY_SUMMARY_LOG_NAME)
+        # the closed day dir is archived, so the open dumps move on
+        for logname in self.__save_lognames.values():
+            self.__rename_log(logname)
+        if self.__wal_policy is not None:
+            self.__wal = WriteAheadLog(self.__daydir, self.__wal_policy)
+            self.__store = self.__wal.restore()
+        else:
+            self.__store = DayStore()
+        if self.__archiver is not None:
+            self.__archiver.archive_past(self.__date)
         self.__day_event_log = self.PATH_TEMPLATE.format(self.__daydir,
                                                          self.DAY_EVENT_LOG_NAME)
         self.__day_summary_log = self.PATH_TEMPLATE.format(self.__daydir,
                                                            self.DAY_SUMMARY_LOG_NAME)
 
+    def check_day(self):
+        dt = datetime.datetime.now()
+        if self.__prev_date is not None:
+            tt1 = self.__prev_date.timetuple()
+            tt2 = dt.timetuple()
+            if tt1[3] < self.DAY_START_HOUR and tt2[3] >= self.DAY_START_HOUR:
+                dprint('-' * 80)
+                dprint('starting new day {:02d}.{:02d}'.format(tt2[2], tt2[1]))
+                self.newday()
+        if (self.__sync_period is not None and
+                time.time() - self.__last_save >= self.__sync_period):
+            self.save()
+        self.__prev_date = dt
+        self.__writer.poll()
+        if self.__wal is not None:
+            self.__wal.poll()
+            if self.__wal.needs_snapshot():
+                self.__wal.snapshot(self.__store)
+
     def event(self, device, ts, num, temp, light):
         local_ts = time.time()
         self.__save_to_log(self.__day_event_log,
                            local_ts, device, ts, num, temp, light)
-        if device not in self.__event_log:
-            self.__event_log[device] = []
-        evlog = self.__event_log[device]
-        local_num = len(evlog)
-        diff = num - local_num
-        for _ in range(diff):
-            evlog.append(local_ts)
+        if self.__wal is not None:
+            self.__wal.event(device, local_ts, ts, num, temp, light)
+        self.__store.event(device, local_ts, num)
+        if self.__tsstore is not None:
+            self.__tsstore.event(device, local_ts, ts, num, temp, light)
 
     def summary(self, device, ts, num, temp, light):
         local_ts = time.time()
         self.__save_to_log(self.__day_summary_log,
                            local_ts, device, ts, num, temp, light)
-        if device not in self.__summary_log:
-            self.__summary_log[device] = []
-        self.__summary_log[device].append((local_ts, ts, num, temp, light))
+        if self.__wal is not None:
+            self.__wal.summary(device, local_ts, ts, num, temp, light)
+        self.__store.summary_log(device).append(local_ts, ts, num, temp, light)
+        if self.__tsstore is not None:
+            self.__tsstore.summary(device, local_ts, ts, num, temp, light)
 
     def __correct_summary_log(self, device, ts, num, temp, light):
         local_ts = time.time()
-        if device not in self.__summary_log:
-            self.__summary_log[device] = [(local_ts, ts, num, temp, light)]
-        else:
-            sumlog = self.__summary_log[device]
-            assert sumlog
-            prev_ts = 0
-            for i, log in enumerate(sumlog):
-                remote_ts = log[1]
-                if ts == remote_ts:
-                    return
-                if prev_ts < ts < remote_ts:
-                    dprint('correcting log at position {} < {} < {}'.format(prev_ts, ts, remote_ts))
-                    sumlog.insert(i, (log[0], ts, num, temp, light))
-                    return
-                prev_ts = remote_ts
-            dprint('correcting log - appending data ts {}'.format(ts))
-            sumlog.append((local_ts, ts, num, temp, light))
-
-    @classmethod
-    def __save_to_log(cls, logname, local_ts, device, ts, num, temp, light):
-        logf = open(logname, 'a')
-        logf.write('{} {} {} {} {} {}\n'.format(local_ts,
-                                                device,
-                                                ts,
-                                                num,
-                                                temp,
-                                                light))
-        logf.close()
+        if self.__wal is not None:
+            self.__wal.insert(device, local_ts, ts, num, temp, light)
+        sumlog = self.__store.summary_log(device)
+        if sumlog.insert_sorted(local_ts, ts, num, temp, light):
+            debug('correcting log - inserted data ts {}', ts)
+
+    def __merge_summary_logs(self, devices=None):
+        local_ts = time.time()
+        if devices is None:
+            devices = list(self.__pending_lines)
+        for device in devices:
+            rows = self.__pending_lines.pop(device, None)
+            if not rows:
+                continue
+            if self.__wal is not None:
+                self.__wal.merge(device, local_ts, rows)
+            merged = self.__store.summary_log(device).merge(local_ts, rows)
+            dprint('correcting log - merged {} of {} lines from {}'.format(merged,
+                                                                           len(rows),
+                                                                           device))
+
+    def __save_to_log(self, logname, local_ts, device, ts, num, temp, light):
+        self.__writer.write(logname, '{} {} {} {} {} {}\n'.format(local_ts,
+                                                                  device,
+                                                                  ts,
+                                                                  num,
+                                                                  temp,
+                                                                  light))
 
     def __rename_log(self, checkname):
+        existing = set('{}/{}'.format(self.__daydir, name) for name in os.listdir(self.__daydir))
         checkpath = self.PATH_TEMPLATE.format(self.__daydir, checkname)
-        if os.path.exists(checkpath):
+        if checkpath in existing:
             postfix = 0
             newname = checkpath
-            while os.path.exists(newname):
+            while newname in existing:
                 newname = self.PATH_RENAME_TEMPLATE.format(self.__daydir, checkname, postfix)
                 postfix += 1
             os.rename(checkpath, newname)
 
-    def start_log(self, logname):
-        if self.__save_logname is not None:
-            self.finish_log()
+    def start_log(self, device, logname):
+        if device in self.__save_lognames:
+            self.finish_log(device)
         self.__rename_log(logname)
-        self.__save_logname = self.PATH_TEMPLATE.format(self.__daydir, logname)
+        self.__save_lognames[device] = logname
 
     def log_data(self, device, ts, num, temp, light):
-        self.__correct_summary_log(device, ts, num, temp, light)
-        if self.__save_logname is None:
-            dprint('cannot log to empty file')
+        logname = self.__save_lognames.get(device)
+        if logname is None:
+            self.__correct_summary_log(device, ts, num, temp, light)
+            warning('cannot log to empty file')
         else:
-            logf = open(self.__save_logname, 'a')
-            logf.write('{} {} {} {}\n'.format(ts,
-                                              num,
-                                              temp,
-                                              light))
-            logf.close()
-
-    def finish_log(self):
-        self.__save_logname = None
+            if device not in self.__pending_lines:
+                self.__pending_lines[device] = []
+            self.__pending_lines[device].append((ts, num, temp, light))
+            self.__writer.write(self.PATH_TEMPLATE.format(self.__daydir, logname),
+                                '{} {} {} {}\n'.format(ts, num, temp, light))
+
+    def finish_log(self, device):
+        if device in self.__pending_lines:
+            self.__merge_summary_logs([device])
+        logname = self.__save_lognames.pop(device, None)
+        if logname is not None:
+            self.__writer.close(self.PATH_TEMPLATE.format(self.__daydir, logname))
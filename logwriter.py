@@ -0,0 +1,96 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: buffered log writer
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import os
+import time
+from metrics import METRICS
+
+class LogWriter(object):
+
+    SYNC_NONE = 'none'
+    SYNC_BATCH = 'batch'
+    SYNC_PERIODIC = 'periodic'
+
+    FLUSH_SIZE = 64 * 1024		# bytes
+    FLUSH_TIME = 1.0			# seconds
+    SYNC_PERIOD = 5.0			# seconds
+
+    def __init__(self, sync_policy=SYNC_NONE, sync_period=SYNC_PERIOD,
+                 flush_size=FLUSH_SIZE, flush_time=FLUSH_TIME):
+        assert sync_policy in (self.SYNC_NONE, self.SYNC_BATCH, self.SYNC_PERIODIC)
+        self.sync_policy = sync_policy
+        self.sync_period = sync_period
+        self.flush_size = flush_size
+        self.flush_time = flush_time
+        self.__files = {}
+        self.__pending = {}
+        self.__pending_size = 0
+        self.__last_flush = self.__last_sync = time.time()
+
+    def write(self, path, line):
+        if path not in self.__pending:
+            self.__pending[path] = []
+        self.__pending[path].append(line)
+        self.__pending_size += len(line)
+        if self.__pending_size >= self.flush_size:
+            self.flush()
+        else:
+            self.poll()
+
+    def poll(self):
+        t = time.time()
+        if self.__pending_size and t - self.__last_flush >= self.flush_time:
+            self.flush()
+        elif (self.sync_policy == self.SYNC_PERIODIC and
+              t - self.__last_sync >= self.sync_period):
+            self.__sync(t)
+
+    def __open(self, path):
+        f = self.__files.get(path)
+        if f is None:
+            f = open(path, 'a')
+            self.__files[path] = f
+        return f
+
+    def __sync(self, t):
+        for f in self.__files.values():
+            os.fsync(f.fileno())
+        self.__last_sync = t
+
+    def flush(self):
+        start = time.perf_counter()
+        t = time.time()
+        for path, lines in self.__pending.items():
+            if not lines:
+                continue
+            f = self.__open(path)
+            f.write(''.join(lines))
+            f.flush()
+        self.__pending = {}
+        self.__pending_size = 0
+        self.__last_flush = t
+        if (self.sync_policy == self.SYNC_BATCH or
+            (self.sync_policy == self.SYNC_PERIODIC and
+             t - self.__last_sync >= self.sync_period)):
+            self.__sync(t)
+        METRICS.flush_time.observe(time.perf_counter() - start)
+
+    def close(self, path):
+        self.flush()
+        f = self.__files.pop(path, None)
+        if f is not None:
+            if self.sync_policy != self.SYNC_NONE:
+                os.fsync(f.fileno())
+            f.close()
+
+    def close_all(self):
+        self.flush()
+        for path in list(self.__files.keys()):
+            self.close(path)
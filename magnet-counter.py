@@ -25,21 +25,30 @@ SENSOR_MEASURE_TIME = 10 * 1000		# 10 sec
 POWER_OFF_TIME = 12 * 60 * 60 * 1000 	# 12 hours
 
 LOG_FILENAME_PREFIX = 'log' + DEVICE
-LOG_FILENAME = LOG_FILENAME_PREFIX + '{}.txt'
+SEGMENT_POSTFIX = '.bin'
+SEGMENT_FILENAME = LOG_FILENAME_PREFIX + '{}' + SEGMENT_POSTFIX
+RECORD_SIZE = 16			# ticks, num, temp & light in thousandths
+SEGMENT_RECORDS = 16			# 8 hours, rewritten on every sync
+SEGMENT_SIZE = RECORD_SIZE * SEGMENT_RECORDS
+LOG_CAPACITY = 24 * 1024		# flash bytes for the log segments
+TEMP_OFFSET = 100			# keeps the stored temperature positive
 
 RADIO_CODE_LOG = 'LOG'
 RADIO_CODE_EVENT = 'EVN'
 RADIO_CODE_FILE = 'FIL'
-RADIO_CODE_LINE = 'LIN'
 RADIO_CODE_EOF = 'EOF'
+RADIO_CODE_PACKED = 'LPK'
 DATA_BYTES_ORDER = 'little'
 SEND_TIMEOUT = 10
 RADIO_BUFFER = 32
+# string header, code, device, sequence number & checksum take the rest
+PACKED_BYTES = RADIO_BUFFER - 3 - 4 - 2
 RADIO_QUEUE = 2
 RADIO_CHANNEL = 1
 
 baseline = num = crossing = show_num = last_change = None
-num_buf = last_sync = file_num = None
+segment_buf = last_sync = None
+first_segment = segment = boot_segment = None
 temp_sum = light_sum = measure_count = sensor_measure = sensor_sync = None
 power_is_on = start_time = None
 
@@ -73,10 +82,74 @@ def update_sensors():
     measure_count += 1
     sensor_measure = time.ticks_ms() # pylint: disable=no-member
 
-def calculate_files():
-    global file_num # pylint: disable=global-statement
-    ll = os.listdir()
-    file_num = int(len(ll) / 2)
+# Every boot starts a new segment after the ones left on the flash
+def calculate_segments():
+    global first_segment, segment, boot_segment, segment_buf # pylint: disable=global-statement
+    first_segment = segment = None
+    for f in os.listdir():
+        if f.startswith(LOG_FILENAME_PREFIX) and f.endswith(SEGMENT_POSTFIX):
+            n = int(f[len(LOG_FILENAME_PREFIX):-len(SEGMENT_POSTFIX)])
+            if first_segment is None or n < first_segment:
+                first_segment = n
+            if segment is None or n > segment:
+                segment = n
+    if segment is None:
+        first_segment = segment = -1
+    segment_buf = bytearray()
+    next_segment()
+    boot_segment = segment
+
+def free_space():
+    return LOG_CAPACITY - (segment - first_segment + 1) * SEGMENT_SIZE
+
+def next_segment():
+    global first_segment, segment, boot_segment, segment_buf # pylint: disable=global-statement
+    segment += 1
+    segment_buf = bytearray()
+    # the oldest segments are dropped when the flash is full
+    while free_space() < 0:
+        try:
+            os.remove(SEGMENT_FILENAME.format(first_segment))
+        except OSError:
+            pass
+        first_segment += 1
+    if boot_segment is not None and boot_segment < first_segment:
+        boot_segment = first_segment
+
+def encode_record(lsync, n, tmp, l):
+    return (lsync.to_bytes(4, DATA_BYTES_ORDER) + # pylint: disable=no-member
+            n.to_bytes(4, DATA_BYTES_ORDER) + # pylint: disable=no-member
+            int((tmp + TEMP_OFFSET) * 1000).to_bytes(4, DATA_BYTES_ORDER) + # pylint: disable=no-member
+            int(l * 1000).to_bytes(4, DATA_BYTES_ORDER)) # pylint: disable=no-member
+
+def decode_record(record):
+    return (int.from_bytes(record[0:4], DATA_BYTES_ORDER),
+            int.from_bytes(record[4:8], DATA_BYTES_ORDER),
+            int.from_bytes(record[8:12], DATA_BYTES_ORDER),
+            int.from_bytes(record[12:16], DATA_BYTES_ORDER))
+
+def read_records():
+    for s in range(boot_segment, segment + 1):
+        try:
+            f = open(SEGMENT_FILENAME.format(s), 'rb')
+        except OSError:
+            continue
+        while True:
+            record = f.read(RECORD_SIZE)
+            if len(record) < RECORD_SIZE:
+                break
+            yield decode_record(record)
+        f.close()
+
+# Only the current segment is rewritten, older ones stay untouched
+def append_record(record):
+    global segment_buf # pylint: disable=global-statement
+    if len(segment_buf) >= SEGMENT_SIZE:
+        next_segment()
+    segment_buf += record
+    f = open(SEGMENT_FILENAME.format(segment), 'wb')
+    f.write(segment_buf)
+    f.close()
 
 def remove_files():
     ll = os.listdir()
@@ -84,7 +157,7 @@ def remove_files():
         os.remove(f)
 
 def reset():
-    global baseline, num, crossing, show_num, last_change, num_buf, last_sync # pylint: disable=global-statement
+    global baseline, num, crossing, show_num, last_change, last_sync # pylint: disable=global-statement
     global temp_sum, sensor_measure, light_sum, measure_count, sensor_sync # pylint: disable=global-statement
     global start_time, power_is_on  # pylint: disable=global-statement
     baseline = m.compass.get_field_strength() # Take a baseline reading of magnetic strength
@@ -92,9 +165,8 @@ def reset():
     crossing = False
     show_num = False
     temp_sum = light_sum = measure_count = 0
-    num_buf = []
     last_change = last_sync = sensor_sync = sensor_measure = start_time = time.ticks_ms() # pylint: disable=no-member
-    calculate_files()
+    calculate_segments()
     m.display.clear()
     update_display()
     radio.on()
@@ -123,11 +195,44 @@ def send_log(lsync, n, pair):
     send_single_event(RADIO_CODE_LOG, lsync, n, pair[0], pair[1])
     sensor_sync = time.ticks_ms() # pylint: disable=no-member
 
+def varint(v):
+    out = bytearray()
+    while v >= 0x80:
+        out.append((v & 0x7f) | 0x80)
+        v >>= 7
+    out.append(v)
+    return out
+
+def zigzag(v):
+    return v * 2 if v >= 0 else -v * 2 - 1
+
+def send_packed(seq, packet):
+    m.sleep(SEND_TIMEOUT)
+    packet = bytes([seq]) + packet
+    radio.send(bytes(RADIO_CODE_PACKED + DEVICE, 'utf-8') + packet +
+               bytes([sum(packet) & 0xff]))
+
+# Streams the records of this boot from the flash, packing as many as fit
+# into every packet: the first one as is, the next ones as deltas
 def send_full_log():
     radio.send('{}{}{}'.format(RADIO_CODE_FILE, DEVICE, LOG_FILENAME_PREFIX))
-    for n in num_buf:
-        m.sleep(SEND_TIMEOUT)
-        radio.send('{}{}{}'.format(RADIO_CODE_LINE, DEVICE, ' '.join(map(str, n))))
+    seq = 0
+    packet = bytearray()
+    prev = None
+    for record in read_records():
+        if prev is None:
+            chunk = b''.join(varint(v) for v in record)
+        else:
+            chunk = b''.join(varint(zigzag(v - p)) for v, p in zip(record, prev))
+        if len(packet) + len(chunk) > PACKED_BYTES:
+            send_packed(seq, packet)
+            seq = (seq + 1) & 0xff
+            chunk = b''.join(varint(v) for v in record)
+            packet = bytearray()
+        packet += chunk
+        prev = record
+    if packet:
+        send_packed(seq, packet)
     m.sleep(SEND_TIMEOUT)
     radio.send('{}{}'.format(RADIO_CODE_EOF, DEVICE))
 
@@ -136,11 +241,7 @@ def sync_data():
     last_sync = time.ticks_ms() # pylint: disable=no-member
     sensors = get_sensors()
     send_log(last_sync, num, sensors)
-    num_buf.append((last_sync, num, sensors[0], sensors[1]))
-    f = open(LOG_FILENAME.format(file_num), 'w')
-    for n in num_buf:
-        f.write("{}\n".format(' '.join(map(str, n))))
-    f.close()
+    append_record(encode_record(last_sync, num, sensors[0], sensors[1]))
 
 def power_off():
     global power_is_on # pylint: disable=global-statement
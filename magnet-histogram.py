@@ -17,13 +17,22 @@ LIGHT = 3
 THRESHOLD = 12500
 TIME_LIMIT = 400
 SYNC_TIME = 1800000 # 30 min
-LOG_FILENAME = 'log{}.txt'
-HIST_FILENAME = 'histogram{}.txt'
+LOG_FILENAME_PREFIX = 'log'
+SEGMENT_POSTFIX = '.bin'
+SEGMENT_FILENAME = LOG_FILENAME_PREFIX + '{}' + SEGMENT_POSTFIX
+HIST_FILENAME = 'histogram{}.bin'	# one per boot, named after its first segment
+DATA_BYTES_ORDER = 'little'
+RECORD_SIZE = 16			# ticks, num, temp & light in thousandths
+SEGMENT_RECORDS = 16			# 8 hours, rewritten on every sync
+SEGMENT_SIZE = RECORD_SIZE * SEGMENT_RECORDS
+LOG_CAPACITY = 20 * 1024		# flash bytes for the log segments
+TEMP_OFFSET = 100			# keeps the stored temperature positive
 HIST_STEPS = 250
 HIST_DELTA = 0.01
 HIST_ROUND_SIGNS = 1
 baseline = num = crossing = show_num = last_change = None
-num_buf = hist_dict = last_sync = file_num = None
+segment_buf = hist_dict = last_sync = None
+first_segment = segment = boot_segment = None
 temp_sum = temp_count = light_sum = light_count = None
 
 def update_display():
@@ -59,10 +68,56 @@ def update_light():
     light_sum += m.pin0.read_analog()
     light_count += 1
 
-def calculate_files():
-    global file_num # pylint: disable=global-statement
-    ll = os.listdir()
-    file_num = int(len(ll) / 2)
+# Every boot starts a new segment after the ones left on the flash
+def calculate_segments():
+    global first_segment, segment, boot_segment, segment_buf # pylint: disable=global-statement
+    first_segment = segment = None
+    for f in os.listdir():
+        if f.startswith(LOG_FILENAME_PREFIX) and f.endswith(SEGMENT_POSTFIX):
+            n = int(f[len(LOG_FILENAME_PREFIX):-len(SEGMENT_POSTFIX)])
+            if first_segment is None or n < first_segment:
+                first_segment = n
+            if segment is None or n > segment:
+                segment = n
+    if segment is None:
+        first_segment = segment = -1
+    segment_buf = bytearray()
+    next_segment()
+    boot_segment = segment
+
+def free_space():
+    return LOG_CAPACITY - (segment - first_segment + 1) * SEGMENT_SIZE
+
+def next_segment():
+    global first_segment, segment, boot_segment, segment_buf # pylint: disable=global-statement
+    segment += 1
+    segment_buf = bytearray()
+    # the oldest segments & their histograms are dropped when the flash is full
+    while free_space() < 0:
+        for f in (SEGMENT_FILENAME.format(first_segment), HIST_FILENAME.format(first_segment)):
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+        first_segment += 1
+    if boot_segment is not None and boot_segment < first_segment:
+        boot_segment = first_segment
+
+def encode_record(lsync, n, tmp, l):
+    return (lsync.to_bytes(4, DATA_BYTES_ORDER) + # pylint: disable=no-member
+            n.to_bytes(4, DATA_BYTES_ORDER) + # pylint: disable=no-member
+            int((tmp + TEMP_OFFSET) * 1000).to_bytes(4, DATA_BYTES_ORDER) + # pylint: disable=no-member
+            int(l * 1000).to_bytes(4, DATA_BYTES_ORDER)) # pylint: disable=no-member
+
+# Only the current segment is rewritten, older ones stay untouched
+def append_record(record):
+    global segment_buf # pylint: disable=global-statement
+    if len(segment_buf) >= SEGMENT_SIZE:
+        next_segment()
+    segment_buf += record
+    f = open(SEGMENT_FILENAME.format(segment), 'wb')
+    f.write(segment_buf)
+    f.close()
 
 def remove_files():
     ll = os.listdir()
@@ -70,17 +125,16 @@ def remove_files():
         os.remove(f)
 
 def reset():
-    global baseline, num, crossing, show_num, last_change, num_buf, hist_dict, last_sync # pylint: disable=global-statement
+    global baseline, num, crossing, show_num, last_change, hist_dict, last_sync # pylint: disable=global-statement
     global temp_sum, temp_count, light_sum, light_count # pylint: disable=global-statement
     baseline = m.compass.get_field_strength() # Take a baseline reading of magnetic strength
     num = 0
     crossing = False
     show_num = False
     temp_sum = temp_count = light_sum = light_count = 0
-    num_buf = []
     hist_dict = [0] * HIST_STEPS
     last_change = last_sync = time.ticks_ms() # pylint: disable=no-member
-    calculate_files()
+    calculate_segments()
     m.display.clear()
     update_display()
 
@@ -93,14 +147,11 @@ def save_hist_value(d):
 
 def sync_data():
     global last_sync # pylint: disable=global-statement
-    num_buf.append((last_sync, num, get_temperature(), get_light()))
-    f = open(LOG_FILENAME.format(file_num), 'w')
-    for n in num_buf:
-        f.write("{}\n".format(' '.join(map(str, n))))
-    f.close()
-    f = open(HIST_FILENAME.format(file_num), 'w')
+    append_record(encode_record(last_sync, num, get_temperature(), get_light()))
+    # the histogram has a fixed size of HIST_STEPS counters
+    f = open(HIST_FILENAME.format(boot_segment), 'wb')
     for i in range(HIST_STEPS):
-        f.write("{} {}\n".format(i * HIST_DELTA, hist_dict[i]))
+        f.write(hist_dict[i].to_bytes(4, DATA_BYTES_ORDER)) # pylint: disable=no-member
     f.close()
     last_sync = time.ticks_ms() # pylint: disable=no-member
 
@@ -22,12 +22,15 @@ LOG_FILENAME_PREFIX = 'evlog'
 LOG_FILENAME = LOG_FILENAME_PREFIX + '{}.txt'
 RADIO_CODE_EVENT = 'EVN'
 RADIO_CODE_FILE = 'FIL'
-RADIO_CODE_LINE = 'LIN'
 RADIO_CODE_EOF = 'EOF'
+RADIO_CODE_PACKED = 'LPK'
 DATA_BYTES_ORDER = 'little'
 DEVICE = 'B'
 SEND_TIMEOUT = 10
 RADIO_BUFFER = 32
+# string header, code, device, sequence number & checksum take the rest
+PACKED_BYTES = RADIO_BUFFER - 3 - 4 - 2
+TEMP_OFFSET = 100			# keeps the packed temperature positive
 RADIO_QUEUE = 2
 RADIO_CHANNEL = 1
 baseline = num = crossing = show_num = last_change = None
@@ -88,11 +91,45 @@ def send_single_event(lsync, n):
                  checksum.to_bytes(2, DATA_BYTES_ORDER)) # pylint: disable=no-member
     radio.send(radio_buf)
 
+def varint(v):
+    out = bytearray()
+    while v >= 0x80:
+        out.append((v & 0x7f) | 0x80)
+        v >>= 7
+    out.append(v)
+    return out
+
+def zigzag(v):
+    return v * 2 if v >= 0 else -v * 2 - 1
+
+def send_packed(seq, packet):
+    m.sleep(SEND_TIMEOUT)
+    packet = bytes([seq]) + packet
+    radio.send(bytes(RADIO_CODE_PACKED + DEVICE, 'utf-8') + packet +
+               bytes([sum(packet) & 0xff]))
+
+# Packs as many records as fit into every packet: the first one as is,
+# the next ones as deltas; temp & light go in thousandths
 def send_full_log():
     radio.send('{}{}{}'.format(RADIO_CODE_FILE, DEVICE, LOG_FILENAME_PREFIX))
+    seq = 0
+    packet = bytearray()
+    prev = None
     for n in num_buf:
-        m.sleep(SEND_TIMEOUT)
-        radio.send('{}{}{}'.format(RADIO_CODE_LINE, DEVICE, ' '.join(map(str, n))))
+        record = (n[0], n[1], int((n[2] + TEMP_OFFSET) * 1000), int(n[3] * 1000))
+        if prev is None:
+            chunk = b''.join(varint(v) for v in record)
+        else:
+            chunk = b''.join(varint(zigzag(v - p)) for v, p in zip(record, prev))
+        if len(packet) + len(chunk) > PACKED_BYTES:
+            send_packed(seq, packet)
+            seq = (seq + 1) & 0xff
+            chunk = b''.join(varint(v) for v in record)
+            packet = bytearray()
+        packet += chunk
+        prev = record
+    if packet:
+        send_packed(seq, packet)
     m.sleep(SEND_TIMEOUT)
     radio.send('{}{}'.format(RADIO_CODE_EOF, DEVICE))
 
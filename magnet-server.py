@@ -17,6 +17,9 @@ DEVICE = 'Z'
 RADIO_CHANNEL = 1
 
 BAUD = 115200
+# rates the binary mode may switch to, the nRF UART supports up to 1M
+UART_BAUDS = (115200, 230400, 460800, 921600, 1000000)
+UART_DRAIN = 5				# ms for the answer to leave before a switch
 SYSTEM_START = 'STA'
 SYSTEM_TIME = 'TIM'
 SYSTEM_LOG = 'LOG'
@@ -25,50 +28,130 @@ SYSTEM_FILE = 'FIL'
 SYSTEM_LINE = 'LIN'
 SYSTEM_EOF = 'EOF'
 SYSTEM_OK = 'OKE'
+SYSTEM_PACKED = 'LPK'
+SYSTEM_BINARY = 'BIN'
+SYSTEM_STATUS = 'STS'
 
 RECV_TIMEOUT = 10
+STATUS_TIME = 10 * 1000			# 10 sec
 
 RADIO_CODE_LOG = 'LOG'
 RADIO_CODE_EVENT = 'EVN'
 RADIO_CODE_FILE = 'FIL'
 RADIO_CODE_LINE = 'LIN'
 RADIO_CODE_EOF = 'EOF'
+RADIO_CODE_PACKED = 'LPK'
 
 RADIO_BUFFER = 32
 RADIO_QUEUE = 5
+DATA_BYTES_ORDER = 'little'
 
 LIGHT = 3
 
-serial_buf = ''
+serial_buf = b''
+binary_mode = False
+crc_table = None
 file_num = None
 start_time = time.ticks_ms() # pylint: disable=no-member
 global_time = 0
 sending_file = False
+# radio packets since the start, reported in the status frames
+received = forwarded = malformed = queue_full = 0
+last_status = start_time
 
 def update_display(sentradio, sentserial):
     m.display.set_pixel(0, 0, LIGHT)
     m.display.set_pixel(0, 1, LIGHT if sentradio else 0)
     m.display.set_pixel(0, 2, LIGHT if sentserial else 0)
 
+def make_crc_table():
+    global crc_table # pylint: disable=global-statement
+    crc_table = bytearray(256)
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = ((c << 1) ^ 0x07) & 0xff if c & 0x80 else (c << 1) & 0xff
+        crc_table[i] = c
+
+def crc8(data):
+    crc = 0
+    for b in data:
+        crc = crc_table[crc ^ b]
+    return crc
+
+def cobs_encode(data):
+    out = bytearray([0])
+    code_index = 0
+    code = 1
+    for b in data:
+        if b:
+            out.append(b)
+            code += 1
+        if not b or code == 0xff:
+            out[code_index] = code
+            code_index = len(out)
+            out.append(0)
+            code = 1
+    out[code_index] = code
+    return out
+
+# Text lines or COBS frames with a CRC-8, ended by a zero byte
+def uart_send(frame):
+    if binary_mode:
+        m.uart.write(cobs_encode(frame + bytes([crc8(frame)])) + b'\x00')
+    else:
+        m.uart.write(frame + b'\r\n')
+
+# Radio payloads go raw in the binary mode & in hex in the text one
+def uart_forward(code, device, data):
+    if not binary_mode:
+        data = bytes(''.join('%02x' % i for i in data), 'utf-8')
+    uart_send(bytes(code, 'utf-8') + device + data)
+
+# "STA BIN <baud>" asks for the binary mode, a plain STA for the text one.
+# The rest of the buffer came at the old rate, so it is dropped on a switch.
+def start_mode(command):
+    global binary_mode, serial_buf # pylint: disable=global-statement
+    baud = None
+    if len(command) == 3 and command[1] == bytes(SYSTEM_BINARY, 'utf-8'):
+        try:
+            baud = int(str(command[2], 'utf-8'))
+        except ValueError:
+            # a garbled rate keeps the text mode
+            pass
+        else:
+            if baud not in UART_BAUDS:
+                baud = BAUD
+    if baud is not None:
+        uart_send(bytes('{} {}'.format(SYSTEM_BINARY, baud), 'utf-8'))
+        m.sleep(UART_DRAIN)
+        m.uart.init(baud)
+        binary_mode = True
+        serial_buf = b''
+    elif binary_mode:
+        m.uart.init(BAUD)
+        binary_mode = False
+        serial_buf = b''
+
 def init_serial():
     global serial_buf # pylint: disable=global-statement
     m.uart.init(BAUD)
-    serial_buf = ''
-    start_cmd = SYSTEM_START + '\r\n'
+    serial_buf = b''
     while True:
         if m.uart.any():
-            serial_buf += str(m.uart.read(), 'UTF-8')
-        idx = serial_buf.find(start_cmd)
-        if idx >= 0:
-            serial_buf = serial_buf[idx + len(start_cmd):]
-            break
+            serial_buf += m.uart.read()
+        index = serial_buf.find(b'\r\n')
+        while index >= 0:
+            command = serial_buf[0:index].strip().split(b' ')
+            serial_buf = serial_buf[index + 2:]
+            if command[0] == bytes(SYSTEM_START, 'utf-8'):
+                start_mode(command)
+                return
+            index = serial_buf.find(b'\r\n')
         update_display(True, True)
         m.sleep(RECV_TIMEOUT)
         update_display(False, False)
 
-def error(s):
-    m.display.show(s, wait=True, loop=True)
-
 def calculate_files():
     global file_num # pylint: disable=global-statement
     ll = os.listdir()
@@ -81,6 +164,56 @@ def remove_files():
         os.remove(f)
     file_num = 0
 
+def forward_packet(msg):
+    global sending_file, forwarded, malformed # pylint: disable=global-statement
+    # string header, code & device
+    if len(msg) < 7 or msg[0:3] != b'\x01\x00\x01':
+        malformed += 1
+        return
+    msg = msg[3:]
+    try:
+        code = str(msg[0:3], 'utf-8')
+    except UnicodeError:
+        malformed += 1
+        return
+    device = msg[3:4]
+    msg = msg[4:]
+    if code == RADIO_CODE_LOG or code == RADIO_CODE_EVENT:
+        serial_code = SYSTEM_EVENT if code == RADIO_CODE_EVENT else SYSTEM_LOG
+        uart_forward(serial_code, device, msg)
+    elif code == RADIO_CODE_PACKED:
+        # decoded on the desktop
+        uart_forward(SYSTEM_PACKED, device, msg)
+    elif code == RADIO_CODE_FILE:
+        if sending_file:
+            uart_send(bytes(SYSTEM_EOF, 'utf-8') + device)
+        else:
+            sending_file = True
+        ts = time.ticks_ms() # pylint: disable=no-member
+        filename = '{}-{}-{}.txt'.format(str(device, 'utf-8'), ts, str(msg, 'utf-8'))
+        uart_send(bytes(SYSTEM_FILE, 'utf-8') + device + bytes(filename, 'utf-8'))
+    elif code == RADIO_CODE_EOF:
+        uart_send(bytes(SYSTEM_EOF, 'utf-8') + device)
+        sending_file = False
+    elif code == RADIO_CODE_LINE:
+        uart_send(bytes(SYSTEM_LINE, 'utf-8') + device + msg)
+    else:
+        malformed += 1
+        return
+    forwarded += 1
+
+# Ticks & the packet counters, the host compares them between the frames
+def send_status():
+    global last_status # pylint: disable=global-statement
+    last_status = time.ticks_ms() # pylint: disable=no-member
+    uart_forward(SYSTEM_STATUS, bytes(DEVICE, 'utf-8'),
+                 last_status.to_bytes(4, DATA_BYTES_ORDER) + # pylint: disable=no-member
+                 received.to_bytes(4, DATA_BYTES_ORDER) + # pylint: disable=no-member
+                 forwarded.to_bytes(4, DATA_BYTES_ORDER) + # pylint: disable=no-member
+                 malformed.to_bytes(4, DATA_BYTES_ORDER) + # pylint: disable=no-member
+                 queue_full.to_bytes(4, DATA_BYTES_ORDER)) # pylint: disable=no-member
+
+make_crc_table()
 calculate_files()
 init_serial()
 radio.on()
@@ -91,45 +224,36 @@ while True:
 
     # Read serial port
     if m.uart.any():
-        serial_buf += str(m.uart.read(), 'UTF-8')
-    index = serial_buf.find('\r\n')
+        serial_buf += m.uart.read()
+    index = serial_buf.find(b'\r\n')
     if index >= 0:
-        command = serial_buf[0:index].strip().split(' ')
-        if command[0] == SYSTEM_TIME:
-            global_time = int(command[1])
-            start_time = time.ticks_ms() # pylint: disable=no-member
-            m.uart.write(SYSTEM_OK + '\r\n')
+        command = serial_buf[0:index].strip().split(b' ')
         serial_buf = serial_buf[index + 2:]
+        if command[0] == bytes(SYSTEM_TIME, 'utf-8'):
+            global_time = int(str(command[1], 'utf-8'))
+            start_time = time.ticks_ms() # pylint: disable=no-member
+            uart_send(bytes(SYSTEM_OK, 'utf-8'))
+        elif command[0] == bytes(SYSTEM_START, 'utf-8'):
+            start_mode(command)
         update_display(False, True)
 
-    # Read radio
+    # Read radio: the whole queue is drained before the next sleep, a full
+    # queue means some packets may have been dropped before it
+    drained = 0
     msg = radio.receive_bytes()
-    if msg:
+    while msg:
+        drained += 1
+        forward_packet(msg)
+        msg = radio.receive_bytes()
+    received += drained
+    if drained >= RADIO_QUEUE:
+        queue_full += 1
+
+    if time.ticks_diff(time.ticks_ms(), last_status) >= STATUS_TIME: # pylint: disable=no-member
+        send_status()
+
+    if drained:
         update_display(True, False)
-        if msg[0:3] != b'\x01\x00\x01':
-            error('bad microbit message')
-        msg = msg[3:]
-        code = str(msg[0:3], 'utf-8')
-        device = str(msg[3:4], 'utf-8')
-        msg = msg[4:]
-        if code == RADIO_CODE_LOG or code == RADIO_CODE_EVENT:
-            hexdump = ''.join('%02x' % i for i in msg)
-            serial_code = SYSTEM_EVENT if code == RADIO_CODE_EVENT else SYSTEM_LOG
-            m.uart.write('{}{}{}\r\n'.format(serial_code, device, hexdump))
-        elif code == RADIO_CODE_FILE:
-            if sending_file:
-                m.uart.write('{}{}\r\n'.format(SYSTEM_EOF, device))
-            else:
-                sending_file = True
-            ts = time.ticks_ms() # pylint: disable=no-member
-            filename = '{}-{}-{}.txt'.format(device, ts, str(msg, 'utf-8'))
-            m.uart.write('{}{}{}\r\n'.format(SYSTEM_FILE, device, filename))
-        elif code == RADIO_CODE_EOF:
-            m.uart.write('{}{}\r\n'.format(SYSTEM_EOF, device))
-            sending_file = False
-        elif code == RADIO_CODE_LINE:
-            m.uart.write('{}{}{}\r\n'.format(SYSTEM_LINE, device, str(msg, 'utf-8')))
-        else:
-            error('bad command code "{}"'.format(code))
-    m.sleep(RECV_TIMEOUT)
-    update_display(False, False)
+    else:
+        m.sleep(RECV_TIMEOUT)
+        update_display(False, False)
@@ -0,0 +1,319 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: in-process metrics, Prometheus endpoint & snapshots
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import bisect
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from debug import dprint
+
+PREFIX = 'hamster_'
+
+def format_labels(label, value):
+    if label is None or value is None:
+        return ''
+    return '{{{}="{}"}}'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+# Instruments only do plain dict/int updates on the hot path, everything
+# else happens when the metrics are scraped. The state of the instruments
+# in other processes is loaded per source & added on the scrape.
+
+class Counter(object):
+
+    TYPE = 'counter'
+
+    def __init__(self, name, doc, label=None):
+        self.name = PREFIX + name
+        self.doc = doc
+        self.label = label
+        self.values = {}
+        self.sources = {}
+
+    def inc(self, value=None, n=1):
+        values = self.values
+        values[value] = values.get(value, 0) + n
+
+    def get(self, value=None):
+        return self.merged().get(value, 0)
+
+    def reset(self):
+        self.values = {}
+        self.sources = {}
+
+    def state(self):
+        return dict(self.values)
+
+    def load(self, source, state):
+        self.sources[source] = state
+
+    def merged(self):
+        values = dict(self.values)
+        for state in list(self.sources.values()):
+            for value, v in state.items():
+                values[value] = values.get(value, 0) + v
+        return values
+
+    def render(self):
+        for value, v in sorted(self.merged().items(), key=lambda i: str(i[0])):
+            yield '{}{} {}'.format(self.name, format_labels(self.label, value), v)
+
+    def snapshot(self):
+        values = self.merged()
+        if self.label is None:
+            return values.get(None, 0)
+        return {str(k): v for k, v in values.items()}
+
+class Gauge(Counter):
+
+    TYPE = 'gauge'
+
+    def __init__(self, name, doc, label=None):
+        Counter.__init__(self, name, doc, label)
+        self.__callbacks = {}
+
+    def set(self, v, value=None):
+        self.values[value] = v
+
+    def reset(self):
+        Counter.reset(self)
+        self.__callbacks = {}
+
+    def state(self):
+        self.__collect()
+        return Counter.state(self)
+
+    # the latest value wins, not the sum
+    def merged(self):
+        values = dict(self.values)
+        for state in list(self.sources.values()):
+            values.update(state)
+        return values
+
+    # the callback is only called on scrape, so tracking costs nothing
+    def track(self, value, callback):
+        self.__callbacks[value] = callback
+
+    def untrack(self, value):
+        self.__callbacks.pop(value, None)
+        self.values.pop(value, None)
+
+    def __collect(self):
+        for value, callback in list(self.__callbacks.items()):
+            try:
+                self.values[value] = callback()
+            except Exception: # pylint: disable=broad-except
+                pass
+
+    def render(self):
+        self.__collect()
+        return Counter.render(self)
+
+    def snapshot(self):
+        self.__collect()
+        return Counter.snapshot(self)
+
+class Histogram(object):
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, doc, buckets):
+        self.name = PREFIX + name
+        self.doc = doc
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.sources = {}
+
+    def observe(self, v):
+        self.counts[bisect.bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.sources = {}
+
+    def state(self):
+        return list(self.counts), self.sum, self.count
+
+    def load(self, source, state):
+        self.sources[source] = state
+
+    def merged(self):
+        counts, total, count = self.state()
+        for state in list(self.sources.values()):
+            counts = [c + n for c, n in zip(counts, state[0])]
+            total += state[1]
+            count += state[2]
+        return counts, total, count
+
+    def render(self):
+        total = 0
+        counts, hsum, _ = self.merged()
+        for le, c in zip(self.buckets, counts):
+            total += c
+            yield '{}_bucket{{le="{}"}} {}'.format(self.name, le, total)
+        total += counts[-1]
+        yield '{}_bucket{{le="+Inf"}} {}'.format(self.name, total)
+        yield '{}_sum {}'.format(self.name, hsum)
+        yield '{}_count {}'.format(self.name, total)
+
+    def snapshot(self):
+        counts, hsum, count = self.merged()
+        return {'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], counts)),
+                'sum': hsum,
+                'count': count}
+
+class Metrics(object):
+
+    FRAME_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025,
+                     0.0005, 0.001, 0.0025, 0.005, 0.01, 0.1)
+    IO_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+    def __init__(self):
+        self.started = time.time()
+        self.frames = Counter('frames_total', 'Frames received by protocol code', 'code')
+        self.bad_frames = Counter('bad_frames_total', 'Rejected frames by reason', 'reason')
+        self.last_seen = Gauge('device_last_seen_seconds',
+                               'Unix time of the last frame from the device', 'device')
+        self.frame_time = Histogram('frame_processing_seconds',
+                                    'Time to process one frame', self.FRAME_BUCKETS)
+        self.flush_time = Histogram('log_flush_seconds',
+                                    'Time to flush the buffered log lines', self.IO_BUCKETS)
+        self.upload_time = Histogram('sheet_upload_seconds',
+                                     'Time to upload the day to sheets', self.IO_BUCKETS)
+        self.uploads = Counter('sheet_uploads_total', 'Sheet uploads by result', 'result')
+        self.queue_depth = Gauge('queue_depth', 'Items waiting in the queue', 'queue')
+        # the receivers' own counters since their start, from the STS frames,
+        # labelled by the serial port of the receiver
+        self.radio_received = Gauge('radio_received_packets',
+                                    'Radio packets received by the receiver', 'port')
+        self.radio_forwarded = Gauge('radio_forwarded_packets',
+                                     'Radio packets forwarded by the receiver', 'port')
+        self.radio_malformed = Gauge('radio_malformed_packets',
+                                     'Malformed radio packets dropped by the receiver', 'port')
+        self.radio_queue_full = Gauge('radio_queue_full',
+                                      'Receiver radio queue drains that found it full', 'port')
+        self.instruments = [self.frames, self.bad_frames, self.last_seen,
+                            self.frame_time, self.flush_time, self.upload_time,
+                            self.uploads, self.queue_depth,
+                            self.radio_received, self.radio_forwarded,
+                            self.radio_malformed, self.radio_queue_full]
+
+    # A forked process starts from zero & sends its state to the parent
+    def reset(self):
+        self.started = time.time()
+        for m in self.instruments:
+            m.reset()
+
+    def state(self):
+        return [m.state() for m in self.instruments]
+
+    def load(self, source, state):
+        for m, s in zip(self.instruments, state):
+            m.load(source, s)
+
+    def render(self):
+        lines = []
+        for m in self.instruments:
+            lines.append('# HELP {} {}'.format(m.name, m.doc))
+            lines.append('# TYPE {} {}'.format(m.name, m.TYPE))
+            lines.extend(m.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        result = {'time': time.time(), 'uptime': time.time() - self.started}
+        for m in self.instruments:
+            result[m.name[len(PREFIX):]] = m.snapshot()
+        return result
+
+    def save(self, path):
+        tmppath = path + '.tmp'
+        f = open(tmppath, 'w')
+        json.dump(self.snapshot(), f, indent=2)
+        f.close()
+        os.replace(tmppath, path)
+
+# the server-wide metrics used by all the modules
+METRICS = Metrics()
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def do_GET(self): # pylint: disable=invalid-name
+        if self.path == '/metrics':
+            body = self.server.metrics.render().encode()
+            content_type = self.CONTENT_TYPE
+        elif self.path == '/metrics.json':
+            body = json.dumps(self.server.metrics.snapshot()).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+class MetricsServer(object):
+
+    HOST = '127.0.0.1'
+    SNAPSHOT_PERIOD = 10.0		# seconds
+
+    def __init__(self, port=None, snapshot_path=None, metrics=METRICS,
+                 host=HOST, snapshot_period=SNAPSHOT_PERIOD):
+        self.metrics = metrics
+        self.snapshot_path = snapshot_path
+        self.snapshot_period = snapshot_period
+        self.__stop = threading.Event()
+        self.__httpd = None
+        self.__threads = []
+        if port is not None:
+            self.__httpd = HTTPServer((host, port), MetricsHandler)
+            self.__httpd.metrics = metrics
+            self.__start(self.__httpd.serve_forever, 'metrics-http')
+            dprint('metrics are available at http://{}:{}/metrics'.format(host, port))
+        if snapshot_path is not None:
+            self.__start(self.__save_snapshots, 'metrics-snapshot')
+
+    def __start(self, target, name):
+        t = threading.Thread(target=target, name=name, daemon=True)
+        t.start()
+        self.__threads.append(t)
+
+    def __save_snapshot(self):
+        try:
+            self.metrics.save(self.snapshot_path)
+        except OSError as e:
+            dprint('cannot save metrics snapshot: {}'.format(e))
+
+    def __save_snapshots(self):
+        while not self.__stop.wait(self.snapshot_period):
+            self.__save_snapshot()
+
+    def close(self):
+        self.__stop.set()
+        if self.__httpd is not None:
+            self.__httpd.shutdown()
+            self.__httpd.server_close()
+        for t in self.__threads:
+            t.join()
+        if self.snapshot_path is not None:
+            self.__save_snapshot()
@@ -0,0 +1,134 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: asyncio multi-receiver listener
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import asyncio
+from serialport import SerialPort, SerialException
+from serialprotocol import SerialProtocol
+from handshake import handshake
+from logger import EventLogger
+from metrics import METRICS
+from debug import warning, error
+
+class PortReader(object):
+
+    QUEUE_SIZE = 256
+
+    def __init__(self, address, logger, queue_size=QUEUE_SIZE):
+        self.address = address
+        self.sport = SerialPort(address)
+        self.protocol = SerialProtocol(self.sport, logger)
+        self.queue = asyncio.Queue(queue_size)
+        self.paused = False
+        self.closed = False
+        self.__loop = None
+        METRICS.queue_depth.track(address, self.queue.qsize)
+
+    def start(self, loop):
+        self.__loop = loop
+        self.__resume()
+
+    def __pause(self):
+        if not self.paused:
+            self.__loop.remove_reader(self.sport.fileno())
+            self.paused = True
+            warning('{}: queue is full, pausing reads', self.address)
+
+    def __resume(self):
+        if self.closed:
+            return
+        self.__loop.add_reader(self.sport.fileno(), self.__on_readable)
+        self.paused = False
+
+    def __split_frames(self):
+        frames = self.sport.framer.frames()
+        for frame in frames:
+            self.queue.put_nowait(bytes(frame))
+            if self.queue.full():
+                frames.close()
+                self.__pause()
+                return
+
+    def __on_readable(self):
+        try:
+            self.sport.framer.feed(self.sport.read_available())
+        except SerialException as e:
+            error('{}: serial error: {}', self.address, e)
+            self.close()
+            return
+        if not self.queue.full():
+            self.__split_frames()
+
+    async def consume(self):
+        while not self.closed or not self.queue.empty():
+            frame = await self.queue.get()
+            if frame is None:
+                break
+            self.protocol.process_frame(frame)
+            if self.paused and self.queue.qsize() <= self.queue.maxsize // 2:
+                self.__resume()
+                self.__split_frames()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        METRICS.queue_depth.untrack(self.address)
+        if not self.paused and self.__loop is not None:
+            self.__loop.remove_reader(self.sport.fileno())
+        self.sport.close()
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+class MultiServer(object):
+
+    DAY_CHECK_PERIOD = 1.0
+
+    def __init__(self, addresses, logger=None, queue_size=PortReader.QUEUE_SIZE):
+        assert addresses
+        if logger is None:
+            logger = EventLogger()
+        self.logger = logger
+        self.readers = []
+        for address in addresses:
+            self.readers.append(PortReader(address, self.logger, queue_size))
+
+    # All the receivers are started & get the time at once, in the binary
+    # mode if a baud rate is given
+    def init(self, baud=None):
+        results = handshake([r.sport for r in self.readers], baud=baud)
+        for r, result in zip(self.readers, results):
+            for frame in result.frames:
+                r.protocol.process_frame(frame)
+        return all(result.ok for result in results)
+
+    async def __check_day(self):
+        while True:
+            self.logger.check_day()
+            await asyncio.sleep(self.DAY_CHECK_PERIOD)
+
+    async def __listen(self):
+        loop = asyncio.get_running_loop()
+        for r in self.readers:
+            r.start(loop)
+        day_task = asyncio.ensure_future(self.__check_day())
+        try:
+            await asyncio.gather(*[r.consume() for r in self.readers])
+        finally:
+            day_task.cancel()
+            for r in self.readers:
+                r.close()
+
+    def listen(self):
+        asyncio.run(self.__listen())
+
+    def save_state(self):
+        self.logger.close()
@@ -0,0 +1,364 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: multi-process ingest pipeline
+#
+#   reader process per port --(shared memory ring)--> decoder process
+#   decoder process --(bounded queue of batches)--> writer process
+#
+# The readers only frame the serial stream. The decoder runs the protocol
+# parsing & checksums and turns the frames into batches of logger calls.
+# The writer owns the EventLogger with its disk writes, day state & uploads.
+# A full stage blocks the one before it, down to the serial port buffers.
+# The decoder & the writer send their metrics to the parent, which exports
+# them.
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import time
+import queue
+import signal
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+from serialport import SerialPort, SerialException
+from serialprotocol import SerialProtocol
+from handshake import handshake_addresses
+from metrics import METRICS
+from debug import dprint, warning, error, flush
+
+class FrameRing(object):
+
+    # frames of the binary serial mode carry raw payloads
+    binary = False
+    # the serial port the frames come from
+    device = None
+
+    # head, tail, closed, frames, full waits, high watermark
+    HEADER = struct.Struct('<QQQQQQ')
+    LENGTH = struct.Struct('<H')
+    WRAP = 0xffff
+    SIZE = 1024 * 1024
+    FULL_WAIT = 0.001		# seconds
+
+    # Single producer, single consumer: only the producer moves the head
+    # and only the consumer moves the tail
+    def __init__(self, name=None, size=SIZE):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER.size + size)
+            self.shm.buf[:self.HEADER.size] = bytes(self.HEADER.size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.size = self.shm.size - self.HEADER.size
+        self.__data = self.shm.buf[self.HEADER.size:self.HEADER.size + self.size]
+
+    def __get(self, field):
+        return struct.unpack_from('<Q', self.shm.buf, field * 8)[0]
+
+    def __set(self, field, value):
+        struct.pack_into('<Q', self.shm.buf, field * 8, value)
+
+    def stats(self):
+        head, tail, closed, frames, full_waits, high = self.HEADER.unpack_from(self.shm.buf, 0)
+        return {'used': head - tail,
+                'closed': bool(closed),
+                'frames': frames,
+                'full_waits': full_waits,
+                'high_watermark': high}
+
+    def put(self, frame, stop=None):
+        need = self.LENGTH.size + len(frame)
+        assert need + self.LENGTH.size <= self.size
+        head = self.__get(0)
+        pos = head % self.size
+        # a frame is never split, the rest of the ring is skipped instead
+        skip = self.size - pos if self.size - pos < need else 0
+        waited = False
+        while self.size - (head - self.__get(1)) < skip + need:
+            if stop is not None and stop.is_set():
+                return False
+            if not waited:
+                self.__set(4, self.__get(4) + 1)
+                waited = True
+            time.sleep(self.FULL_WAIT)
+        if skip:
+            if self.size - pos >= self.LENGTH.size:
+                self.LENGTH.pack_into(self.__data, pos, self.WRAP)
+            head += skip
+            pos = 0
+        self.LENGTH.pack_into(self.__data, pos, len(frame))
+        self.__data[pos + self.LENGTH.size:pos + need] = frame
+        head += need
+        self.__set(0, head)
+        self.__set(3, self.__get(3) + 1)
+        if head - self.__get(1) > self.__get(5):
+            self.__set(5, head - self.__get(1))
+        return True
+
+    def get_batch(self, limit):
+        tail = self.__get(1)
+        head = self.__get(0)
+        frames = []
+        while tail < head and len(frames) < limit:
+            pos = tail % self.size
+            if self.size - pos < self.LENGTH.size:
+                tail += self.size - pos
+                continue
+            length = self.LENGTH.unpack_from(self.__data, pos)[0]
+            if length == self.WRAP:
+                tail += self.size - pos
+                continue
+            start = pos + self.LENGTH.size
+            frames.append(bytes(self.__data[start:start + length]))
+            tail += self.LENGTH.size + length
+        self.__set(1, tail)
+        return frames
+
+    def close_writer(self):
+        self.__set(2, 1)
+
+    def drained(self):
+        return self.__get(2) and self.__get(0) == self.__get(1)
+
+    def close(self):
+        self.__data.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class BatchLogger(object):
+
+    # Collects the logger calls of the protocol to replay them in the writer
+    def __init__(self):
+        self.batch = []
+
+    def check_day(self):
+        pass
+
+    def summary(self, *args):
+        self.batch.append(('summary', args))
+
+    def event(self, *args):
+        self.batch.append(('event', args))
+
+    def log_data(self, *args):
+        self.batch.append(('log_data', args))
+
+    def start_log(self, *args):
+        self.batch.append(('start_log', args))
+
+    def finish_log(self, *args):
+        self.batch.append(('finish_log', args))
+
+    def take(self):
+        batch = self.batch
+        self.batch = []
+        return batch
+
+def ignore_interrupts():
+    # the parent stops the stages in order on Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def send_metrics(metrics, source):
+    try:
+        metrics.put_nowait((source, METRICS.state()))
+    except queue.Full:
+        pass
+
+def reader_main(address, ring_name, stop, baud, binary):
+    ignore_interrupts()
+    ring = FrameRing(ring_name)
+    sport = None
+    try:
+        sport = SerialPort(address, baud, binary=binary)
+        while not stop.is_set():
+            for frame in sport.read_frames():
+                if not ring.put(frame, stop):
+                    break
+    except SerialException as e:
+        error('{}: serial error: {}', address, e)
+    finally:
+        ring.close_writer()
+        ring.close()
+        if sport is not None:
+            sport.close()
+        flush()
+
+def decoder_main(ring_names, addresses, binary, batches, batch_size, stats_period,
+                 metrics, metrics_period):
+    ignore_interrupts()
+    METRICS.reset()
+    rings = [FrameRing(name) for name in ring_names]
+    for ring, address, b in zip(rings, addresses, binary):
+        ring.device = address
+        ring.binary = b
+    logger = BatchLogger()
+    protocols = [SerialProtocol(ring, logger) for ring in rings]
+    queue_waits = 0
+    frames = 0
+    last_stats = last_metrics = time.time()
+    while True:
+        got = 0
+        for ring, protocol in zip(rings, protocols):
+            for frame in ring.get_batch(batch_size):
+                protocol.process_frame(frame)
+                got += 1
+        frames += got
+        batch = logger.take()
+        if batch:
+            try:
+                batches.put_nowait(batch)
+            except queue.Full:
+                queue_waits += 1
+                batches.put(batch)
+        if not got:
+            if all(ring.drained() for ring in rings):
+                break
+            time.sleep(0.001)
+        if time.time() - last_metrics >= metrics_period:
+            last_metrics = time.time()
+            send_metrics(metrics, 'decoder')
+        if stats_period and time.time() - last_stats >= stats_period:
+            last_stats = time.time()
+            dprint('pipeline: {} frames decoded, {} writer queue waits'.format(frames,
+                                                                                queue_waits))
+            for name, ring in zip(ring_names, rings):
+                dprint('pipeline: ring {} {}'.format(name, ring.stats()))
+    batches.put(None)
+    send_metrics(metrics, 'decoder')
+    dprint('pipeline: decoder drained {} frames, {} writer queue waits'.format(frames,
+                                                                                queue_waits))
+    for ring in rings:
+        ring.close()
+    flush()
+
+def writer_main(logger_factory, batches, day_check_period, metrics, metrics_period):
+    ignore_interrupts()
+    METRICS.reset()
+    logger = logger_factory()
+    last_check = last_metrics = 0
+    calls = 0
+    while True:
+        try:
+            batch = batches.get(timeout=day_check_period)
+        except queue.Empty:
+            batch = []
+        if batch is None:
+            break
+        for method, args in batch:
+            getattr(logger, method)(*args)
+        calls += len(batch)
+        if time.time() - last_check >= day_check_period:
+            logger.check_day()
+            last_check = time.time()
+        if time.time() - last_metrics >= metrics_period:
+            last_metrics = time.time()
+            send_metrics(metrics, 'writer')
+    logger.close()
+    send_metrics(metrics, 'writer')
+    dprint('pipeline: writer stored {} records'.format(calls))
+    flush()
+
+class Pipeline(object):
+
+    QUEUE_SIZE = 64		# batches between the decoder & the writer
+    BATCH_SIZE = 512		# frames taken from a ring at once
+    DAY_CHECK_PERIOD = 1.0
+    STATS_PERIOD = 60.0
+    METRICS_PERIOD = 1.0
+    METRICS_QUEUE_SIZE = 16
+    JOIN_TIMEOUT = 30.0
+
+    # The logger factory is called in the writer process. With a baud rate
+    # the receivers are asked for the binary frames at it.
+    def __init__(self, addresses, logger_factory, ring_size=FrameRing.SIZE,
+                 queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, baud=None):
+        assert addresses
+        self.__ctx = multiprocessing.get_context('fork')
+        self.addresses = addresses
+        self.baud = baud
+        self.batch_size = batch_size
+        self.__logger_factory = logger_factory
+        self.__stop = self.__ctx.Event()
+        self.rings = [FrameRing(size=ring_size) for _ in addresses]
+        self.__batches = self.__ctx.Queue(queue_size)
+        self.__metrics = self.__ctx.Queue(self.METRICS_QUEUE_SIZE)
+        self.__modes = [(SerialPort.SERIAL_BAUD, False) for _ in addresses]
+        self.__frames = [[] for _ in addresses]
+        self.readers = []
+        self.decoder = None
+        self.writer = None
+
+    # The readers open the ports in the mode agreed here. The data frames
+    # that came before OKE go first into the rings.
+    def init(self):
+        results = handshake_addresses(self.addresses, baud=self.baud)
+        self.__modes = [(r.baud, r.binary) for r in results]
+        self.__frames = [r.frames for r in results]
+        return all(r.ok for r in results)
+
+    def start(self):
+        for ring, frames in zip(self.rings, self.__frames):
+            for frame in frames:
+                ring.put(frame)
+        self.__frames = [[] for _ in self.addresses]
+        ctx = self.__ctx
+        self.readers = [ctx.Process(target=reader_main, name='reader-{}'.format(address),
+                                    args=(address, ring.name, self.__stop, baud, binary))
+                        for address, ring, (baud, binary) in zip(self.addresses, self.rings,
+                                                                  self.__modes)]
+        self.decoder = ctx.Process(target=decoder_main, name='decoder',
+                                   args=([r.name for r in self.rings], self.addresses,
+                                         [binary for _, binary in self.__modes],
+                                         self.__batches, self.batch_size, self.STATS_PERIOD,
+                                         self.__metrics, self.METRICS_PERIOD))
+        self.writer = ctx.Process(target=writer_main, name='writer',
+                                  args=(self.__logger_factory, self.__batches,
+                                        self.DAY_CHECK_PERIOD, self.__metrics,
+                                        self.METRICS_PERIOD))
+        self.writer.start()
+        self.decoder.start()
+        for p in self.readers:
+            p.start()
+
+    def load_metrics(self):
+        while True:
+            try:
+                source, state = self.__metrics.get_nowait()
+            except queue.Empty:
+                return
+            METRICS.load(source, state)
+
+    def listen(self):
+        self.start()
+        try:
+            while self.decoder.is_alive() and self.writer.is_alive():
+                if not any(p.is_alive() for p in self.readers):
+                    break
+                self.load_metrics()
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            dprint('keyboard interrupt. draining the pipeline...')
+            flush()
+        finally:
+            self.stop()
+
+    # Readers stop first, then the decoder drains the rings and the writer
+    # drains the queue & closes the logger
+    def stop(self):
+        self.__stop.set()
+        for p in self.readers + [self.decoder, self.writer]:
+            p.join(self.JOIN_TIMEOUT)
+            if p.is_alive():
+                warning('pipeline: {} did not stop, terminating', p.name)
+                p.terminate()
+            # the final states may still wait in the queue
+            self.load_metrics()
+        for ring in self.rings:
+            ring.close()
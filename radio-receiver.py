@@ -16,16 +16,21 @@ import microbit as m # pylint: disable=import-error
 DEVICE = 'Z'
 
 RECV_TIMEOUT = 10
+RADIO_QUEUE = 8
+SACK_BITS = 16
 
 CMD_GET_TIME = 'GET_TIME'
 CMD_DATA_START = 'DATA_START'
 CMD_DATA_VECTOR = 'DATA_VECT'
 CMD_DATA_END = 'DATA_END'
 CMD_DATA_RESET = 'DATA_RESET'
+CMD_DATA_ACK = 'DATA_ACK'
 
 start_time = time.ticks_ms() # pylint: disable=no-member
 global_time = 1001
 receiving = {}
+finished = set()
+acks = set()
 
 def send_command(todev, cmd_name, *cmd_args):
     cmd_string = '{} {} {}'.format(todev, cmd_name, ' '.join(map(str, cmd_args)))
@@ -35,8 +40,8 @@ def save_data(device, data):
     timestamp = time.ticks_ms() # pylint: disable=no-member
     filename = '{}-{}-{}.txt'.format(device, data['data_type'], timestamp)
     f = open(filename, 'w')
-    for dline in data['data']:
-        f.write("{}\n".format(' '.join(map(str, dline))))
+    for seq in range(data['size']):
+        f.write("{}\n".format(' '.join(map(str, data['data'][seq]))))
     f.close()
 
 def info(s):
@@ -51,64 +56,96 @@ def remove_files():
     for f in ll:
         os.remove(f)
 
+# Cumulative ack: the next seq waited for & the SACK_BITS vectors after it
+def ack_vectors(fromdev):
+    r = receiving[fromdev]
+    bits = 0
+    for i in range(SACK_BITS):
+        if r['next'] + 1 + i in r['data']:
+            bits |= 1 << i
+    send_command(fromdev, CMD_DATA_ACK, r['next'], bits)
+
+def process_message(msg):
+    args = msg.strip().split(' ')
+    if len(args) < 2:
+        error('bad incoming message "{}"'.format(msg))
+        return
+    fromdev = args[0]
+    cmd = args[1]
+    if cmd == CMD_GET_TIME:
+        info('from {} cmd {}'.format(fromdev, cmd))
+        t = time.ticks_ms() # pylint: disable=no-member
+        send_command(fromdev, CMD_GET_TIME, global_time + t - start_time)
+    elif cmd == CMD_DATA_START:
+        info('from {} cmd {}'.format(fromdev, cmd))
+        if len(args) != 4:
+            error('bad incoming command "{}" - bad args'.format(msg))
+        else:
+            # a repeated start means the ack was lost
+            receiving[fromdev] = {
+                'data': {},
+                'data_type': args[2],
+                'size': int(args[3]),
+                'next': 0
+            }
+            finished.discard(fromdev)
+            send_command(fromdev, CMD_DATA_START)
+    elif cmd == CMD_DATA_VECTOR:
+        if fromdev not in receiving:
+            error('bad incoming command "{}" - not receiving'.format(msg))
+        elif len(args) < 4:
+            error('bad incoming command "{}" - bad args'.format(msg))
+        else:
+            r = receiving[fromdev]
+            seq = int(args[2])
+            if r['next'] <= seq <= r['next'] + SACK_BITS and seq not in r['data']:
+                d = []
+                for a in args[3:]:
+                    if a.find('.') >= 0:
+                        d.append(float(a))
+                    else:
+                        d.append(int(a))
+                r['data'][seq] = d
+                while r['next'] in r['data']:
+                    r['next'] += 1
+            # duplicates are acked too, their ack may have been lost
+            acks.add(fromdev)
+    elif cmd == CMD_DATA_END:
+        if fromdev in finished:
+            send_command(fromdev, CMD_DATA_END)
+        elif fromdev not in receiving:
+            error('bad incoming command "{}" - not receiving'.format(msg))
+        elif receiving[fromdev]['next'] < receiving[fromdev]['size']:
+            ack_vectors(fromdev)
+        else:
+            r = receiving[fromdev]
+            save_data(fromdev, r)
+            info('received from {} {} {}'.format(fromdev, r['data_type'], r['size']))
+            send_command(fromdev, CMD_DATA_END)
+            del receiving[fromdev]
+            finished.add(fromdev)
+    elif cmd == CMD_DATA_RESET:
+        if fromdev not in receiving:
+            error('bad incoming command "{}" - not receiving'.format(msg))
+        else:
+            info('reset {}'.format(fromdev))
+            del receiving[fromdev]
+            send_command(fromdev, CMD_DATA_RESET)
+    elif cmd != CMD_DATA_ACK:
+        error('bad command name "{}"'.format(cmd))
+
 debug(DEVICE)
 remove_files()
 radio.on()
+radio.config(queue=RADIO_QUEUE)
 while True:
+    # the whole queue is taken at once, so one ack covers all the vectors
     msg = radio.receive()
-    if msg:
-        args = msg.strip().split(' ')
-        if not args:
-            error('bad incoming message "{}" args: {}')
-        else:
-            fromdev = args[0]
-            cmd = args[1]
-            info('from {} cmd {}'.format(fromdev, cmd))
-            if cmd == CMD_GET_TIME:
-                t = time.ticks_ms() # pylint: disable=no-member
-                send_command(fromdev, CMD_GET_TIME, global_time + t - start_time)
-            elif cmd == CMD_DATA_START:
-                if len(args) != 4:
-                    error('bad incoming command "{}" - bad args'.format(msg))
-                elif fromdev in receiving:
-                    error('double data start "{}"'.format(msg))
-                else:
-                    receiving[fromdev] = {
-                        'data': [],
-                        'data_type': args[2]
-                    }
-                    send_command(fromdev, CMD_DATA_START)
-            elif cmd == CMD_DATA_VECTOR:
-                if fromdev not in receiving:
-                    error('bad incoming command "{}" - not receiving'.format(msg))
-                elif len(args) < 3:
-                    error('bad incoming command "{}" - bad args'.format(msg))
-                else:
-                    d = []
-                    for a in args[2:]:
-                        if a.find('.') >= 0:
-                            d.append(float(a))
-                        else:
-                            d.append(int(a))
-                    receiving[fromdev]['data'].append(d)
-                    send_command(fromdev, CMD_DATA_VECTOR)
-            elif cmd == CMD_DATA_END:
-                if fromdev not in receiving:
-                    error('bad incoming command "{}" - not receiving'.format(msg))
-                else:
-                    r = receiving[fromdev]
-                    save_data(fromdev, r)
-                    size = len(r['data'])
-                    info('received from {} {} {}'.format(fromdev, r['data_type'], size))
-                    send_command(fromdev, CMD_DATA_END)
-                    del receiving[fromdev]
-            elif cmd == CMD_DATA_RESET:
-                if fromdev not in receiving:
-                    error('bad incoming command "{}" - not receiving'.format(msg))
-                else:
-                    info('reset {}'.format(fromdev))
-                    del receiving[fromdev]
-                    send_command(fromdev, CMD_DATA_RESET)
-            else:
-                error('bad command name "{}"'.format(cmd))
+    while msg:
+        process_message(msg)
+        msg = radio.receive()
+    for dev in acks:
+        if dev in receiving:
+            ack_vectors(dev)
+    acks.clear()
     m.sleep(RECV_TIMEOUT)
@@ -17,12 +17,20 @@ DEVICE = 'A'
 DEFAULT_TRIES = 3
 DEFAULT_TIMEOUT = 1000
 RECV_TIMEOUT = 10
+RADIO_QUEUE = 8
+
+WINDOW = 6			# vectors in flight, fits the receiver radio queue
+RETRANSMIT_TIMEOUT = 200	# ms without an ack before a vector is resent
+DUP_ACKS = 2			# same acks with holes before the fast retransmit
+SACK_BITS = 16
+ACK_POLL = 2			# ms between the ack checks
 
 CMD_GET_TIME = 'GET_TIME'
 CMD_DATA_START = 'DATA_START'
 CMD_DATA_VECTOR = 'DATA_VECT'
 CMD_DATA_END = 'DATA_END'
 CMD_DATA_RESET = 'DATA_RESET'
+CMD_DATA_ACK = 'DATA_ACK'
 
 global_data = [(1,),
                (2, 2),
@@ -38,7 +46,8 @@ def radio_recv(timeout):
     start_time = t = time.ticks_ms() # pylint: disable=no-member
     while t - start_time < timeout:
         msg = radio.receive()
-        if msg:
+        # late acks of the data window are not answers
+        if msg and msg.split(' ')[1:2] != [CMD_DATA_ACK]:
             return msg
         m.sleep(RECV_TIMEOUT)
         t = time.ticks_ms() # pylint: disable=no-member
@@ -64,6 +73,57 @@ def send_command(cmd, *args):
         result = (False, 'send timeout')
     return result
 
+def send_vector(seq, d):
+    radio.send('{} {} {} {}'.format(DEVICE, CMD_DATA_VECTOR, seq, ' '.join(map(str, d))))
+
+# Keeps up to WINDOW vectors in flight. The receiver acks the next seq it
+# waits for & a bitmap of the SACK_BITS vectors after it that it already has.
+def send_vectors(data):
+    base = next_seq = dups = 0
+    sent_at = {}
+    sacked = set()
+    progress = time.ticks_ms() # pylint: disable=no-member
+    while base < len(data):
+        t = time.ticks_ms() # pylint: disable=no-member
+        if t - progress >= DEFAULT_TIMEOUT * DEFAULT_TRIES:
+            return (False, 'send timeout')
+        for seq in range(base, next_seq):
+            if seq not in sacked and t - sent_at[seq] >= RETRANSMIT_TIMEOUT:
+                send_vector(seq, data[seq])
+                sent_at[seq] = t
+        while next_seq < len(data) and next_seq < base + WINDOW:
+            send_vector(next_seq, data[next_seq])
+            sent_at[next_seq] = t
+            next_seq += 1
+        msg = radio.receive()
+        while msg:
+            args = msg.strip().split(' ')
+            if len(args) == 4 and args[0] == DEVICE and args[1] == CMD_DATA_ACK:
+                cum = int(args[2])
+                bits = int(args[3])
+                for i in range(SACK_BITS):
+                    if bits >> i & 1:
+                        sacked.add(cum + 1 + i)
+                if cum > base:
+                    for seq in range(base, cum):
+                        sent_at.pop(seq, None)
+                        sacked.discard(seq)
+                    base = cum
+                    dups = 0
+                    progress = t
+                elif cum == base and bits:
+                    dups += 1
+                    if dups >= DUP_ACKS:
+                        # resend the holes below the last vector received
+                        for seq in range(base, max(sacked)):
+                            if seq not in sacked:
+                                send_vector(seq, data[seq])
+                                sent_at[seq] = t
+                        dups = 0
+            msg = radio.receive()
+        m.sleep(ACK_POLL)
+    return (True, [])
+
 def get_time():
     radio.on()
     status, args = send_command(CMD_GET_TIME)
@@ -81,10 +141,7 @@ def send_data(typ, data):
     res = send_command(CMD_DATA_START, typ, len(data))
     if res[0]:
         debug('1')
-        for d in data:
-            res = send_command(CMD_DATA_VECTOR, ' '.join(map(str, d)))
-            if not res[0]:
-                break
+        res = send_vectors(data)
         debug('2')
         if res[0]:
             res = send_command(CMD_DATA_END)
@@ -97,6 +154,7 @@ def send_data(typ, data):
     radio.off()
     return False
 
+radio.config(queue=RADIO_QUEUE)
 debug(DEVICE)
 while True:
     if m.button_a.was_pressed():
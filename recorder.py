@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: serial stream recorder & replayer
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import pty
+import tty
+import time
+import struct
+import binascii
+import tempfile
+from serialport import SerialException
+from serialprotocol import SerialProtocol
+from framer import SerialFramer, BinaryFramer
+from logger import EventLogger
+from uploader import NullUploader
+import decoder
+from debug import dprint
+
+RECORD_MAGIC = b'HMSTREC1'
+# start time of the recording
+RECORD_HEADER = struct.Struct('<d')
+# offset from the start in microseconds, chunk length
+CHUNK_HEADER = struct.Struct('<QH')
+MAX_CHUNK = 0xffff
+# a zero length chunk is a port mode change: baud rate, binary frames
+MODE_RECORD = struct.Struct('<IB')
+
+class StreamRecorder(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.start = time.time()
+        self.__f = open(path, 'wb')
+        self.__f.write(RECORD_MAGIC + RECORD_HEADER.pack(self.start))
+
+    def record(self, data, t=None):
+        if not data:
+            return
+        if t is None:
+            t = time.time()
+        offset = int((t - self.start) * 1000000)
+        for i in range(0, len(data), MAX_CHUNK):
+            chunk = data[i:i + MAX_CHUNK]
+            self.__f.write(CHUNK_HEADER.pack(offset, len(chunk)))
+            self.__f.write(chunk)
+
+    def set_mode(self, baud, binary, t=None):
+        if t is None:
+            t = time.time()
+        offset = int((t - self.start) * 1000000)
+        self.__f.write(CHUNK_HEADER.pack(offset, 0))
+        self.__f.write(MODE_RECORD.pack(baud, binary))
+
+    def close(self):
+        if self.__f is not None:
+            self.__f.close()
+            self.__f = None
+
+class StreamReader(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.__f = open(path, 'rb')
+        magic = self.__f.read(len(RECORD_MAGIC))
+        if magic != RECORD_MAGIC:
+            self.__f.close()
+            raise SerialException('bad recording file {}'.format(path))
+        self.start = RECORD_HEADER.unpack(self.__f.read(RECORD_HEADER.size))[0]
+        self.baud = None
+        self.binary = False
+
+    # yields (offset in seconds, chunk); a port mode change yields a None
+    # chunk after baud & binary are updated
+    def __iter__(self):
+        while True:
+            header = self.__f.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                break
+            offset, size = CHUNK_HEADER.unpack(header)
+            if not size:
+                mode = self.__f.read(MODE_RECORD.size)
+                if len(mode) < MODE_RECORD.size:
+                    break
+                self.baud, binary = MODE_RECORD.unpack(mode)
+                self.binary = bool(binary)
+                yield offset / 1000000.0, None
+                continue
+            data = self.__f.read(size)
+            if len(data) < size:
+                break
+            yield offset / 1000000.0, data
+
+    def close(self):
+        self.__f.close()
+
+class StreamClock(object):
+
+    # speed 0 replays as fast as possible
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.__start = None
+
+    def wait(self, offset):
+        if not self.speed:
+            return
+        if self.__start is None:
+            self.__start = time.time() - offset / self.speed
+        delay = self.__start + offset / self.speed - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+class FakeSerialPort(object):
+
+    def __init__(self, path, speed=0):
+        self.device = path
+        self.reader = StreamReader(path)
+        self.clock = StreamClock(speed)
+        self.baud = None
+        self.binary = False
+        self.framer = SerialFramer()
+        self.sent = []
+        self.__chunks = iter(self.reader)
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+    # follows the mode changes of the recorded port
+    def set_mode(self, baud, binary):
+        self.baud = baud
+        self.binary = binary
+        self.framer = BinaryFramer() if binary else SerialFramer()
+
+    def read_available(self):
+        while True:
+            try:
+                offset, data = next(self.__chunks)
+            except StopIteration:
+                raise SerialException('end of recording {}'.format(self.device))
+            self.clock.wait(offset)
+            if data is not None:
+                return data
+            self.set_mode(self.reader.baud, self.reader.binary)
+
+    def read_frames(self):
+        self.framer.feed(self.read_available())
+        return self.framer.frames()
+
+    def readline(self):
+        return ''
+
+    def close(self):
+        self.reader.close()
+
+def replay_to_pty(path, speed=1.0, wait=None):
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    dprint('replaying {} to {}'.format(path, os.ttyname(slave)))
+    if wait is not None:
+        wait()
+    reader = StreamReader(path)
+    clock = StreamClock(speed)
+    try:
+        for offset, data in reader:
+            clock.wait(offset)
+            if data is None:
+                # the listener on the pty cannot follow the switch
+                if reader.binary:
+                    raise SerialException('{} switches to binary frames, '
+                                          'use ingest or decode'.format(path))
+                continue
+            os.write(master, data)
+    finally:
+        reader.close()
+    dprint('recording finished')
+    return master, slave
+
+def ingest(path, speed=0):
+    sport = FakeSerialPort(path, speed)
+    logger = EventLogger(tempfile.mkdtemp(), uploader=NullUploader())
+    protocol = SerialProtocol(sport, logger)
+    frames = 0
+    start = time.time()
+    try:
+        while True:
+            for frame in sport.read_frames():
+                protocol.process_frame(frame)
+                frames += 1
+    except SerialException:
+        pass
+    protocol.save_state()
+    return frames, time.time() - start
+
+# Binary frames carry the raw payloads, text ones carry them in hex
+def decode_recording(path):
+    reader = StreamReader(path)
+    framer = SerialFramer()
+    payloads = []
+    for _, data in reader:
+        if data is None:
+            framer = BinaryFramer() if reader.binary else SerialFramer()
+            continue
+        framer.feed(data)
+        for frame in framer.frames():
+            if bytes(frame[0:3]) in (b'LOG', b'EVN'):
+                payload = bytes(frame[4:])
+                if not reader.binary:
+                    try:
+                        payload = binascii.unhexlify(payload)
+                    except (ValueError, binascii.Error):
+                        continue
+                if len(payload) == decoder.PAYLOAD_SIZE:
+                    payloads.append(payload)
+    reader.close()
+    return decoder.decode_batch(b''.join(payloads))
+
+def usage():
+    dprint('Hamster serial stream recorder')
+    dprint('Usage: {} <command> [args]'.format(sys.argv[0]))
+    dprint('Commands:')
+    dprint('\treplay <file> [speed]\tReplay the recording to a new pty '
+           '(speed 1 - real time, 0 - as fast as possible)')
+    dprint('\tingest <file> [speed]\tFeed the recording through the protocol & logger')
+    dprint('\tdecode <file>\tBatch decode all LOG/EVN payloads of the recording')
+    exit(1)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or len(sys.argv) > 4:
+        usage()
+    command = sys.argv[1]
+    filename = sys.argv[2]
+    replay_speed = 1.0
+    if len(sys.argv) == 4:
+        try:
+            replay_speed = float(sys.argv[3])
+        except ValueError:
+            usage()
+    try:
+        if command == 'replay':
+            replay_to_pty(filename, replay_speed,
+                          lambda: (dprint('press Enter to start'), sys.stdin.readline()))
+            dprint('press Ctrl-C to close the pty')
+            while True:
+                time.sleep(1)
+        elif command == 'ingest':
+            if len(sys.argv) < 4:
+                replay_speed = 0
+            total, elapsed = ingest(filename, replay_speed)
+            dprint('{} frames in {:.3f} sec, {:.0f} frames/sec'.format(total, elapsed,
+                                                                      total / max(elapsed, 1e-9)))
+        elif command == 'decode':
+            result = decode_recording(filename)
+            dprint('{} payloads, {} bad checksums'.format(len(result),
+                                                         int((~result['checksum_ok']).sum())))
+        else:
+            usage()
+    except KeyboardInterrupt:
+        pass
+    except SerialException as e:
+        dprint('error: {}'.format(e))
+        exit(1)
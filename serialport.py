@@ -9,6 +9,7 @@
 # -----------------------------------------------------------------------------
 
 import serial
+from framer import SerialFramer, BinaryFramer
 
 class SerialException(Exception):
     def __init__(self, msg):
@@ -21,10 +22,13 @@ class SerialPort(object):
 
     SERIAL_BAUD = 115200
 
-    def __init__(self, dev, baud=SERIAL_BAUD):
+    def __init__(self, dev, baud=SERIAL_BAUD, recorder=None, binary=False):
         self.device = dev
         self.baud = baud
+        self.recorder = recorder
         self.s = None
+        self.binary = binary
+        self.framer = BinaryFramer() if binary else SerialFramer()
         self.init()
 
     def init(self):
@@ -53,6 +57,29 @@ class SerialPort(object):
         except serial.serialutil.SerialException as e:
             raise SerialException('error while openinig serial port: ' + str(e))
 
+    # Switches to the COBS frames at the baud rate agreed with the receiver
+    # or back to the text lines. The bytes buffered at the old rate are
+    # dropped, the ones being sent are let out first.
+    def set_mode(self, baud, binary):
+        assert self.s is not None
+        self.baud = baud
+        self.binary = binary
+        self.framer = BinaryFramer() if binary else SerialFramer()
+        if self.recorder is not None:
+            self.recorder.set_mode(baud, binary)
+        try:
+            self.s.flush()
+            self.s.baudrate = baud
+            self.s.reset_input_buffer()
+        except serial.serialutil.SerialException as e:
+            raise SerialException('error while setting serial port baud rate: ' + str(e))
+
+    def set_binary(self, baud):
+        self.set_mode(baud, True)
+
+    def set_text(self):
+        self.set_mode(self.SERIAL_BAUD, False)
+
     def send(self, msg):
         assert self.s is not None
         if not self.s.isOpen():
@@ -67,11 +94,51 @@ class SerialPort(object):
         if not self.s.isOpen():
             self.reset()
         try:
-            return str(self.s.readline(), 'utf-8')
+            line = self.s.readline()
+        except serial.serialutil.SerialException as e:
+            raise SerialException('error while reading serial port: ' + str(e))
+        if self.recorder is not None:
+            self.recorder.record(line)
+        return str(line, 'utf-8')
+
+    def read_frames(self):
+        assert self.s is not None
+        if not self.s.isOpen():
+            self.reset()
+        try:
+            waiting = self.s.in_waiting
+            # block for up to the port timeout when idle
+            data = self.s.read(waiting if waiting else 1)
+        except serial.serialutil.SerialException as e:
+            raise SerialException('error while reading serial port: ' + str(e))
+        if data:
+            if self.recorder is not None:
+                self.recorder.record(data)
+            self.framer.feed(data)
+        return self.framer.frames()
+
+    def fileno(self):
+        assert self.s is not None
+        return self.s.fileno()
+
+    def read_available(self):
+        assert self.s is not None
+        if not self.s.isOpen():
+            self.reset()
+        try:
+            waiting = self.s.in_waiting
+            if not waiting:
+                return b''
+            data = self.s.read(waiting)
         except serial.serialutil.SerialException as e:
             raise SerialException('error while reading serial port: ' + str(e))
+        if self.recorder is not None:
+            self.recorder.record(data)
+        return data
 
     def close(self):
         assert self.s is not None
         self.s.close()
         self.s = None
+        if self.recorder is not None:
+            self.recorder.close()
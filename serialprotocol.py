@@ -9,9 +9,12 @@
 # -----------------------------------------------------------------------------
 
 import time
-import datetime
-from debug import dprint
+import binascii
+from debug import dprint, debug, warning, enabled, record_frame, DEBUG
 from logger import EventLogger
+from metrics import METRICS
+import decoder
+import handshake
 
 class SerialProtocol(object):
 
@@ -27,108 +30,182 @@ class SerialProtocol(object):
     SYSTEM_LINE = 'LIN'
     SYSTEM_EOF = 'EOF'
     SYSTEM_OK = 'OKE'
+    SYSTEM_PACKED = 'LPK'
+    SYSTEM_STATUS = 'STS'
 
-    DATA_BYTES_ORDER = 'little'
+    FRAME_LOG = SYSTEM_LOG.encode()
+    FRAME_EVENT = SYSTEM_EVENT.encode()
+    FRAME_FILE = SYSTEM_FILE.encode()
+    FRAME_LINE = SYSTEM_LINE.encode()
+    FRAME_EOF = SYSTEM_EOF.encode()
+    FRAME_PACKED = SYSTEM_PACKED.encode()
+    FRAME_STATUS = SYSTEM_STATUS.encode()
+    FRAME_NAMES = {FRAME_LOG: SYSTEM_LOG,
+                   FRAME_EVENT: SYSTEM_EVENT,
+                   FRAME_FILE: SYSTEM_FILE,
+                   FRAME_LINE: SYSTEM_LINE,
+                   FRAME_EOF: SYSTEM_EOF,
+                   FRAME_PACKED: SYSTEM_PACKED,
+                   FRAME_STATUS: SYSTEM_STATUS}
 
-    def __init__(self, sport):
+    def __init__(self, sport, logger=None):
         assert sport is not None
         self.state = self.STATE_START
         self.sport = sport
-        self.logger = EventLogger()
-        self.__prev_date = None
-        self.__check_day()
+        if logger is None:
+            logger = EventLogger()
+        self.logger = logger
+        # the next LPK sequence number of every device
+        self.__packed_seq = {}
+        # the last (ticks, received, forwarded, malformed, queue full) of the receiver
+        self.status = None
+        self.check_day()
 
     def init(self):
         assert self.state == self.STATE_START
         dprint('sending start...')
         self.sport.send(self.SYSTEM_START)
-        time.sleep(1)
-
-    def send_time(self, timeout=None):
-        t = time.time()
-        dprint('sending time {}'.format(int(t)))
-        self.sport.send('{} {}'.format(self.SYSTEM_TIME, int(t)))
-        time.sleep(1)
-        line = None
-        start_t = t = time.time()
-        while timeout is None or (t - start_t < timeout):
-            line = self.sport.readline()
-            if line:
-                if line.strip() == self.SYSTEM_OK:
-                    dprint('time ok')
-                    return True
-                else:
-                    dprint('bad line: {}'.format(line))
-            t = time.time()
-        dprint('protocol timeout')
-        return False
-
-    def __check_day(self):
-        dt = datetime.datetime.now()
-        if self.__prev_date is not None:
-            tt1 = self.__prev_date.timetuple()
-            tt2 = dt.timetuple()
-            if tt1[3] < 12 and tt2[3] >= 12:
-                dprint('-' * 80)
-                dprint('starting new day {:02d}.{:02d}'.format(tt2[2], tt2[1]))
-                self.logger.newday()
-        self.__prev_date = dt
+
+    # Waits for OKE as the frames come, resending STA & TIM on a timeout
+    def send_time(self, timeout=None, baud=None):
+        retries = handshake.RETRIES
+        if timeout is not None:
+            retries = max(1, int(timeout / handshake.TIMEOUT))
+        result = handshake.handshake([self.sport], retries=retries, baud=baud)[0]
+        for frame in result.frames:
+            self.process_frame(frame)
+        return result.ok
+
+    def check_day(self):
+        self.logger.check_day()
 
     def listen(self):
         while True:
-            self.__check_day()
-
-            line = self.sport.readline()
-            if line:
-                code = line[0:3]
-                device = line[3:4]
-                rawdata = line[4:].strip()
-                dprint('received {} "{}" from {}...'.format(code, rawdata, device))
-                if code == self.SYSTEM_LOG or code == self.SYSTEM_EVENT:
-                    try:
-                        data = bytes.fromhex(rawdata)
-                    except ValueError:
-                        dprint('bad hex data')
-                        continue
-                    if len(data) != 20:
-                        dprint('bad data size')
-                        continue
-                    ts = int.from_bytes(data[0:4], self.DATA_BYTES_ORDER)
-                    num = int.from_bytes(data[4:6], self.DATA_BYTES_ORDER)
-                    temp1 = int.from_bytes(data[6:8], self.DATA_BYTES_ORDER)
-                    temp2 = int.from_bytes(data[8:12], self.DATA_BYTES_ORDER)
-                    temp = temp1 + float(temp2) / 1000000.0
-                    light1 = int.from_bytes(data[12:14], self.DATA_BYTES_ORDER)
-                    light2 = int.from_bytes(data[14:18], self.DATA_BYTES_ORDER)
-                    light = light1 + float(light2) / 1000000.0
-                    checksum = sum(data[0:18])
-                    remote_cs = int.from_bytes(data[18:20], self.DATA_BYTES_ORDER)
-                    if checksum != remote_cs:
-                        dprint('bad log checksum')
-                    else:
-                        dt = datetime.datetime.now()
-                        dprint('{} received {}: {} {} {} {}'.format(dt.strftime('%H:%M:%S.%f'),
-                                                                    code, ts, num, temp, light))
-                        if code == self.SYSTEM_LOG:
-                            self.logger.summary(device, ts, num, temp, light)
-                        else:
-                            self.logger.event(device, ts, num, temp, light)
-                elif code == self.SYSTEM_FILE:
-                    self.logger.start_log(rawdata)
-                elif code == self.SYSTEM_EOF:
-                    self.logger.finish_log()
-                elif code == self.SYSTEM_LINE:
-                    parts = rawdata.split(' ')
-                    if len(parts) != 4:
-                        dprint('wrong log string')
-                    else:
-                        ts = int(parts[0])
-                        num = int(parts[1])
-                        temp = float(parts[2])
-                        light = float(parts[3])
-                        self.logger.log_data(device, ts, num, temp, light)
+            self.check_day()
+
+            for frame in self.sport.read_frames():
+                self.process_frame(frame)
+
+    def process_frame(self, frame):
+        start = time.perf_counter()
+        self.__process_frame(frame)
+        METRICS.frame_time.observe(time.perf_counter() - start)
+
+    # Binary frames carry the raw payloads, text ones carry them in hex.
+    # The ports without the binary mode (rings, recordings) are text.
+    def __payload(self, rawdata, device):
+        if getattr(self.sport, 'binary', False):
+            return bytes(rawdata)
+        try:
+            return binascii.unhexlify(rawdata)
+        except (ValueError, binascii.Error):
+            METRICS.bad_frames.inc('hex')
+            warning('bad hex data from {}', device)
+            return None
+
+    def __process_frame(self, frame):
+        if len(frame) < 4:
+            if len(frame):
+                METRICS.bad_frames.inc('size')
+                warning('bad frame size')
+            return
+        code = bytes(frame[0:3])
+        device = chr(frame[3])
+        METRICS.frames.inc(self.FRAME_NAMES.get(code, 'other'))
+        # all the receivers send their status as the same device
+        if code != self.FRAME_STATUS:
+            METRICS.last_seen.set(time.time(), device)
+        rawdata = frame[4:]
+        record_frame(frame)
+        if enabled(DEBUG):
+            debug('received {} "{}" from {}...', str(code, 'ascii', 'replace'),
+                  str(rawdata, 'ascii', 'replace'), device)
+        if code == self.FRAME_LOG or code == self.FRAME_EVENT:
+            data = self.__payload(rawdata, device)
+            if data is None:
+                return
+            if len(data) != decoder.PAYLOAD_SIZE:
+                METRICS.bad_frames.inc('data_size')
+                warning('bad data size from {}', device)
+                return
+            ts, num, temp, light, checksum_ok = decoder.decode_payload(data)
+            if not checksum_ok:
+                METRICS.bad_frames.inc('checksum')
+                warning('bad log checksum from {}', device)
+            else:
+                debug('received {} from {}: {} {} {} {}', self.FRAME_NAMES[code], device,
+                      ts, num, temp, light)
+                if code == self.FRAME_LOG:
+                    self.logger.summary(device, ts, num, temp, light)
                 else:
-                    dprint('bad protocol code {}'.format(code))
+                    self.logger.event(device, ts, num, temp, light)
+        elif code == self.FRAME_PACKED:
+            data = self.__payload(rawdata, device)
+            if data is None:
+                return
+            try:
+                seq, records = decoder.decode_packed(data)
+            except decoder.DecoderException as e:
+                METRICS.bad_frames.inc('packed')
+                warning('bad packed log from {}: {}', device, e)
+                return
+            expected = self.__packed_seq.get(device, seq)
+            if seq != expected:
+                METRICS.bad_frames.inc('packed_lost')
+                warning('lost {} packed log packets from {}', (seq - expected) & 0xff, device)
+            self.__packed_seq[device] = (seq + 1) & 0xff
+            for ts, num, temp, light in records:
+                self.logger.log_data(device, ts, num, temp, light)
+        elif code == self.FRAME_STATUS:
+            data = self.__payload(rawdata, device)
+            if data is None:
+                return
+            try:
+                status = decoder.decode_status(data)
+            except decoder.DecoderException as e:
+                METRICS.bad_frames.inc('status')
+                warning('bad status from {}: {}', device, e)
+                return
+            self.__process_status(status)
+        elif code == self.FRAME_FILE:
+            self.__packed_seq.pop(device, None)
+            self.logger.start_log(device, str(rawdata, 'utf-8', 'replace').strip())
+        elif code == self.FRAME_EOF:
+            self.logger.finish_log(device)
+        elif code == self.FRAME_LINE:
+            parts = bytes(rawdata).strip().split(b' ')
+            if len(parts) != 4:
+                METRICS.bad_frames.inc('line')
+                warning('wrong log string from {}', device)
+            else:
+                ts = int(parts[0])
+                num = int(parts[1])
+                temp = float(parts[2])
+                light = float(parts[3])
+                self.logger.log_data(device, ts, num, temp, light)
+        else:
+            warning('bad protocol code {}', str(code, 'ascii', 'replace'))
+
+    # The counters restart with the receiver, so they are compared only
+    # with the status frame from the same run. The in-frame device is the
+    # same for all the receivers, so they are told apart by the port.
+    def __process_status(self, status):
+        port = self.sport.device
+        ticks, received, forwarded, malformed, queue_full = status
+        debug('status of {}: {} received, {} forwarded, {} malformed, {} full queues',
+              port, received, forwarded, malformed, queue_full)
+        last = self.status
+        if last is not None and ticks >= last[0]:
+            if malformed > last[3]:
+                warning('{} malformed radio packets at {}', malformed - last[3], port)
+            if queue_full > last[4]:
+                warning('radio queue of {} was full {} times, packets may be lost',
+                        port, queue_full - last[4])
+        self.status = status
+        METRICS.radio_received.set(received, port)
+        METRICS.radio_forwarded.set(forwarded, port)
+        METRICS.radio_malformed.set(malformed, port)
+        METRICS.radio_queue_full.set(queue_full, port)
 
     def save_state(self):
-        self.logger.save()
+        self.logger.close()
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Day state write-ahead log restore tests: python3 -m unittest test_wal
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+import unittest
+import wal
+from wal import WriteAheadLog
+
+class RestoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.daydir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.daydir)
+
+    def path(self, name):
+        return os.path.join(self.daydir, name)
+
+    def open_wal(self):
+        w = WriteAheadLog(self.daydir)
+        return w, w.restore()
+
+    def write_events(self, w, store, device, count, start=0):
+        for i in range(start, start + count):
+            w.event(device, 1000.0 + i, i, i + 1, 20.5, 0.25)
+            store.event(device, 1000.0 + i, i + 1)
+
+    def test_replay(self):
+        w, store = self.open_wal()
+        self.write_events(w, store, 'A', 5)
+        w.summary('B', 2000.0, 10, 1, 21.0, 0.5)
+        w.close()
+        w, restored = self.open_wal()
+        self.assertEqual(list(restored.events['A']), list(store.events['A']))
+        self.assertEqual(list(restored.summaries['B'].ts), [10])
+        self.assertEqual(w.records, 6)
+        w.close()
+
+    def test_snapshot_and_log(self):
+        w, store = self.open_wal()
+        self.write_events(w, store, 'A', 5)
+        w.snapshot(store)
+        self.write_events(w, store, 'A', 3, 5)
+        w.close()
+        w, restored = self.open_wal()
+        self.assertEqual(w.generation, 1)
+        self.assertEqual(len(restored.events['A']), 8)
+        self.assertEqual(w.records, 3)
+        w.close()
+
+    def test_torn_tail(self):
+        w, store = self.open_wal()
+        self.write_events(w, store, 'A', 4)
+        w.close()
+        f = open(self.path(wal.WAL_NAME), 'r+b')
+        f.seek(0, os.SEEK_END)
+        f.truncate(f.tell() - wal.RECORD_SIZE // 2)
+        f.close()
+        w, restored = self.open_wal()
+        self.assertEqual(len(restored.events['A']), 3)
+        # the log goes on after the last good record
+        self.write_events(w, restored, 'A', 1, 3)
+        w.close()
+        w, restored = self.open_wal()
+        self.assertEqual(len(restored.events['A']), 4)
+        w.close()
+
+    def test_broken_record(self):
+        w, store = self.open_wal()
+        self.write_events(w, store, 'A', 4)
+        w.close()
+        offset = len(wal.WAL_MAGIC) + wal.FILE_HEADER.size + 2 * wal.RECORD_SIZE
+        f = open(self.path(wal.WAL_NAME), 'r+b')
+        f.seek(offset + 3)
+        f.write(b'\xff')
+        f.close()
+        w, restored = self.open_wal()
+        self.assertEqual(len(restored.events['A']), 2)
+        w.close()
+        self.assertEqual(os.path.getsize(self.path(wal.WAL_NAME)), offset)
+
+    def test_corrupt_snapshot_drops_later_log(self):
+        w, store = self.open_wal()
+        self.write_events(w, store, 'A', 5)
+        w.snapshot(store)
+        self.write_events(w, store, 'A', 3, 5)
+        w.close()
+        f = open(self.path(wal.SNAP_NAME), 'r+b')
+        f.seek(len(wal.SNAP_MAGIC) + wal.FILE_HEADER.size + 1)
+        f.write(b'\xff')
+        f.close()
+        w, restored = self.open_wal()
+        # the 3 records since the snapshot are not the whole day
+        self.assertEqual(len(restored.events), 0)
+        self.assertEqual(w.records, 0)
+        w.close()
+        self.assertTrue(os.path.exists(self.path(wal.SNAP_NAME) + '.bad'))
+        self.assertTrue(os.path.exists(self.path(wal.WAL_NAME) + '.bad'))
+
+    def test_corrupt_snapshot_replays_first_log(self):
+        w, store = self.open_wal()
+        self.write_events(w, store, 'A', 5)
+        w.close()
+        f = open(self.path(wal.SNAP_NAME), 'wb')
+        f.write(b'garbage')
+        f.close()
+        w, restored = self.open_wal()
+        self.assertEqual(len(restored.events['A']), 5)
+        w.close()
+
+    def test_missing_snapshot_drops_later_log(self):
+        w, store = self.open_wal()
+        self.write_events(w, store, 'A', 5)
+        w.snapshot(store)
+        self.write_events(w, store, 'A', 2, 5)
+        w.close()
+        os.remove(self.path(wal.SNAP_NAME))
+        w, restored = self.open_wal()
+        self.assertEqual(len(restored.events), 0)
+        w.close()
+
+    def test_older_log_is_ignored(self):
+        w, store = self.open_wal()
+        self.write_events(w, store, 'A', 5)
+        w.close()
+        f = open(self.path(wal.WAL_NAME), 'rb')
+        old_log = f.read()
+        f.close()
+        w, store = self.open_wal()
+        w.snapshot(store)
+        w.close()
+        # a crash between the snapshot & the new log leaves the old log
+        f = open(self.path(wal.WAL_NAME), 'wb')
+        f.write(old_log)
+        f.close()
+        w, restored = self.open_wal()
+        self.assertEqual(w.generation, 1)
+        self.assertEqual(len(restored.events['A']), 5)
+        w.close()
+        self.assertFalse(os.path.exists(self.path(wal.WAL_NAME) + '.bad'))
+
+if __name__ == '__main__':
+    unittest.main()
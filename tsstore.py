@@ -0,0 +1,388 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: indexed time-series store
+#
+# Every device & day has a partition per record kind:
+#   <root>/<device hex code>/<YYYY-MM-DD>.<kind>	fixed-width records
+#   <root>/<device hex code>/<YYYY-MM-DD>.<kind>.idx	(min, max) local time
+#                                                       of every full block
+# Records are appended in arrival order. Reads mmap the partition and only
+# look at the blocks the sparse index selects.
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import mmap
+import struct
+import datetime
+from debug import dprint
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+KIND_EVENT = 'evn'
+KIND_SUMMARY = 'sum'
+KINDS = (KIND_EVENT, KIND_SUMMARY)
+
+# local_ts, ts, num, temp, light
+RECORD = struct.Struct('<dIIdd')
+RECORD_SIZE = RECORD.size
+INDEX_ENTRY = struct.Struct('<dd')
+BLOCK_RECORDS = 512
+DAY_FORMAT = '%Y-%m-%d'
+
+if np is not None:
+    DTYPE = np.dtype([('local_ts', '<f8'),
+                      ('ts', '<u4'),
+                      ('num', '<u4'),
+                      ('temp', '<f8'),
+                      ('light', '<f8')])
+    INDEX_DTYPE = np.dtype([('min', '<f8'), ('max', '<f8')])
+    assert DTYPE.itemsize == RECORD_SIZE
+
+class TSStoreException(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+
+def device_dir(device):
+    return '{:02x}'.format(ord(device))
+
+def day_bounds(local_ts):
+    day = datetime.date.fromtimestamp(local_ts)
+    start = time.mktime(day.timetuple())
+    end = time.mktime((day + datetime.timedelta(days=1)).timetuple())
+    return day.strftime(DAY_FORMAT), start, end
+
+class PartitionWriter(object):
+
+    def __init__(self, path, start, end):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.__min = self.__max = None
+        self.__count = self.__check(path)
+        self.__f = open(path, 'ab')
+        self.__idx = open(path + '.idx', 'ab')
+        tail = self.__count % BLOCK_RECORDS
+        if tail:
+            # continue the block the previous run did not finish
+            f = open(path, 'rb')
+            f.seek((self.__count - tail) * RECORD_SIZE)
+            data = f.read(tail * RECORD_SIZE)
+            f.close()
+            for (local_ts, _, _, _, _) in RECORD.iter_unpack(data):
+                self.__update(local_ts)
+
+    # The two files are flushed separately, so after a crash the data may
+    # end with a torn record & the index may miss or have extra entries.
+    # Both are made to match before anything is appended.
+    @staticmethod
+    def __check(path):
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        count = size // RECORD_SIZE
+        if size % RECORD_SIZE:
+            dprint('{}: dropping a torn record'.format(path))
+            f = open(path, 'r+b')
+            f.truncate(count * RECORD_SIZE)
+            f.close()
+        idxpath = path + '.idx'
+        idxsize = os.path.getsize(idxpath) if os.path.exists(idxpath) else 0
+        blocks = count // BLOCK_RECORDS
+        if idxsize != blocks * INDEX_ENTRY.size:
+            dprint('{}: rebuilding the index of {} blocks'.format(path, blocks))
+            entries = []
+            if blocks:
+                f = open(path, 'rb')
+                for _ in range(blocks):
+                    stamps = [r[0] for r in RECORD.iter_unpack(f.read(BLOCK_RECORDS * RECORD_SIZE))]
+                    entries.append(INDEX_ENTRY.pack(min(stamps), max(stamps)))
+                f.close()
+            f = open(idxpath, 'wb')
+            f.write(b''.join(entries))
+            f.close()
+        return count
+
+    def __update(self, local_ts):
+        if self.__min is None or local_ts < self.__min:
+            self.__min = local_ts
+        if self.__max is None or local_ts > self.__max:
+            self.__max = local_ts
+
+    def append(self, local_ts, ts, num, temp, light):
+        self.__f.write(RECORD.pack(local_ts, ts, num, temp, light))
+        self.__update(local_ts)
+        self.__count += 1
+        if self.__count % BLOCK_RECORDS == 0:
+            self.__idx.write(INDEX_ENTRY.pack(self.__min, self.__max))
+            self.__min = self.__max = None
+
+    def flush(self):
+        self.__f.flush()
+        self.__idx.flush()
+
+    def close(self):
+        self.__f.close()
+        self.__idx.close()
+
+class TimeSeriesStore(object):
+
+    def __init__(self, root):
+        self.root = root
+        self.__writers = {}
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def __partition_path(self, device, day, kind):
+        return '{}/{}/{}.{}'.format(self.root, device_dir(device), day, kind)
+
+    def __writer(self, device, kind, local_ts):
+        key = (device, kind)
+        w = self.__writers.get(key)
+        if w is not None and w.start <= local_ts < w.end:
+            return w
+        if w is not None:
+            w.close()
+        day, start, end = day_bounds(local_ts)
+        path = self.__partition_path(device, day, kind)
+        if not os.path.exists(os.path.dirname(path)):
+            os.mkdir(os.path.dirname(path))
+        w = PartitionWriter(path, start, end)
+        self.__writers[key] = w
+        return w
+
+    def append(self, kind, device, local_ts, ts, num, temp, light):
+        self.__writer(device, kind, local_ts).append(local_ts, ts, num, temp, light)
+
+    def event(self, device, local_ts, ts, num, temp, light):
+        self.append(KIND_EVENT, device, local_ts, ts, num, temp, light)
+
+    def summary(self, device, local_ts, ts, num, temp, light):
+        self.append(KIND_SUMMARY, device, local_ts, ts, num, temp, light)
+
+    def flush(self):
+        for w in self.__writers.values():
+            w.flush()
+
+    def close(self):
+        for w in self.__writers.values():
+            w.close()
+        self.__writers = {}
+
+    # local times of the records already in the partition of the given time
+    def stored_times(self, device, local_ts, kind=KIND_EVENT):
+        w = self.__writers.get((device, kind))
+        if w is not None:
+            w.flush()
+        day, start, end = day_bounds(local_ts)
+        path = self.__partition_path(device, day, kind)
+        if not os.path.exists(path):
+            return start, end, set()
+        f = open(path, 'rb')
+        data = f.read()
+        f.close()
+        data = data[:len(data) // RECORD_SIZE * RECORD_SIZE]
+        return start, end, set(r[0] for r in RECORD.iter_unpack(data))
+
+    def devices(self):
+        result = []
+        for name in sorted(os.listdir(self.root)):
+            try:
+                result.append(chr(int(name, 16)))
+            except ValueError:
+                pass
+        return result
+
+    def days(self, device, kind=KIND_EVENT):
+        path = '{}/{}'.format(self.root, device_dir(device))
+        if not os.path.exists(path):
+            return []
+        postfix = '.' + kind
+        return sorted(name[:-len(postfix)] for name in os.listdir(path)
+                      if name.endswith(postfix))
+
+    def __read_partition(self, path, start, end):
+        size = os.path.getsize(path)
+        count = size // RECORD_SIZE
+        if not count:
+            return np.empty(0, DTYPE)
+        f = open(path, 'rb')
+        try:
+            mm = mmap.mmap(f.fileno(), count * RECORD_SIZE, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        records = np.frombuffer(mm, DTYPE, count)
+        index = np.empty(0, INDEX_DTYPE)
+        if os.path.exists(path + '.idx'):
+            index = np.fromfile(path + '.idx', INDEX_DTYPE)
+        blocks = min(len(index), count // BLOCK_RECORDS)
+        parts = []
+        selected = np.nonzero((index['max'][:blocks] >= start) &
+                              (index['min'][:blocks] < end))[0]
+        # neighbouring blocks are read as one slice
+        if len(selected):
+            breaks = np.nonzero(np.diff(selected) != 1)[0] + 1
+            for run in np.split(selected, breaks):
+                parts.append(records[run[0] * BLOCK_RECORDS:(run[-1] + 1) * BLOCK_RECORDS])
+        parts.append(records[blocks * BLOCK_RECORDS:])
+        data = np.concatenate(parts)
+        return data[(data['local_ts'] >= start) & (data['local_ts'] < end)]
+
+    # Records of the device with start <= local_ts < end, sorted by local_ts
+    def query(self, device, start, end, kind=KIND_EVENT):
+        if np is None:
+            raise TSStoreException('numpy is required for the queries')
+        w = self.__writers.get((device, kind))
+        if w is not None:
+            w.flush()
+        first = datetime.date.fromtimestamp(start).strftime(DAY_FORMAT)
+        last = datetime.date.fromtimestamp(end).strftime(DAY_FORMAT)
+        parts = []
+        for day in self.days(device, kind):
+            if first <= day <= last:
+                parts.append(self.__read_partition(self.__partition_path(device, day, kind),
+                                                   start, end))
+        if not parts:
+            return np.empty(0, DTYPE)
+        data = np.concatenate(parts)
+        if len(data) > 1 and np.any(np.diff(data['local_ts']) < 0):
+            data = data[np.argsort(data['local_ts'], kind='stable')]
+        return data
+
+    def count(self, device, start, end, kind=KIND_EVENT):
+        return len(self.query(device, start, end, kind))
+
+    # Revolutions from the cumulative event counter, a device reset
+    # restarts the counter
+    def revolutions(self, device, start, end):
+        num = self.query(device, start, end, KIND_EVENT)['num'].astype(np.int64)
+        if not len(num):
+            return 0
+        diff = np.diff(num)
+        return int(np.where(diff < 0, num[1:], diff).sum()) + 1
+
+    # Applies func (count, sum, mean, min, max, last) to the field in
+    # buckets of the given seconds; returns bucket starts & values
+    def aggregate(self, device, start, end, bucket, kind=KIND_EVENT, field='num', func='count'):
+        data = self.query(device, start, end, kind)
+        buckets = int(np.ceil((end - start) / float(bucket)))
+        starts = start + np.arange(buckets) * float(bucket)
+        idx = ((data['local_ts'] - start) // bucket).astype(np.int64)
+        counts = np.bincount(idx, minlength=buckets)
+        if func == 'count':
+            return starts, counts
+        values = data[field].astype(np.float64)
+        if func in ('sum', 'mean'):
+            sums = np.bincount(idx, values, minlength=buckets)
+            if func == 'sum':
+                return starts, sums
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return starts, sums / counts
+        result = np.full(buckets, np.nan)
+        if func == 'min':
+            np.fmin.at(result, idx, values)
+        elif func == 'max':
+            np.fmax.at(result, idx, values)
+        elif func == 'last':
+            result[idx] = values
+        else:
+            raise TSStoreException('unknown aggregate {}'.format(func))
+        return starts, result
+
+    # Counts the records in the windows [starts[i], starts[i] + length),
+    # e.g. the same hour of every night of a month
+    def count_windows(self, device, starts, length, kind=KIND_EVENT):
+        starts = np.asarray(starts, dtype=np.float64)
+        if not len(starts):
+            return np.zeros(0, np.int64)
+        local_ts = self.query(device, starts.min(), starts.max() + length, kind)['local_ts']
+        return (np.searchsorted(local_ts, starts + length, 'left') -
+                np.searchsorted(local_ts, starts, 'left'))
+
+# Imports the lines with the local times not yet in the store, seen keeps
+# the stored times of the current partition of every device
+def import_day_log(store, f, kind, seen=None):
+    if seen is None:
+        seen = {}
+    imported = 0
+    for line in f:
+        parts = line.split()
+        if len(parts) != 6:
+            continue
+        try:
+            device = parts[1]
+            local_ts = float(parts[0])
+            stored = seen.get(device)
+            if stored is None or not stored[0] <= local_ts < stored[1]:
+                stored = store.stored_times(device, local_ts, kind)
+                seen[device] = stored
+            if local_ts in stored[2]:
+                continue
+            store.append(kind, device, local_ts, int(parts[2]), int(parts[3]),
+                         float(parts[4]), float(parts[5]))
+            stored[2].add(local_ts)
+            imported += 1
+        except ValueError:
+            pass
+    return imported
+
+# The log fragments left by the restarts (events-00.log, events-01.log, ...)
+# come before the log itself
+def day_log_names(names, logname):
+    fragments = []
+    for name in names:
+        if name.startswith(logname + '-') and name.endswith('.log'):
+            postfix = name[len(logname) + 1:-len('.log')]
+            if postfix.isdigit():
+                fragments.append((int(postfix), name))
+    result = [name for _, name in sorted(fragments)]
+    if logname + '.log' in names:
+        result.append(logname + '.log')
+    return result
+
+# Imports the events & summary logs of all the days, archived or not
+def import_datadir(store, datadir):
+    import archiver
+    total = 0
+    for date in archiver.list_days(datadir):
+        names = archiver.list_day_files(datadir, date)
+        for logname, kind in (('events', KIND_EVENT), ('summary', KIND_SUMMARY)):
+            seen = {}
+            for name in day_log_names(names, logname):
+                total += import_day_log(store, archiver.open_day_file(datadir, date, name),
+                                        kind, seen)
+        dprint('imported {}: {} records'.format(date, total))
+    store.close()
+    return total
+
+def usage():
+    dprint('Hamster time-series store')
+    dprint('Usage: {} <command> [args]'.format(sys.argv[0]))
+    dprint('Commands:')
+    dprint('\timport <datadir> <store>\tImport the text day logs into the store')
+    dprint('\tcount <store> <device> <from> <to>\tCount events between '
+           'two times ("YYYY-MM-DD HH:MM")')
+    exit(1)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        usage()
+    command = sys.argv[1]
+    if command == 'import' and len(sys.argv) == 4:
+        import_datadir(TimeSeriesStore(sys.argv[3]), sys.argv[2])
+    elif command == 'count' and len(sys.argv) == 6:
+        try:
+            t1, t2 = (time.mktime(time.strptime(t, '%Y-%m-%d %H:%M')) for t in sys.argv[4:6])
+        except ValueError:
+            usage()
+        s = TimeSeriesStore(sys.argv[2])
+        print('events {} revolutions {}'.format(s.count(sys.argv[3], t1, t2),
+                                                s.revolutions(sys.argv[3], t1, t2)))
+    else:
+        usage()
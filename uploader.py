@@ -0,0 +1,141 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: background sheets uploader
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import queue
+import time
+import threading
+import hamstersheet
+from metrics import METRICS
+from debug import dprint, warning, error
+
+class SheetUploader(object):
+
+    QUEUE_SIZE = 4
+    SHEETS_PATH_TEMPLATE = '{}/sheets.log'
+    CHECKPOINT_PATH_TEMPLATE = '{}/{}/sheet.json'
+
+    def __init__(self, datadir, incremental=False, queue_size=QUEUE_SIZE):
+        self.__datadir = datadir
+        self.incremental = incremental
+        self.__queue_size = queue_size
+        # the latest snapshot waiting for every date, the queue holds the dates
+        self.__snapshots = {}
+        self.__lock = threading.Lock()
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(target=self.__run,
+                                         name='sheet-uploader',
+                                         daemon=True)
+        self.__thread.start()
+        METRICS.queue_depth.track('upload', self.pending)
+
+    # a newer snapshot replaces the waiting one of the same date,
+    # the last snapshot of a date is never dropped
+    def upload(self, date, snapshot):
+        with self.__lock:
+            waiting = date in self.__snapshots
+            self.__snapshots[date] = snapshot
+            if waiting:
+                METRICS.uploads.inc('merged')
+                return True
+            if len(self.__snapshots) > self.__queue_size:
+                warning('{} sheets are waiting for upload', len(self.__snapshots))
+        self.__queue.put(date)
+        return True
+
+    def __take(self, date):
+        with self.__lock:
+            return self.__snapshots.pop(date)
+
+    def pending(self):
+        return self.__queue.qsize()
+
+    def wait(self):
+        if self.__thread.is_alive():
+            self.__queue.join()
+
+    def __save_sheet_address(self, date, sheet):
+        logf = open(self.SHEETS_PATH_TEMPLATE.format(self.__datadir), 'a')
+        logf.write('{} {}\n'.format(date, sheet))
+        logf.close()
+
+    def __load_checkpoint(self, date):
+        path = self.CHECKPOINT_PATH_TEMPLATE.format(self.__datadir, date)
+        if not os.path.exists(path):
+            return None
+        try:
+            f = open(path)
+            checkpoint = json.load(f)
+            f.close()
+            return checkpoint
+        except (OSError, ValueError) as e:
+            warning('bad sheet checkpoint {}: {}', path, e)
+            return None
+
+    def __save_checkpoint(self, date, checkpoint):
+        path = self.CHECKPOINT_PATH_TEMPLATE.format(self.__datadir, date)
+        tmppath = path + '.tmp'
+        f = open(tmppath, 'w')
+        json.dump(checkpoint, f)
+        f.close()
+        os.replace(tmppath, path)
+
+    def __sync(self, date, snapshot):
+        checkpoint = None
+        if self.incremental:
+            checkpoint = self.__load_checkpoint(date)
+        start = time.perf_counter()
+        try:
+            sh = hamstersheet.HamsterSheet(date, snapshot, checkpoint)
+            url = sh.get_url()
+            if checkpoint is None or checkpoint['sheet_id'] != url:
+                dprint('uploaded sheet {}'.format(url))
+                self.__save_sheet_address(date, url)
+            if self.incremental:
+                self.__save_checkpoint(date, sh.get_checkpoint())
+            METRICS.uploads.inc('ok')
+        except hamstersheet.SheetException as e:
+            METRICS.uploads.inc('error')
+            error('error while uploading sheet: {}', e)
+        METRICS.upload_time.observe(time.perf_counter() - start)
+
+    def __run(self):
+        while True:
+            date = self.__queue.get()
+            try:
+                if date is None:
+                    break
+                self.__sync(date, self.__take(date))
+            except Exception as e: # pylint: disable=broad-except
+                error('uploader error: {}', e)
+            finally:
+                self.__queue.task_done()
+
+    def close(self, timeout=None):
+        if not self.__thread.is_alive():
+            return
+        dprint('waiting for {} pending uploads...'.format(self.pending()))
+        self.__queue.put(None)
+        self.__thread.join(timeout)
+
+class NullUploader(object):
+
+    def upload(self, date, snapshot):
+        return True
+
+    def pending(self):
+        return 0
+
+    def wait(self):
+        pass
+
+    def close(self, timeout=None):
+        pass
@@ -0,0 +1,267 @@
+# -----------------------------------------------------------------------------
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# bit4hamster collection
+#
+# Hamster desktop server: write-ahead log & snapshots of the day state
+#
+# Every change of the DayStore is appended to <daydir>/state.wal as a fixed
+# size record with a crc. A snapshot of the whole store replaces the log
+# every SNAPSHOT_RECORDS records, so a restart reads the snapshot and replays
+# at most that many records. Both files carry a generation number: the log
+# is only replayed over the snapshot of the same generation.
+#
+# Author: Alexey Fedoseev <aleksey@fedoseev.net>, 2020
+# -----------------------------------------------------------------------------
+
+import os
+import time
+import zlib
+import struct
+from daystore import DayStore, EventColumn, SummaryColumns
+from debug import dprint, warning, error
+
+WAL_MAGIC = b'HMSTWAL1'
+SNAP_MAGIC = b'HMSTSNP1'
+# generation
+FILE_HEADER = struct.Struct('<Q')
+# type, device, local_ts, ts, num, temp, light
+RECORD = struct.Struct('<BBdIIdd')
+CRC = struct.Struct('<I')
+RECORD_SIZE = RECORD.size + CRC.size
+# kind, device, rows
+SNAP_ENTRY = struct.Struct('<BBI')
+
+REC_EVENT = 1
+REC_SUMMARY = 2
+REC_INSERT = 3
+REC_MERGE_ROW = 4
+REC_MERGE_END = 5
+
+KIND_EVENTS = 1
+KIND_SUMMARY = 2
+
+WAL_NAME = 'state.wal'
+SNAP_NAME = 'state.snap'
+
+class WALException(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+
+def write_file(path, data):
+    tmppath = path + '.tmp'
+    f = open(tmppath, 'wb')
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(tmppath, path)
+
+def encode_snapshot(generation, store):
+    parts = [SNAP_MAGIC, FILE_HEADER.pack(generation)]
+    for device, column in sorted(store.events.items()):
+        parts.append(SNAP_ENTRY.pack(KIND_EVENTS, ord(device), len(column)))
+        parts.append(column.local_ts.tobytes())
+    for device, columns in sorted(store.summaries.items()):
+        parts.append(SNAP_ENTRY.pack(KIND_SUMMARY, ord(device), len(columns)))
+        parts.extend(c.tobytes() for c in columns.columns())
+    data = b''.join(parts)
+    return data + CRC.pack(zlib.crc32(data))
+
+def decode_snapshot(data):
+    if len(data) < len(SNAP_MAGIC) + FILE_HEADER.size + CRC.size or \
+       not data.startswith(SNAP_MAGIC):
+        raise WALException('bad snapshot header')
+    if CRC.unpack_from(data, len(data) - CRC.size)[0] != zlib.crc32(data[:-CRC.size]):
+        raise WALException('bad snapshot checksum')
+    view = memoryview(data)[:-CRC.size]
+    offset = len(SNAP_MAGIC)
+    generation = FILE_HEADER.unpack_from(view, offset)[0]
+    offset += FILE_HEADER.size
+    store = DayStore()
+    while offset < len(view):
+        kind, device, rows = SNAP_ENTRY.unpack_from(view, offset)
+        offset += SNAP_ENTRY.size
+        device = chr(device)
+        if kind == KIND_EVENTS:
+            column = EventColumn()
+            size = rows * column.local_ts.itemsize
+            column.local_ts.frombytes(view[offset:offset + size])
+            offset += size
+            store.events[device] = column
+        elif kind == KIND_SUMMARY:
+            columns = SummaryColumns()
+            for c in columns.columns():
+                size = rows * c.itemsize
+                c.frombytes(view[offset:offset + size])
+                offset += size
+            store.summaries[device] = columns
+        else:
+            raise WALException('bad snapshot entry {}'.format(kind))
+    return generation, store
+
+class WriteAheadLog(object):
+
+    SYNC_NONE = 'none'
+    SYNC_FLUSH = 'flush'
+    SYNC_FSYNC = 'fsync'
+
+    SNAPSHOT_RECORDS = 20000	# the replay window
+    FLUSH_TIME = 1.0		# seconds
+
+    def __init__(self, daydir, sync_policy=SYNC_FLUSH,
+                 snapshot_records=SNAPSHOT_RECORDS, flush_time=FLUSH_TIME):
+        assert sync_policy in (self.SYNC_NONE, self.SYNC_FLUSH, self.SYNC_FSYNC)
+        self.sync_policy = sync_policy
+        self.snapshot_records = snapshot_records
+        self.flush_time = flush_time
+        self.records = 0
+        self.generation = 0
+        self.__wal_path = '{}/{}'.format(daydir, WAL_NAME)
+        self.__snap_path = '{}/{}'.format(daydir, SNAP_NAME)
+        self.__f = None
+        self.__last_flush = time.time()
+
+    # Loads the snapshot & replays the log over it, then opens the log
+    # for appending after the last good record. A log after the first
+    # snapshot only holds the changes since it, so without a good snapshot
+    # it is kept aside instead of being replayed as the whole day.
+    def restore(self):
+        start = time.time()
+        store = DayStore()
+        snap_generation = None
+        if os.path.exists(self.__snap_path):
+            f = open(self.__snap_path, 'rb')
+            data = f.read()
+            f.close()
+            try:
+                snap_generation, store = decode_snapshot(data)
+                self.generation = snap_generation
+            except WALException as e:
+                error('cannot load the day snapshot: {}', e)
+                self.__keep_bad(self.__snap_path)
+                store = DayStore()
+        replayed = 0
+        good_size = None
+        if os.path.exists(self.__wal_path):
+            f = open(self.__wal_path, 'rb')
+            data = f.read()
+            f.close()
+            generation = None
+            if data.startswith(WAL_MAGIC) and len(data) >= len(WAL_MAGIC) + FILE_HEADER.size:
+                generation = FILE_HEADER.unpack_from(data, len(WAL_MAGIC))[0]
+            if generation is None:
+                error('bad day log header, the day state is lost')
+                self.__keep_bad(self.__wal_path)
+            elif generation == (0 if snap_generation is None else snap_generation):
+                self.generation = generation
+                replayed, good_size = self.__replay(store, data)
+            elif snap_generation is None or generation > snap_generation:
+                error('day log of generation {} has no snapshot, the day state is lost',
+                      generation)
+                self.__keep_bad(self.__wal_path)
+            # an older log is already in the snapshot written after it
+        if good_size is None:
+            self.__start_log()
+        else:
+            self.__f = open(self.__wal_path, 'r+b')
+            self.__f.truncate(good_size)
+            self.__f.seek(good_size)
+            self.records = replayed
+        dprint('restored day state: {} devices, {} records replayed in {:.1f} ms'.format(
+            len(set(store.events) | set(store.summaries)), replayed, (time.time() - start) * 1000))
+        return store
+
+    def __keep_bad(self, path):
+        os.replace(path, path + '.bad')
+        warning('{} is kept as {}.bad', path, path)
+
+    def __replay(self, store, data):
+        offset = len(WAL_MAGIC) + FILE_HEADER.size
+        end = len(data) - (len(data) - offset) % RECORD_SIZE
+        replayed = 0
+        merge_rows = {}
+        view = memoryview(data)
+        while offset < end:
+            if (CRC.unpack_from(view, offset + RECORD.size)[0] !=
+                    zlib.crc32(view[offset:offset + RECORD.size])):
+                warning('day log is broken at {}, dropping the tail', offset)
+                break
+            typ, device, local_ts, ts, num, temp, light = RECORD.unpack_from(view, offset)
+            device = chr(device)
+            if typ == REC_EVENT:
+                store.event(device, local_ts, num)
+            elif typ == REC_SUMMARY:
+                store.summary_log(device).append(local_ts, ts, num, temp, light)
+            elif typ == REC_INSERT:
+                store.summary_log(device).insert_sorted(local_ts, ts, num, temp, light)
+            elif typ == REC_MERGE_ROW:
+                merge_rows.setdefault(device, []).append((ts, num, temp, light))
+            elif typ == REC_MERGE_END:
+                store.summary_log(device).merge(local_ts, merge_rows.pop(device, []))
+            offset += RECORD_SIZE
+            replayed += 1
+        # the rows of an unfinished merge are lost with the pending lines
+        return replayed, offset
+
+    def __start_log(self):
+        if self.__f is not None:
+            self.__f.close()
+        write_file(self.__wal_path, WAL_MAGIC + FILE_HEADER.pack(self.generation))
+        self.__f = open(self.__wal_path, 'r+b')
+        self.__f.seek(0, os.SEEK_END)
+        self.records = 0
+
+    def __append(self, typ, device, local_ts, ts=0, num=0, temp=0.0, light=0.0):
+        record = RECORD.pack(typ, ord(device), local_ts, ts, num, temp, light)
+        self.__f.write(record + CRC.pack(zlib.crc32(record)))
+        self.records += 1
+
+    def event(self, device, local_ts, ts, num, temp, light):
+        self.__append(REC_EVENT, device, local_ts, ts, num, temp, light)
+
+    def summary(self, device, local_ts, ts, num, temp, light):
+        self.__append(REC_SUMMARY, device, local_ts, ts, num, temp, light)
+
+    def insert(self, device, local_ts, ts, num, temp, light):
+        self.__append(REC_INSERT, device, local_ts, ts, num, temp, light)
+
+    def merge(self, device, local_ts, rows):
+        for ts, num, temp, light in rows:
+            self.__append(REC_MERGE_ROW, device, local_ts, ts, num, temp, light)
+        self.__append(REC_MERGE_END, device, local_ts)
+
+    def needs_snapshot(self):
+        return self.records >= self.snapshot_records
+
+    def flush(self):
+        if self.__f is None:
+            return
+        self.__f.flush()
+        if self.sync_policy == self.SYNC_FSYNC:
+            os.fsync(self.__f.fileno())
+        self.__last_flush = time.time()
+
+    def poll(self):
+        if self.sync_policy != self.SYNC_NONE and time.time() - self.__last_flush >= self.flush_time:
+            self.flush()
+
+    # The snapshot of the next generation is written first, so a crash
+    # before the new log is started leaves an older log that is ignored
+    def snapshot(self, store):
+        self.generation += 1
+        write_file(self.__snap_path, encode_snapshot(self.generation, store))
+        self.__start_log()
+
+    def close(self):
+        if self.__f is not None:
+            self.flush()
+            self.__f.close()
+            self.__f = None
+
+    # The finished day does not need its state any more
+    def discard(self):
+        self.close()
+        for path in (self.__wal_path, self.__snap_path):
+            if os.path.exists(path):
+                os.remove(path)